@@ -1,5 +1,27 @@
+import importlib
 import os
 os.environ["PYVISA_LIBRARY"] = "@py"
 
-from .sdg6022x import SDG6022X
-from .agilent33600A import Agilent33600A
+# Drivers are imported the first time they are used (pylablib alone takes about a second)
+DRIVERS = {     # { "SDG6022X": ".sdg6022x" }
+    "SDG6022X": ".sdg6022x",
+    "Agilent33600A": ".agilent33600A",
+}
+
+
+def load_driver(name):
+    """Driver class by name, importing its module on first use."""
+    if name not in DRIVERS:
+        raise KeyError(f"Unknown driver '{name}', known drivers are {sorted(DRIVERS)}")
+    return getattr(importlib.import_module(DRIVERS[name], __name__), name)
+
+
+def __getattr__(name):
+    # from Equipment import SDG6022X keeps working, without importing the other drivers
+    if name in DRIVERS:
+        return load_driver(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted([*globals(), *DRIVERS])
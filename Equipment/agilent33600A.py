@@ -1,28 +1,164 @@
 from pylablib.devices import AWG
 import numpy as np
 import time
-from typing import Literal, Annotated, Union, Iterable, TextIO, BinaryIO
+from typing import Literal, Annotated, Union, Iterable, Iterator, TextIO, BinaryIO
+from itertools import islice
 import re
 from pydantic import validate_call, Field, conint, confloat
 import os
-import streamlit as st
+
+from .binblock import BinaryBlock, pack_ahead, terminate_socket_writes, write_block
+from .upload_cache import UploadCache
+from .completion import clear_events, wait_complete
+from .shadow import ShadowMixin, scpi_filter
+from .command_specs import A33_SPECS, ScanPlan
+from .tracing import TraceMixin
+from core import Trace
 
 os.environ["PYVISA_LIBRARY"] = "@py"
 
 ChannelType = Literal[1, 2]
 
-class Agilent33600A(AWG.GenericAWG):
+# Files holding raw little-endian int16 DAC codes
+RAW_DAC_SUFFIXES = ('.bin', '.i16')
+
+
+def _ascii_dac_chunks(f, chunk_size, source):
+    # Parse chunk_size lines at a time so memory stays bounded by the chunk, not the file
+    while lines := list(islice(f, chunk_size)):
+        try:
+            chunk = np.loadtxt(lines, dtype=np.int32, ndmin=1)
+        except Exception as exc:
+            raise ValueError(
+                f"Failed to load DAC waveform from '{source}'. "
+                "File must contain 1D integer ASCII data "
+                "(valid for DATA:ARB:DAC)."
+            ) from exc
+        if chunk.ndim != 1:
+            raise ValueError(
+                f"Waveform data in '{source}' must be 1D, got shape {chunk.shape}."
+            )
+        yield chunk
+
+
+def _raw_dac_chunks(f, chunk_size):
+    while payload := f.read(2 * chunk_size):
+        yield np.frombuffer(payload, dtype='<i2')
+
+
+def _dac_chunks(data, chunk_size):
+    """
+    Yield the waveform in chunks of at most chunk_size DAC codes.
+
+    .npy files are memory mapped and raw int16 files (RAW_DAC_SUFFIXES) mapped
+    with np.memmap, so chunks are slices of the file rather than copies. ASCII
+    files and text streams are parsed chunk by chunk.
+    """
+    name = os.fspath(data) if isinstance(data, (str, os.PathLike)) else getattr(data, 'name', '')
+    suffix = os.path.splitext(str(name))[1].lower()
+
+    if hasattr(data, 'read'):
+        if suffix == '.npy':
+            waveform = np.load(data)
+        elif suffix in RAW_DAC_SUFFIXES:
+            yield from _raw_dac_chunks(data, chunk_size)
+            return
+        else:
+            yield from _ascii_dac_chunks(data, chunk_size, name or data)
+            return
+    elif isinstance(data, (str, os.PathLike)):
+        if suffix == '.npy':
+            waveform = np.load(name, mmap_mode='r')
+        elif suffix in RAW_DAC_SUFFIXES:
+            waveform = np.memmap(name, dtype='<i2', mode='r')
+        else:
+            with open(name) as f:
+                yield from _ascii_dac_chunks(f, chunk_size, name)
+            return
+    elif isinstance(data, Iterator):
+        # Generated piece by piece: regroup into chunk_size chunks
+        pending, count = [], 0
+        for piece in data:
+            piece = np.asarray(piece).ravel()
+            pending.append(piece)
+            count += piece.shape[0]
+            while count >= chunk_size:
+                joined = np.concatenate(pending)
+                yield joined[:chunk_size]
+                pending, count = [joined[chunk_size:]], count - chunk_size
+        if count:
+            yield np.concatenate(pending)
+        return
+    else:
+        waveform = np.asarray(data)
+
+    if waveform.ndim != 1:
+        raise ValueError(f"Waveform data must be 1D, got shape {waveform.shape}.")
+    for start in range(0, waveform.shape[0], chunk_size):
+        yield waveform[start:start + chunk_size]
+
+
+class Agilent33600A(ShadowMixin, TraceMixin, AWG.GenericAWG):
     """
     Driver for Keysight/Agilent 33600A series AWGs with Pydantic validation
     and integrated command registry.
     """
+    MODEL = "33600A"
+    COMMAND_SPECS = A33_SPECS
+    SHADOW_FILTER = staticmethod(scpi_filter)
+    SHADOW_FIELDS = {
+        'waveform': "SOUR:FUNC", 'frequency': "SOUR:FREQ", 'amplitude': "SOUR:VOLT", 'offset': "SOUR:VOLT:OFFS",
+        'burst': "SOUR:BURS:STAT", 'modulation': "SOUR:AM:STAT", 'output': "OUTP", 'load': "OUTP:LOAD",
+    }
 
     def __init__(self, addr, channels_number=2):
         self._channels_number = channels_number
+        self.upload_cache = UploadCache()
+        self._init_shadow()
+        self._status_reporting = False  # *ESE 1;*SRE 32 sent, completion can be serial polled
         super().__init__(addr)
+        self._setup_visa()
+        self._block = BinaryBlock()
+        self._blocks = [self._block]    # buffers recycled by the upload pipeline
+
+    def _setup_visa(self):
         visa_instr = self.instr.instr
         visa_instr.timeout = 10_000
         visa_instr.chunk_size = 4 * 1024 * 1024
+        terminate_socket_writes(self.instr)
+
+    def open(self):
+        # A new connection may be to a power cycled instrument, nothing uploaded before can be trusted
+        self.upload_cache.clear()
+        self.shadow.clear()
+        self._status_reporting = False
+        super().open()
+
+    def reconnect(self, *args, **kwargs):
+        self.upload_cache.clear()
+        self.shadow.clear()
+        self._status_reporting = False
+        super().reconnect(*args, **kwargs)
+        self._setup_visa()      # a reconnect may make a new VISA resource with default settings
+
+    def plan(self, command, rows):
+        """
+        Validate and format a scan of one A33* command (see A33_SPECS) once.
+
+        The returned ScanPlan goes to run_plan, which only writes the precomputed strings.
+        """
+        return ScanPlan(A33_SPECS[command], rows)
+
+    def run_plan(self, plan):
+        plan.run(self)
+
+    def fast_call(self, command, **kwargs):
+        """Send an A33* command from its spec without any validation, for parameters already checked."""
+        self.write(A33_SPECS[command].format(**kwargs))
+
+    def upload_cache_stats(self):
+        """Hit/miss counters of the ARB upload cache."""
+        return self.upload_cache.stats()
 
     # def _upload_custom_waveform_binary(self, name, waveform, channel=1):
     #     waveform = np.asarray(waveform, dtype=np.float32)
@@ -55,57 +191,71 @@ class Agilent33600A(AWG.GenericAWG):
             ARB memory index (e.g. 1 -> ARB1).
         channel : int
             Output channel (1 or 2).
+
+        Returns the transfer rate of the successful attempt in bytes/s, or None
+        if ARB{arb_index} already holds this waveform and the upload was skipped.
         """
-        # Convert to signed 16-bit integers (33600A DAC mode expects integers)
-        waveform = np.asarray(waveform, dtype=np.int16)
-        payload = waveform.tobytes()
-        visa_instr = self.instr.instr
-        
-        old_timeout = visa_instr.timeout
-        visa_instr.timeout = 60_000
-        
-        byte_count = len(payload)
-        len_str = str(byte_count)
-        header = f"#{len(len_str)}{len_str}".encode("ascii")
+        digest = self._pack_dac(self._block, waveform, arb_index, channel)
+        return self._send_dac_block(self._block, digest, arb_index, channel, max_attempts)
 
+    def _pack_dac(self, block, waveform, arb_index, channel):
+        """Build the DATA:ARB:DAC message for waveform in block and return the payload hash."""
         cmd = (
             f"FORM:BORD SWAP;:SOUR{channel}:DATA:ARB:DAC ARB{arb_index},"
             .encode("ascii")
         )
-        # Full message
-        message = cmd + header + payload# + b";\n"
+        # Full message, built once: signed 16-bit little endian (FORM:BORD SWAP) DAC codes
+        block.pack(cmd, waveform, "<i2")
+        return self.upload_cache.digest(block.parts[2])
 
+    def _send_dac_block(self, block, digest, arb_index, channel, max_attempts=10):
+        visa_instr = self.instr.instr
+
+        key = (channel, arb_index)
+        fmt = ("<i2", len(block.parts[2]) // 2)
+        header = f"SOUR{channel}:DATA:ARB:DAC ARB{arb_index} <{len(block.buffer)} bytes>"
+        if self.upload_cache.lookup(key, digest, fmt):
+            if Trace.enabled:
+                Trace.record(self, 'upload', header, 0.0, "cached")
+            return None
+        # Whatever was in the slot is overwritten (or half written) from here on
+        self.upload_cache.forget(key)
+
+        old_timeout = visa_instr.timeout
+        visa_instr.timeout = 60_000
 
         last_err = None
         for attempt in range(1, max_attempts + 1):
             try:
                 # Write waveform
-                visa_instr.write_raw(message)
-
-                # Short wait between attempts (like 100 ms)
-                time.sleep(0.1)
+                clear_events(self)
+                rate = write_block(visa_instr, block)
 
-                opc_reply = self.ask("*OPC?")
-     
-                if opc_reply != "1":
-                    # Optional: if not done, wait longer (LabVIEW style)
-                    time.sleep(20)  # 20 seconds, emulate LabVIEW long wait
+                # Poll until the instrument has stored the waveform
+                wait_complete(self, self.MODEL, "DATA:ARB:DAC", use_stb=self._status_reporting)
 
                 # Check instrument error
                 err = self.ask("SYST:ERR?")
                 
                 if err==('+0,"No error"'):
                     # Success
-                    print(f"Waveform ARB{arb_index} uploaded successfully on attempt {attempt}")
+                    if Trace.enabled:
+                        Trace.record(self, 'upload', header, len(block.buffer) / rate, f"ok, attempt {attempt}")
                     visa_instr.timeout = old_timeout
-                    return
+                    self.upload_cache.store(key, digest, fmt)
+                    return rate
                 else:
                     last_err = err
+                    self.invalidate_shadow()
                     print(f"Attempt {attempt}: Instrument busy/error -> {err}")
+                    if Trace.enabled:
+                        Trace.record(self, 'upload', header, None, f"attempt {attempt}: {err}")
 
             except Exception as e:
                 last_err = str(e)
                 print(f"Attempt {attempt}: Exception -> {last_err}")
+                if Trace.enabled:
+                    Trace.record(self, 'upload', header, None, f"attempt {attempt}: {last_err}")
         
         visa_instr.timeout = old_timeout
         # If we exit the loop without success
@@ -126,6 +276,7 @@ class Agilent33600A(AWG.GenericAWG):
     @validate_call
     def A33ClearArbitrary(self, channel: ChannelType):
         """Clears volatile memory for the specified channel."""
+        self.upload_cache.clear(channel)
         self.write(f"SOUR{channel}:DATA:VOL:CLE")
         self.ask("*OPC?")
 
@@ -162,7 +313,7 @@ class Agilent33600A(AWG.GenericAWG):
         arb_number: int, 
         amplitude: Annotated[float, Field(ge=0)], 
         f_sr_p: Annotated[int, Field(ge=0, le=2)], # ["FREQ", "SRAT", "PER"]
-        phase: Annotated[float, Field(ge=-360, le=360)], 
+        phase: Union[Annotated[float, Field(ge=-360, le=360)], None], # None = no change (burst mode)
         filter_key: Annotated[int, Field(ge=0, le=2)], # ["OFF", "STEP", "NORM"]
         dc_offset: float, 
         advance_mode: bool, # 0=SRAT, 1=TRIG
@@ -181,7 +332,7 @@ class Agilent33600A(AWG.GenericAWG):
         cmd += f'SOUR{channel}:VOLT:OFFS {dc_offset:#.12g};:'
         cmd += f'SOUR{channel}:FUNC ARB:{["FREQ", "SRAT", "PER"][f_sr_p]} {freq_sample_rate_period:#.12g};:'
         
-        if (phase >= -360) and (phase < 360):
+        if phase is not None:
             cmd += f'SOUR{channel}:PHASE:ARB {phase:#.12g};:'
  
         self.write(cmd)
@@ -192,7 +343,7 @@ class Agilent33600A(AWG.GenericAWG):
         channel: ChannelType, 
         burst_mode: bool, # 0=Triggered, 1=Gated
         burst_phase: Annotated[float, Field(ge=-360, le=360)], 
-        burst_count: Annotated[int, Field(ge=1)], 
+        burst_count: Union[Annotated[int, Field(ge=1)], Literal['INF']], # 'INF' = infinite burst
         gate_polarity: bool, # 0=Norm, 1=Inv
         internal_period: Annotated[float, Field(gt=0)], 
         enable_burst: bool
@@ -205,7 +356,8 @@ class Agilent33600A(AWG.GenericAWG):
             else: # Triggered
                 cmd = f'SOUR{channel}:BURS:MODE TRIG;:'
                 cmd += f'SOUR{channel}:BURS:PHAS {burst_phase:#.12g};:'
-                cmd += f'SOUR{channel}:BURS:NCYC {burst_count:.0f};:'
+                ncycles = burst_count if burst_count == 'INF' else f'{burst_count:.0f}'
+                cmd += f'SOUR{channel}:BURS:NCYC {ncycles};:'
             
             cmd += f'SOUR{channel}:BURS:STAT ON'
         else:
@@ -275,12 +427,10 @@ class Agilent33600A(AWG.GenericAWG):
         leading_edge: Annotated[float, Field(gt=0)], 
         trailing_edge: Annotated[float, Field(gt=0)] 
     ):
-        cmd = f':SOUR{channel}:FUNC:PULS:PER {pulse_period:#.12g};:'
-        cmd += f'SOUR{channel}:FUNC:PULS:WIDT {pulse_width:#.12g};:'
-        cmd += f'SOUR{channel}:FUNC:PULS:TRAN:LEAD {leading_edge:#.12g};:'
-        cmd += f'SOUR{channel}:FUNC:PULS:TRAN:TRA {trailing_edge:#.12g};'
-        
-        self.write(cmd)
+        self.write(A33_SPECS['A33ConfigurePulse'].format(
+            channel=channel, pulse_period=pulse_period, pulse_width=pulse_width,
+            leading_edge=leading_edge, trailing_edge=trailing_edge,
+        ))
 
     @validate_call
     def A33ConfigureTrigger(
@@ -292,16 +442,10 @@ class Agilent33600A(AWG.GenericAWG):
         int_period: Annotated[float, Field(gt=0)], 
         trigger_level: float 
     ):
-        trigger_source_str = ['IMM', 'TIM', 'EXT', 'BUS'][trigger_source]
-        trigger_slope_str = ['POS', 'NEG'][trigger_slope]        
-
-        cmd = f':TRIG{channel}: SOUR {trigger_source_str};:'
-        cmd += f'TRIG{channel}:SLOP {trigger_slope_str};:'
-        cmd += f'TRIG{channel}:DEL {delay:#.12g};:'
-        cmd += f'TRIG{channel}:TIM {int_period:#.12g};:'
-        cmd += f'TRIG{channel}:LEV {trigger_level:#.12g};'
-        
-        self.write(cmd)
+        self.write(A33_SPECS['A33ConfigureTrigger'].format(
+            channel=channel, trigger_source=trigger_source, trigger_slope=trigger_slope,
+            delay=delay, int_period=int_period, trigger_level=trigger_level,
+        ))
 
     @validate_call
     def A33ConfigureWFM(
@@ -313,36 +457,21 @@ class Agilent33600A(AWG.GenericAWG):
         frequency_bw_bitrate: Annotated[float, Field(gt=0)], 
         phase: Annotated[float, Field(ge=-360, le=360)]
     ):
-        waveform_str = ['SIN','SQU','PULS','RAMP','NOIS','DC','PRBS','TRI'][waveform]
-        
-        cmd = f':SOUR{channel}:FUNC {waveform_str};:'
-
-        if waveform_str != 'DC':
-            cmd += f'SOUR{channel}:VOLT {amplitude:#.12g};:'
-        
-        cmd += f'SOUR{channel}:VOLT:OFFS {dc_offset:#.12g};:'
-        
-        if waveform_str == 'NOIS':
-            cmd += f'SOUR{channel}:FUNC NOISE:BAND {frequency_bw_bitrate:#.12g};:'  
-        elif waveform_str == 'PRBS':
-            cmd += f'SOUR{channel}:FUNC:PRBS:BRAT {frequency_bw_bitrate:#.12g};:'
-        else:
-            cmd += f'SOUR{channel}:FREQ {frequency_bw_bitrate:#.12g};:'
-
-        if waveform_str not in ['NOIS', 'DC']:        
-            cmd += f'SOUR{channel}:PHASE {phase:#.12g};'
-        
-        self.write(cmd)
+        self.write(A33_SPECS['A33ConfigureWFM'].format(
+            channel=channel, waveform=waveform, amplitude=amplitude, dc_offset=dc_offset,
+            frequency_bw_bitrate=frequency_bw_bitrate, phase=phase,
+        ))
 
     @validate_call
     def A33Initialize(self, reset: bool): 
         if reset:
+            self.upload_cache.clear()
+            clear_events(self)
             self.write('*RST')
-            time.sleep(0.5)
+            wait_complete(self, self.MODEL, "*RST", deadline=10.0)
         self.write('*CLS;*ESE 1;*SRE 32;')
-        time.sleep(0.5)        
+        self._status_reporting = True
         self.write('*WAI')
-        time.sleep(0.5)
         self.write(':ROSCillator:SOURce:AUTO  ON;')
 
     @validate_call
@@ -354,15 +483,10 @@ class Agilent33600A(AWG.GenericAWG):
         polarity: bool, # 0=NORM, 1=INV
         impedance: Annotated[float, Field(gt=0)] 
     ):
-        polarity_str = ['NORM', 'INV'][int(polarity)]
-        enable_output_str = ['OFF', 'ON'][int(enable_output)]
-        output_mode_str = ['NORM', 'GATED'][int(output_mode)]
-        
-        cmd = f':OUTP{channel}:LOAD {impedance:#.12g};:'
-        cmd+= f'OUTP{channel}:POL {polarity_str};:'
-        cmd+= f'OUTP{channel}:MODE {output_mode_str};:'
-        cmd+= f'OUTP{channel} {enable_output_str};'
-        self.write(cmd)
+        self.write(A33_SPECS['A33OutputOnOff'].format(
+            channel=channel, enable_output=enable_output, output_mode=output_mode,
+            polarity=polarity, impedance=impedance,
+        ))
 
     @validate_call
     def A33PhaseSync(self):
@@ -371,6 +495,9 @@ class Agilent33600A(AWG.GenericAWG):
     @validate_call
     def A33ReadError(self):  
         err = self.ask('SYST:ERR?')
+        if not err.startswith('+0'):
+            # A rejected command leaves the settings unknown
+            self.invalidate_shadow()
         return err
 
     @validate_call
@@ -425,63 +552,53 @@ class Agilent33600A(AWG.GenericAWG):
 
     def load_split_and_upload_dac(
         self,
-        data: Union[str, np.ndarray, TextIO, BinaryIO],
+        data: Union[str, np.ndarray, TextIO, BinaryIO, Iterator[np.ndarray]],
         arb_start_index: int,
         channel: int = 1,
         chunk_size: int = 4_000_000,
+        depth: int = 2,
     ):
         """
         Load waveform data, split into chunks, auto-increment names with _XX suffix,
         and upload each chunk using DATA:ARB:DAC.
 
+        Loading, int16 conversion, framing and hashing of the next chunks run on a
+        worker thread while the current chunk is transferred, at most depth
+        chunks ahead.
+
         Parameters
         ----------
-        data : str | Path | array-like
-            Path to file (loaded via np.load) or waveform array.
+        data : str | Path | file-like | array-like
+            Waveform array, or a file: .npy (memory mapped), raw little-endian
+            int16 (.bin/.i16, memory mapped) or 1D integer ASCII (parsed one
+            chunk at a time), or an iterator yielding the waveform piece by
+            piece (synthesised on the worker thread).
         arb_start_index : int
             Starting ARB memory index (ARBn).
         channel : int
             Output channel.
         chunk_size : int
             Number of points per chunk (default: 4M).
-        """
-
-        # ---- Load data ---------------------------------------------------------
-        if hasattr(data, "read"):
-            try:
-                waveform = np.loadtxt(data, dtype=np.int32)
-            except Exception as exc:
-                raise ValueError(
-                    f"Failed to load DAC waveform from '{data}'. "
-                    "File must contain 1D integer ASCII data "
-                    "(valid for DATA:ARB:DAC)."
-                ) from exc
-
-            if waveform.ndim != 1:
-                raise ValueError(
-                    f"Waveform data in '{data}' must be 1D, got shape {waveform.shape}."
-                )
-        else:
-            waveform = np.asarray(data)
+        depth : int
+            Number of chunks prepared ahead of the transfer.
 
-        total_points = waveform.shape[0]
+        Returns the per-chunk transfer rates in bytes/s (None for chunks the
+        upload cache found already in place).
+        """
 
-        counter = arb_start_index
         # ---- Split and upload --------------------------------------------------
-        num_chunks = (total_points + chunk_size - 1) // chunk_size
-
-        for i in range(num_chunks):
-            chunk = waveform[i * chunk_size : (i + 1) * chunk_size]
-
-            name = f"{counter + i:01d}"
+        def pack(block, item):
+            i, chunk = item
             arb_index = arb_start_index + i
+            return arb_index, self._pack_dac(block, chunk, arb_index, channel)
 
-            self._upload_custom_waveform_dac_binary(
-                waveform=chunk,
-                arb_index=arb_index,
-                channel=channel,
-            )
-            time.sleep(5)
+        self._blocks += [BinaryBlock() for _ in range(depth + 1 - len(self._blocks))]
+        chunks = enumerate(_dac_chunks(data, chunk_size))
+
+        rates = []
+        for block, (arb_index, digest) in pack_ahead(chunks, pack, self._blocks[:depth + 1]):
+            rates.append(self._send_dac_block(block, digest, arb_index, channel))
+        return rates
 
 
 
@@ -489,18 +606,18 @@ if __name__=="__main__":
     num_points = 13e6
     x = np.arange(num_points)
     data = 1e4*(np.sin(17 * x * (2*np.pi/num_points)) +  np.sin(6 * x * (2 * np.pi /num_points)))
-    np.savetxt(r'C:\Users\dt360\Documents\GitHub\QD_experiment_control\test_data.txt', data, fmt='%d')
+    np.save(r'C:\Users\dt360\Documents\GitHub\QD_experiment_control\test_data.npy', data.astype(np.int16))
 
 
     with Agilent33600A("TCPIP::169.254.11.23::INSTR") as awg:
         awg.A33ClearArbitrary(1)
         awg.A33ClearArbitrary(2)
     
-        with open(r'C:\Users\dt360\Documents\GitHub\QD_experiment_control\test_data.txt') as f:
-            # with Agilent33600A("TCPIP::169.254.11.23::INSTR") as awg:
-            awg.load_split_and_upload_dac(f,1)
+        # with Agilent33600A("TCPIP::169.254.11.23::INSTR") as awg:
+        awg.load_split_and_upload_dac(r'C:\Users\dt360\Documents\GitHub\QD_experiment_control\test_data.npy', 1)
             
 
+#     import streamlit as st      # only the UI needs it, importing it costs seconds
 #     st.set_page_config(page_title="Agilent 33600A Controller", layout="wide")
 #     st.title("Agilent 33600A Series Controller")
 # # "TCPIP::127.0.0.1::5025::SOCKET"
@@ -512,13 +629,14 @@ if __name__=="__main__":
 
     # def run_command(func, *args, **kwargs):
     #     try:
-    #         # Re-instantiate context for every click to ensure stateless web behavior unless managed by session state
-    #         with Agilent33600A(visa_addr) as instr:
-    #             result = func(instr, *args, **kwargs)
-    #             if result is not None:
-    #                 st.success(f"Response: {result}")
-    #             else:
-    #                 st.success(f"Command executed: {func.__name__}")
+    #         # The session is opened on the first click and shared with every later one (core.Pool)
+    #         from core.Pool import pool
+    #         instr = pool.acquire(visa_addr, Agilent33600A, visa_addr)
+    #         result = pool.call(visa_addr, func, instr, *args, **kwargs)
+    #         if result is not None:
+    #             st.success(f"Response: {result}")
+    #         else:
+    #             st.success(f"Command executed: {func.__name__}")
     #     except Exception as e:
     #         st.error(f"Error: {e}")
 
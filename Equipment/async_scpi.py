@@ -0,0 +1,124 @@
+"""
+asyncio transport for raw SCPI over a socket (TCPIP::host::5025::SOCKET).
+
+Writes go out as soon as they are awaited and queries do not wait for each
+other: every query registers the future for its reply when it is written, and
+one reader task hands the reply lines out in order. Several queries can so be
+in flight on one connection (query_many), and connections to different
+instruments are simply awaited together.
+"""
+import asyncio
+import collections
+import re
+
+_SOCKET_ADDR = re.compile(r"^TCPIP\d*::([^:]+)::(\d+)::SOCKET$", re.IGNORECASE)
+
+
+def socket_address(addr):
+    """'TCPIP::127.0.0.1::5025::SOCKET' -> ('127.0.0.1', 5025)."""
+    match = _SOCKET_ADDR.match(addr.strip())
+    if match is None:
+        raise ValueError(f"'{addr}' is not a TCPIP::host::port::SOCKET resource")
+    return match.group(1), int(match.group(2))
+
+
+class AsyncSCPI:
+    def __init__(self, addr, term_write="\n", term_read="\n", timeout=10.0):
+        self.addr = addr
+        self.host, self.port = socket_address(addr)
+        self.term_write = term_write.encode()
+        self.term_read = term_read.encode()
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._replies = collections.deque()     # futures of the queries written and not answered yet
+        self._write_lock = asyncio.Lock()
+        self._read_task = None
+
+    async def open(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout)
+        self._read_task = asyncio.create_task(self._read_replies(), name=f"scpi-read-{self.addr}")
+        return self
+
+    async def close(self):
+        if self._read_task is not None:
+            self._read_task.cancel()
+            await asyncio.gather(self._read_task, return_exceptions=True)
+            self._read_task = None
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+            self._writer = None
+        self._fail_pending(ConnectionError(f"{self.addr}: connection closed"))
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def is_opened(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    # ------------------------------------------------------------------
+
+    def _fail_pending(self, error):
+        while self._replies:
+            future = self._replies.popleft()
+            if not future.done():
+                future.set_exception(error)
+
+    async def _read_replies(self):
+        try:
+            while True:
+                line = await self._reader.readuntil(self.term_read)
+                if not self._replies:
+                    print(f"[{self.addr}] Unexpected reply: {line!r}")
+                    continue
+                future = self._replies.popleft()
+                if not future.done():
+                    future.set_result(line[:-len(self.term_read)].decode(errors='replace').strip())
+        except asyncio.CancelledError:
+            raise
+        except (asyncio.IncompleteReadError, OSError) as e:
+            self._fail_pending(ConnectionError(f"{self.addr}: {e}"))
+
+    async def _send(self, data, replies=0):
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in range(replies)]
+        async with self._write_lock:
+            # Registered under the lock, so the futures are in the order the queries hit the wire
+            self._replies.extend(futures)
+            self._writer.write(data)
+            await self._writer.drain()
+        return futures
+
+    async def _await_replies(self, futures):
+        try:
+            return await asyncio.wait_for(asyncio.gather(*futures), self.timeout)
+        except asyncio.TimeoutError:
+            # The remaining replies can no longer be matched to their queries
+            await self.close()
+            raise TimeoutError(f"{self.addr}: no reply within {self.timeout} s") from None
+
+    # ------------------------------------------------------------------
+
+    async def write(self, msg):
+        await self._send(msg.encode() + self.term_write)
+
+    async def write_raw(self, data):
+        await self._send(bytes(data))
+
+    async def query(self, msg):
+        futures = await self._send(msg.encode() + self.term_write, replies=1)
+        return (await self._await_replies(futures))[0]
+
+    async def query_many(self, msgs):
+        """Write all queries back to back, then collect their replies in order."""
+        data = b"".join(msg.encode() + self.term_write for msg in msgs)
+        futures = await self._send(data, replies=len(msgs))
+        return list(await self._await_replies(futures))
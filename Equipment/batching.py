@@ -0,0 +1,77 @@
+import contextlib
+import re
+
+# "C1:BSWV FRQ,1000" -> ("C1:BSWV", "FRQ,1000")
+_BSWV = re.compile(r"^(C\d+:BSWV)\s+(.+)$", re.IGNORECASE)
+
+
+class BatchingMixin:
+    """
+    Collects plain writes made inside ``with instr.batch():`` and sends them as one message.
+
+    Writes to the same ``C{n}:BSWV`` header are merged into one command whose
+    KEY,value pairs are comma joined (a key written twice keeps its first
+    position and its last value), the remaining commands are joined with
+    ``;`` in the order they were written. The message is sent once, when the
+    outermost batch exits; if the block raises, nothing is sent. A query inside
+    a batch sends what was collected so far first.
+    """
+    BATCH_SEPARATOR = ";"
+
+    _batch_depth = 0
+    _batch = None
+
+    @contextlib.contextmanager
+    def batch(self):
+        if not self._batch_depth:
+            self._batch = []
+        self._batch_depth += 1
+        try:
+            yield self
+        except BaseException:
+            if self._batch_depth == 1:
+                self._batch = None
+            raise
+        finally:
+            self._batch_depth -= 1
+        if not self._batch_depth:
+            self.flush_batch()
+
+    def flush_batch(self):
+        """Send the commands collected so far."""
+        pending, self._batch = self._batch, ([] if self._batch_depth else None)
+        if not pending:
+            return
+        commands = []
+        for entry in pending:
+            if isinstance(entry, tuple):
+                header, params = entry
+                entry = f"{header} " + ",".join(f"{key},{value}" for key, value in params.items())
+            commands.append(entry)
+        super().write(self.BATCH_SEPARATOR.join(commands))
+
+    def _collect(self, msg):
+        msg = msg.strip()
+        match = _BSWV.match(msg)
+        if match:
+            header, fields = match.group(1).upper(), match.group(2).split(",")
+            if len(fields) % 2 == 0:
+                params = next((entry[1] for entry in self._batch if isinstance(entry, tuple) and entry[0] == header), None)
+                if params is None:
+                    params = {}
+                    self._batch.append((header, params))
+                for key, value in zip(fields[::2], fields[1::2]):
+                    params[key.strip().upper()] = value.strip()
+                return
+        self._batch.append(msg)
+
+    def write(self, msg, *args, **kwargs):
+        if self._batch is not None and not args and not kwargs:
+            self._collect(msg)
+            return
+        self.flush_batch()
+        return super().write(msg, *args, **kwargs)
+
+    def ask(self, msg, *args, **kwargs):
+        self.flush_batch()
+        return super().ask(msg, *args, **kwargs)
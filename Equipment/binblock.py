@@ -0,0 +1,128 @@
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+class BinaryBlock:
+    """
+    Reusable buffer for ``<SCPI prefix>#N<len><payload>`` messages (IEEE 488.2 definite length block).
+
+    The array is converted to the wire dtype/byte order once, directly into the
+    message buffer, so there is no tobytes() copy and no bytes concatenation.
+    The buffer is kept between chunks and resent as is on retries. parts holds
+    memoryviews of prefix, header and payload for transports that can send
+    scatter/gather.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.parts = ()
+
+    def _release(self):
+        for view in self.parts:
+            view.release()
+        self.parts = ()
+
+    def pack(self, prefix, data, dtype):
+        data = np.asarray(data)
+        dtype = np.dtype(dtype)
+        count = data.shape[0]
+        length = str(count * dtype.itemsize).encode("ascii")
+        header = b"#" + str(len(length)).encode("ascii") + length
+        p, h = len(prefix), len(prefix) + len(header)
+        total = h + count * dtype.itemsize
+
+        # VISA backends want the exact message, so resize in place (shrinking keeps the allocation)
+        self._release()
+        if len(self.buffer) > total:
+            del self.buffer[total:]
+        elif len(self.buffer) < total:
+            self.buffer = bytearray(total)
+
+        view = memoryview(self.buffer)
+        view[:p] = prefix
+        view[p:h] = header
+        np.frombuffer(self.buffer, dtype=dtype, count=count, offset=h)[:] = data
+        self.parts = (view[:p], view[p:h], view[h:])
+        view.release()
+        return self.buffer
+
+
+def write_block(visa_instr, block):
+    """Send a packed BinaryBlock over a raw PyVISA resource and return the transfer rate in bytes/s."""
+    start = time.perf_counter()
+    try:
+        visa_instr.write_raw(block.buffer)
+    except TypeError:
+        # Some VISA libraries only accept bytes objects
+        visa_instr.write_raw(bytes(block.buffer))
+    if is_socket(visa_instr):
+        # A raw socket has no END, the instrument only sees the end of the message at the terminator
+        term = visa_instr.write_termination
+        visa_instr.write_raw(term.encode() if isinstance(term, str) else term)
+    return len(block.buffer) / max(time.perf_counter() - start, 1e-9)
+
+
+def is_socket(visa_instr):
+    return getattr(visa_instr, 'resource_name', '').upper().endswith("::SOCKET")
+
+
+def terminate_socket_writes(backend):
+    """
+    Make a pylablib VISA backend append the write terminator itself on TCPIP::...::SOCKET resources.
+
+    pylablib hands the terminator to PyVISA and then sends with write_raw, which
+    skips it; over VXI-11 the END flag ends each message, a raw socket has none.
+    """
+    if is_socket(backend.instr) and not backend.term_write:
+        backend.term_write = backend.instr.write_termination
+
+
+def pack_ahead(items, pack, blocks):
+    """
+    Pack the next items on a worker thread while the caller sends the current one.
+
+    pack(block, item) fills a BinaryBlock and returns anything the sender needs
+    along with it; the generator yields (block, info) in order. The blocks are
+    recycled, so at most len(blocks) - 1 packed messages wait ahead of the
+    caller and memory stays bounded whatever the number of items. A block may
+    only be used until the next item is requested.
+    """
+    free = queue.Queue()
+    for block in blocks:
+        free.put(block)
+    ready = queue.Queue(maxsize=len(blocks) - 1)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in items:
+                block = free.get()
+                if stop.is_set():
+                    return
+                ready.put((block, pack(block, item)))
+        except BaseException as e:
+            ready.put(e)
+            return
+        ready.put(None)
+
+    producer = threading.Thread(target=produce, name="pack-ahead", daemon=True)
+    producer.start()
+    try:
+        while (entry := ready.get()) is not None:
+            if isinstance(entry, BaseException):
+                raise entry
+            block, info = entry
+            yield block, info
+            free.put(block)
+    finally:
+        # Unblock the producer wherever it waits and let it finish
+        stop.set()
+        free.put(None)
+        while producer.is_alive():
+            try:
+                ready.get(timeout=0.1)
+            except queue.Empty:
+                pass
@@ -0,0 +1,258 @@
+"""
+Declarative command specs for the hot configure commands.
+
+Every spec lists its parameters (type, bounds, enumerations) and the SCPI
+template(s) it fills. The tables are compiled once at import: each parameter
+becomes a plain converter/check and each template a bound str.format, so
+formatting a command is a dict lookup and one format call. ScanPlan validates
+a whole list of parameter sets up front, after which the commands are only
+written, without pydantic or per-call string building.
+"""
+import itertools
+import math
+import numbers
+import operator
+
+
+class Param:
+    def __init__(self, name, kind=float, ge=None, gt=None, le=None, lt=None, allowed=None, choices=None):
+        self.name = name
+        self.kind = kind            # float, int or bool
+        self.ge, self.gt, self.le, self.lt = ge, gt, le, lt
+        self.allowed = allowed      # {1, 2}
+        self.choices = choices      # ['SIN', 'SQU', ...] string sent for each index (or False/True)
+
+    def bounds(self):
+        """(low, high, low inclusive, high inclusive) for vectorized checks."""
+        low, low_inclusive = (self.ge, True) if self.ge is not None else (self.gt, False)
+        high, high_inclusive = (self.le, True) if self.le is not None else (self.lt, False)
+        return low, high, low_inclusive, high_inclusive
+
+    def compile(self):
+        """
+        Checker for this parameter: validates and converts one value, raising
+        ValueError like the pydantic signatures did. Only the checks the
+        parameter needs are in it.
+        """
+        name, kind, allowed = self.name, self.kind, self.allowed
+        low, high, low_inclusive, high_inclusive = self.bounds()
+
+        def fail(value, reason):
+            raise ValueError(f"{name}: {reason}, got {value!r}")
+
+        if kind is bool:
+            def check(value):
+                if value is True or value is False:
+                    return value
+                if not isinstance(value, numbers.Integral) or value not in (0, 1):
+                    fail(value, "expected a bool")
+                return bool(value)
+            return check
+
+        def check(value):
+            if type(value) is not float and (isinstance(value, bool) or not isinstance(value, numbers.Real)):
+                fail(value, "expected a number")
+            if kind is int:
+                if value != int(value):
+                    fail(value, "expected an integer")
+                value = int(value)
+            elif not math.isfinite(value):
+                fail(value, "expected a finite number")
+            if low is not None and (value < low if low_inclusive else value <= low):
+                fail(value, "out of range")
+            if high is not None and (value > high if high_inclusive else value >= high):
+                fail(value, "out of range")
+            if allowed is not None and value not in allowed:
+                fail(value, f"expected one of {sorted(allowed)}")
+            return value
+        return check
+
+
+class CommandSpec:
+    """
+    A command with its parameters and SCPI template.
+
+    template is a str.format template over the parameter names, or a function
+    returning one for the enumerated values (when the command layout depends on
+    them). Enumerated parameters (choices) are baked into one compiled template
+    per combination, so formatting only picks a template and fills in numbers.
+    """
+
+    def __init__(self, name, params, template):
+        self.name = name
+        self.params = {param.name: param for param in params}
+        self._checks = [(param.name, param.compile()) for param in params]
+        self.enums = [param for param in params if param.choices is not None]
+        self._formats = {}
+        for combination in itertools.product(*(range(len(param.choices)) for param in self.enums)):
+            names = {param.name: param.choices[i] for param, i in zip(self.enums, combination)}
+            text = template(**names) if callable(template) else template
+            for name, choice in names.items():
+                text = text.replace("{" + name + "}", choice)
+            self._formats[combination[0] if len(combination) == 1 else combination] = text.format
+        # Picks the template from the enumerated values (bools and numpy ints hash like the indices)
+        self._key = operator.itemgetter(*(param.name for param in self.enums)) if self.enums else None
+
+    def validate(self, kwargs):
+        """Checked and converted copy of kwargs."""
+        if len(kwargs) != len(self._checks) or not kwargs.keys() <= self.params.keys():
+            missing = sorted(self.params.keys() - kwargs.keys())
+            unknown = sorted(kwargs.keys() - self.params.keys())
+            raise ValueError(f"{self.name}: missing parameters {missing}, unknown parameters {unknown}")
+        return {name: check(kwargs[name]) for name, check in self._checks}
+
+    def format(self, **values):
+        """SCPI string for already validated values (fast path, nothing is checked)."""
+        if self._key is None:
+            return self._formats[()](**values)
+        return self._formats[self._key(values)](**values)
+
+    def __call__(self, **kwargs):
+        return self.format(**self.validate(kwargs))
+
+
+class ScanPlan:
+    """
+    A list of parameter sets for one command, validated and formatted once.
+
+    run(device) then only writes the precomputed strings.
+    """
+
+    def __init__(self, spec, rows):
+        self.spec = spec
+        self.commands = [spec.format(**spec.validate(row)) for row in rows]
+
+    def __len__(self):
+        return len(self.commands)
+
+    def run(self, device):
+        for command in self.commands:
+            device.write(command)
+
+
+# ------------------------------------------------------------------
+# Agilent 33600A
+# ------------------------------------------------------------------
+
+CHANNEL = Param('channel', int, allowed={1, 2})
+A33_WAVEFORMS = ['SIN', 'SQU', 'PULS', 'RAMP', 'NOIS', 'DC', 'PRBS', 'TRI']
+
+
+def _a33_wfm_template(waveform):
+    # Same pieces, in the same order, as A33ConfigureWFM always sent
+    cmd = ':SOUR{channel}:FUNC {waveform};:'
+    if waveform != 'DC':
+        cmd += 'SOUR{channel}:VOLT {amplitude:#.12g};:'
+    cmd += 'SOUR{channel}:VOLT:OFFS {dc_offset:#.12g};:'
+    if waveform == 'NOIS':
+        cmd += 'SOUR{channel}:FUNC NOISE:BAND {frequency_bw_bitrate:#.12g};:'
+    elif waveform == 'PRBS':
+        cmd += 'SOUR{channel}:FUNC:PRBS:BRAT {frequency_bw_bitrate:#.12g};:'
+    else:
+        cmd += 'SOUR{channel}:FREQ {frequency_bw_bitrate:#.12g};:'
+    if waveform not in ['NOIS', 'DC']:
+        cmd += 'SOUR{channel}:PHASE {phase:#.12g};'
+    return cmd
+
+
+A33_SPECS = {spec.name: spec for spec in [
+    CommandSpec('A33ConfigureWFM', [
+        CHANNEL,
+        Param('waveform', int, ge=0, le=7, choices=A33_WAVEFORMS),
+        Param('amplitude', ge=0),
+        Param('dc_offset'),
+        Param('frequency_bw_bitrate', gt=0),
+        Param('phase', ge=-360, le=360),
+    ], _a33_wfm_template),
+
+    CommandSpec('A33ConfigurePulse', [
+        CHANNEL,
+        Param('pulse_period', gt=0),
+        Param('pulse_width', gt=0),
+        Param('leading_edge', gt=0),
+        Param('trailing_edge', gt=0),
+    ], ':SOUR{channel}:FUNC:PULS:PER {pulse_period:#.12g};:'
+       'SOUR{channel}:FUNC:PULS:WIDT {pulse_width:#.12g};:'
+       'SOUR{channel}:FUNC:PULS:TRAN:LEAD {leading_edge:#.12g};:'
+       'SOUR{channel}:FUNC:PULS:TRAN:TRA {trailing_edge:#.12g};'),
+
+    CommandSpec('A33ConfigureTrigger', [
+        CHANNEL,
+        Param('trigger_source', int, ge=0, le=3, choices=['IMM', 'TIM', 'EXT', 'BUS']),
+        Param('trigger_slope', int, ge=0, le=1, choices=['POS', 'NEG']),
+        Param('delay', ge=0),
+        Param('int_period', gt=0),
+        Param('trigger_level'),
+    ], ':TRIG{channel}: SOUR {trigger_source};:'
+       'TRIG{channel}:SLOP {trigger_slope};:'
+       'TRIG{channel}:DEL {delay:#.12g};:'
+       'TRIG{channel}:TIM {int_period:#.12g};:'
+       'TRIG{channel}:LEV {trigger_level:#.12g};'),
+
+    CommandSpec('A33OutputOnOff', [
+        CHANNEL,
+        Param('enable_output', bool, choices=['OFF', 'ON']),
+        Param('output_mode', bool, choices=['NORM', 'GATED']),
+        Param('polarity', bool, choices=['NORM', 'INV']),
+        Param('impedance', gt=0),
+    ], ':OUTP{channel}:LOAD {impedance:#.12g};:'
+       'OUTP{channel}:POL {polarity};:'
+       'OUTP{channel}:MODE {output_mode};:'
+       'OUTP{channel} {enable_output};'),
+]}
+
+
+# ------------------------------------------------------------------
+# Siglent SDG6022X
+# ------------------------------------------------------------------
+
+class KeyValueSpec:
+    """
+    A Siglent ``C{channel}:BSWV KEY,value,...`` command whose keys are all optional.
+
+    The template for each combination of given keys is built the first time
+    it is used and kept, so repeated calls with the same keys only format.
+    """
+
+    def __init__(self, name, header, keys, defaults):
+        self.name = name
+        self.header = header        # 'C{channel}:BSWV WVTP,{waveform_type}'
+        self.keys = keys            # {"freq": "FRQ", ...} in the order they are sent
+        self.defaults = defaults
+        self._templates = {}
+
+    def _template(self, present):
+        template = self._templates.get(present)
+        if template is None:
+            parts = [self.header] + [f"{key},{{{name}:#.12g}}" for name, key in self.keys.items() if name in present]
+            template = self._templates[present] = ",".join(parts).format
+        return template
+
+    def validate(self, kwargs):
+        """Only the KEY,value parameters have to be numbers, everything else is passed through."""
+        for name, value in kwargs.items():
+            if name in self.keys and (not isinstance(value, numbers.Real) or isinstance(value, bool)):
+                raise ValueError(f"{self.name}: {name} must be a number, got {value!r}")
+        return kwargs
+
+    def format(self, **values):
+        values = {**self.defaults, **values}
+        present = frozenset(name for name in self.keys if name in values)
+        return self._template(present)(**values)
+
+    def __call__(self, **kwargs):
+        return self.format(**self.validate(kwargs))
+
+
+_STDWFM_KEYS = {
+    'freq': 'FRQ', 'period': 'PERI',
+    'amp': 'AMP', 'offset': 'OFST', 'phase': 'PHSE', 'duty_cycle': 'DUTY',
+    'ramp_symmetry': 'SYM', 'pulse_width': 'WIDTH', 'edge_time': 'EDGE',
+}
+
+SDG60_SPECS = {
+    'SDG60ConfSTDWFM': KeyValueSpec(
+        'SDG60ConfSTDWFM', 'C{channel}:BSWV WVTP,{waveform_type}', _STDWFM_KEYS,
+        defaults={'channel': 1, 'waveform_type': 'SINE'},
+    ),
+}
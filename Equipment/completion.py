@@ -0,0 +1,78 @@
+import statistics
+import time
+from collections import deque
+
+# { ("33600A", "DATA:ARB:DAC"): deque([1.92, 1.88, ...]) } last observed completion times in s
+settle_times = {}
+
+_HISTORY = 32
+
+ESB = 0x20      # STB bit 5, event status summary (set through *ESE 1 when OPC completes)
+OPC = 0x01      # ESR bit 0, operation complete
+
+
+class CompletionTimeout(TimeoutError):
+    pass
+
+
+def typical_settle(model, operation):
+    """Median of the recorded completion times, None until something was recorded."""
+    times = settle_times.get((model, operation))
+    return statistics.median(times) if times else None
+
+
+def settle_summary():
+    return {
+        f"{model} {operation}": {'count': len(times), 'median': statistics.median(times), 'max': max(times)}
+        for (model, operation), times in settle_times.items() if times
+    }
+
+
+def clear_events(device):
+    """Read (and so clear) the event status register, so a stale OPC bit is not taken for completion."""
+    device.ask("*ESR?")
+
+
+def _complete(device, use_stb):
+    if use_stb:
+        # Serial poll does not go through the instrument's parser, so it answers while a transfer is processed
+        try:
+            stb = int(device.instr.instr.read_stb())
+        except Exception:
+            stb = ESB
+        if not stb & ESB:
+            return False
+    return bool(int(float(device.ask("*ESR?"))) & OPC)
+
+
+def wait_complete(device, model, operation, deadline=60.0, first=None, factor=2.0, max_interval=1.0, use_stb=False):
+    """
+    Wait until every pending operation on device is done, using *OPC and *ESR? polling.
+
+    Call clear_events before starting the operation. With use_stb the status byte is
+    polled instead (needs *ESE 1, as set by A33Initialize), and *ESR? is only read once
+    ESB is set. The first poll comes after 80 % of the typical settle time of
+    (model, operation), then the interval starts at first (10 ms) and backs off by
+    factor up to max_interval. Returns the settle time, which is recorded for the
+    next call. Raises CompletionTimeout after deadline s.
+    """
+    start = time.perf_counter()
+    device.write("*OPC")
+
+    typical = typical_settle(model, operation)
+    if typical:
+        # Nothing to poll for most of the usual settle time
+        time.sleep(min(0.8 * typical, deadline))
+    interval = first if first is not None else 0.01
+    while True:
+        elapsed = time.perf_counter() - start
+        if elapsed >= deadline:
+            raise CompletionTimeout(f"{model} {operation} not complete after {deadline:.1f} s")
+        time.sleep(min(interval, deadline - elapsed))
+        if _complete(device, use_stb):
+            break
+        interval = min(interval * factor, max(max_interval, interval))
+
+    elapsed = time.perf_counter() - start
+    settle_times.setdefault((model, operation), deque(maxlen=_HISTORY)).append(elapsed)
+    return elapsed
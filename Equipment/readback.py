@@ -0,0 +1,84 @@
+import re
+import time
+
+# 1e+06HZ, 0.01S, -4.5V, 50%, 1.2e-08s -> number and unit
+_NUMBER = re.compile(r"^([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)([A-Za-z%/]*)$")
+
+# Keys that open a nested group of KEY,value pairs (C1:MDWV STATE,ON,AM,SRC,INT,...)
+SECTIONS = {'AM', 'DSBAM', 'FM', 'PM', 'PWM', 'ASK', 'FSK', 'CARR', 'MOD'}
+
+
+def parse_value(text):
+    """'1e+06HZ' -> 1000000.0, '10' -> 10, 'SINE' -> 'SINE'."""
+    match = _NUMBER.match(text.strip())
+    if match is None:
+        return text.strip()
+    number = match.group(1)
+    if re.fullmatch(r"[-+]?\d+", number):
+        return int(number)
+    return float(number)
+
+
+def parse_response(text):
+    """
+    Turn a Siglent ``C1:BSWV WVTP,SINE,FRQ,100HZ,...`` reply into {"WVTP": "SINE", "FRQ": 100.0, ...}.
+
+    A leading value without key (C1:OUTP ON,LOAD,HZ) is returned as "STATE" and
+    modulation/burst sections (AM, FM, CARR, ...) become nested dicts.
+    """
+    text = text.strip()
+    _, _, args = text.partition(" ")
+    fields = [field.strip() for field in args.split(",")] if args else []
+    result = {}
+    if fields and fields[0].upper() in ('ON', 'OFF'):
+        result['STATE'] = fields.pop(0).upper()
+
+    target = result
+    i = 0
+    while i < len(fields):
+        key = fields[i].upper()
+        if key in SECTIONS and i + 1 < len(fields) and fields[i + 1].upper() not in ('ON', 'OFF'):
+            target = result.setdefault(key, {})
+            i += 1
+            continue
+        target[key] = parse_value(fields[i + 1]) if i + 1 < len(fields) else None
+        i += 2
+    return result
+
+
+def query_burst(device, queries):
+    """
+    Send all queries as one message and collect one reply per query, without waiting in between.
+
+    The replies may come back in one ';' separated message or one message each.
+    """
+    device.write(";".join(queries))
+    replies = []
+    while len(replies) < len(queries):
+        replies += [reply.strip() for reply in device.read().split(";") if reply.strip()]
+    return replies[:len(queries)]
+
+
+class ReadbackCache:
+    """Parsed query replies per channel, served for ttl seconds after they were read."""
+
+    def __init__(self, ttl=0.5):
+        self.ttl = ttl
+        self.channels = {}      # { 1: (<time read>, {"BSWV": {...}, "OUTP": {...}}) }
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, channel, max_age=None):
+        entry = self.channels.get(channel)
+        max_age = self.ttl if max_age is None else max_age
+        if entry is not None and time.monotonic() - entry[0] <= max_age:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def store(self, channel, parameters):
+        self.channels[channel] = (time.monotonic(), parameters)
+
+    def clear(self):
+        self.channels.clear()
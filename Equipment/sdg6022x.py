@@ -1,4 +1,3 @@
-import cmd
 from pylablib.core.devio import SCPI
 import numpy as np
 
@@ -6,17 +5,68 @@ import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from core import Trace
 from core.Registry import register_command
+from Equipment.binblock import BinaryBlock, terminate_socket_writes, write_block
+from Equipment.upload_cache import UploadCache
+from Equipment.completion import clear_events, wait_complete
+from Equipment.batching import BatchingMixin
+from Equipment.shadow import ShadowMixin, siglent_filter
+from Equipment.readback import ReadbackCache, parse_response, query_burst
+from Equipment.command_specs import SDG60_SPECS
+from Equipment.tracing import TraceMixin
 import time
 
-class SDG6022X(SCPI.SCPIDevice):
+class SDG6022X(BatchingMixin, ShadowMixin, TraceMixin, SCPI.SCPIDevice):
+    MODEL = "SDG6022X"
+    COMMAND_SPECS = SDG60_SPECS
+    SHADOW_FILTER = staticmethod(siglent_filter)
+    SHADOW_FIELDS = {
+        'waveform': "BSWV:WVTP", 'frequency': "BSWV:FRQ", 'amplitude': "BSWV:AMP", 'offset': "BSWV:OFST",
+        'burst': "BTWV:STATE", 'modulation': "MDWV", 'output': "OUTP:STATE", 'load': "OUTP:LOAD",
+    }
+    # Channel state queries read together by read_parameters
+    READBACK_QUERIES = ("BSWV", "MDWV", "SWWV", "BTWV", "SRATE", "OUTP")
+
     def __init__(self, addr):
+        self.upload_cache = UploadCache()
+        self._init_shadow()
+        self.readback = ReadbackCache()
+        self._burst_queries = True      # replies to ';' joined queries come back, see read_parameters
         super().__init__(addr, term_write="\n", term_read="\n")
+        self._setup_visa()
+        self._block = BinaryBlock()
 
+    def _setup_visa(self):
         # Access the raw PyVISA resource to adjust timeouts
         raw_dev = self.instr.instr
         raw_dev.timeout = 20_000          # 20s timeout (uploading large ARBs takes time)
         raw_dev.chunk_size = 4 * 1024 * 1024  # 4MB chunk size
+        terminate_socket_writes(self.instr)
+
+    def open(self):
+        # A new connection may be to a power cycled instrument, nothing uploaded before can be trusted
+        self.upload_cache.clear()
+        self.shadow.clear()
+        self.readback.clear()
+        super().open()
+
+    def reconnect(self, *args, **kwargs):
+        self.upload_cache.clear()
+        self.shadow.clear()
+        self.readback.clear()
+        super().reconnect(*args, **kwargs)
+        self._setup_visa()      # a reconnect may make a new VISA resource with default settings
+
+    def write(self, msg, *args, **kwargs):
+        if not str(msg).rstrip().endswith("?"):
+            # Anything set from here on may differ from what was read back
+            self.readback.clear()
+        return super().write(msg, *args, **kwargs)
+
+    def upload_cache_stats(self):
+        """Hit/miss counters of the WVDT upload cache."""
+        return self.upload_cache.stats()
         
     # --------------------------------------------------
     # Set functions
@@ -75,11 +125,41 @@ class SDG6022X(SCPI.SCPIDevice):
     # --------------------------------------------------
     # Get functions
     # --------------------------------------------------
+    def read_parameters(self, channel, max_age=None):
+        """
+        Parsed replies to READBACK_QUERIES for channel, e.g. {"BSWV": {"WVTP": "SINE", "FRQ": 1000.0, ...}, ...}.
+
+        Served from the readback cache while younger than max_age (default: the cache ttl),
+        otherwise all queries are sent in one burst.
+        """
+        parameters = self.readback.get(channel, max_age)
+        if parameters is not None:
+            return parameters
+
+        queries = [f"C{channel}:{q}?" for q in self.READBACK_QUERIES]
+        replies = None
+        if self._burst_queries:
+            try:
+                replies = query_burst(self, queries)
+            except Exception as e:
+                print(f"[ERROR] Query burst failed ({e}), reading one query at a time")
+                self._burst_queries = False
+                try:
+                    self.instr.instr.clear()
+                except Exception:
+                    pass
+        if replies is None:
+            replies = [self.ask(q) for q in queries]
+
+        parameters = {q: parse_response(reply) for q, reply in zip(self.READBACK_QUERIES, replies)}
+        self.readback.store(channel, parameters)
+        return parameters
+
     def get_frequency(self, channel): 
-        return self.ask(f"C{channel}:BSWV?")
+        return self.read_parameters(channel)["BSWV"].get("FRQ")
     
     def is_output_enabled(self, channel): 
-        return 'OUTP ON' in self.ask(f"C{channel}:OUTP?")
+        return self.read_parameters(channel)["OUTP"].get("STATE") == "ON"
 
     def get_reference_out(self):
         return self.ask(f"ROSC?")
@@ -88,29 +168,38 @@ class SDG6022X(SCPI.SCPIDevice):
         """
         Uploads a waveform to the Siglent AWG.
         Command: C1:WVDT WVNM,name,WAVEDATA,binary_block
+        Returns the transfer rate in bytes/s, or None if the same data was
+        already uploaded under this name and only the selection was sent.
         """
-        # Ensure data is float32
-        waveform = np.asarray(waveform, dtype=np.float32)
-        payload = waveform.tobytes()
-        
-        # 1. Prepare Header
-        byte_count = len(payload)
-        len_str = str(byte_count)
-        # IEEE 488.2 Header: # + digits_in_length + length
-        header = f"#{len(len_str)}{len_str}".encode("ascii")
-        
-        # 2. Prepare Command String
+        # 1. Prepare Command String
         # Siglent uses C1, C2 etc.
         cmd_str = f"C{channel}:WVDT WVNM,{name},WAVEDATA,"
         cmd_bytes = cmd_str.encode("ascii")
-        
-        # 3. Send Binary Block
-        # We write directly to the raw instrument to handle binary data safely
-        self.instr.instr.write_raw(cmd_bytes + header + payload)
-        self.write("*WAI")
+
+        # 2. Pack command, IEEE 488.2 header and float32 data into the reusable buffer
+        self._block.pack(cmd_bytes, waveform, "<f4")
+
+        key = (channel, name)
+        digest = self.upload_cache.digest(self._block.parts[2])
+        fmt = ("<f4", len(self._block.parts[2]) // 4)
+        if self.upload_cache.lookup(key, digest, fmt):
+            if Trace.enabled:
+                Trace.record(self, 'upload', f"{cmd_str}<{len(self._block.buffer)} bytes>", 0.0, "cached")
+            rate = None
+        else:
+            # 3. Send Binary Block
+            # We write directly to the raw instrument to handle binary data safely
+            self.flush_batch()
+            self.upload_cache.forget(key)
+            rate = write_block(self.instr.instr, self._block)
+            if Trace.enabled:
+                Trace.record(self, 'upload', f"{cmd_str}<{len(self._block.buffer)} bytes>", len(self._block.buffer) / rate)
+            self.write("*WAI")
+            self.upload_cache.store(key, digest, fmt)
         
         # 4. Select the uploaded wave
         self.write(f"C{channel}:ARWV NAME,{name}")
+        return rate
 
     def set_sample_rate(self, sample_rate, channel=1):
         """Sets sample rate in Sa/s"""
@@ -169,48 +258,17 @@ def SDG60ConfPRBS(instr, channel, bit_rate_period, bit_rate, period, amp, offset
 
     full_command = ",".join(cmd_parts)
     
-    print(f"[SENT] {full_command}")
     
     instr.write(full_command)
 
 @register_command
 def SDG60ConfSTDWFM(instr, **kwargs):
 
-    channel = kwargs.get('channel', 1)
-    wv_type = kwargs.get('waveform_type', 'SINE') 
-    
-    cmd_parts = [f"C{channel}:BSWV WVTP,{wv_type}"]
+    # Frequency or period, as selected by is_freq_mode
+    kwargs.pop('period' if kwargs.pop('is_freq_mode', True) else 'freq', None)
 
-    is_freq_mode = kwargs.get('is_freq_mode', True)
-    
-    if is_freq_mode:
-        if 'freq' in kwargs:
-            cmd_parts.append(f"FRQ,{kwargs['freq']:#.12g}")
-    else:
-        if 'period' in kwargs:
-            cmd_parts.append(f"PERI,{kwargs['period']:#.12g}")
-
-    # 3. Dynamic Parameter Mapping
-    param_map = {
-        'amp': 'AMP',
-        'offset': 'OFST',
-        'phase': 'PHSE',
-        'duty_cycle': 'DUTY',
-        'ramp_symmetry': 'SYM',
-        'pulse_width': 'WIDTH',
-        # Add 'edge_time' here if standard waveforms (like Pulse) need it later
-        'edge_time': 'EDGE' 
-    }
-
-    for json_key, scpi_key in param_map.items():
-        if json_key in kwargs:
-            value = kwargs[json_key]
-            # Append formatted string
-            cmd_parts.append(f"{scpi_key},{value:#.12g}")
-
-    # 5. Join and Send
-    full_command = ",".join(cmd_parts)
-    print(f"[SENT] {full_command}")
+    # Template for this set of keys compiled once, see command_specs.SDG60_SPECS
+    full_command = SDG60_SPECS['SDG60ConfSTDWFM'](**kwargs)
     instr.write(full_command)
 
 @register_command
@@ -251,7 +309,6 @@ def SDG60ConfPulse1(instr,kwargs):
         cmd_parts.append(f"EDGE,{kwargs['delay_time']:#.12g}")
 
     full_command = ",".join(cmd_parts)
-    print(f"[SENT] {full_command}")
     instr.write(full_command)
 
 
@@ -268,7 +325,6 @@ def SDG60LoadPolarity(instr, kwargs):
         cmd_parts.append(f"PLRT,{kwargs['polarity']}")
     full_command = ",".join(cmd_parts)
     full_command = f"{Base_cmd} {full_command}"
-    print(f"[SENT] {full_command}")
     
     instr.write(full_command)
 
@@ -283,18 +339,15 @@ def SDG60ModulationOff(instr, channel, OUTPUT_ENABLED):
 
     full_command = ",".join(cmd_parts)
     full_command = f"{base_cmd} {full_command}"
-    print(f"[SENT] {full_command}")
 
     instr.write(full_command)
 
 def SDG60Trg(instr):
     full_command = "%.;BTWV MTRIG"
-    print(f"[SENT] {full_command}")
     instr.write(full_command)
 
 def SDG60SelectChannel(instr, channel):
     full_command = f"C{channel}:BSWV"
-    print(f"[SENT] {full_command}")
     instr.write(full_command)
     time.sleep(0.5)
 
@@ -324,11 +377,11 @@ def SDG60SelectArbitraryWFM(instr, **kwargs):
         arb_name = f"ARB{arb_num}"
         
         cmd = f"C{channel}:ARWV NAME,{arb_name}"
-        print(f"[SENT] {cmd}")
+        clear_events(instr)
         instr.write(cmd)
         
-        print("Waiting 3.0s for User Arb load...")
-        time.sleep(3.0)
+        # The settle time is kept in completion.settle_times
+        wait_complete(instr, instr.MODEL, "ARWV", deadline=10.0)
 
     # --- CASE 2: Built-in Waveform ---
     elif 'builtin_index' in kwargs:
@@ -348,7 +401,6 @@ def SDG60SelectArbitraryWFM(instr, **kwargs):
             index = int(raw_input)
 
         cmd = f"C{channel}:ARWV INDEX,{index}"
-        print(f"[SENT] {cmd}")
         instr.write(cmd)
 
     else:
@@ -358,41 +410,9 @@ def SDG60SelectArbitraryWFM(instr, **kwargs):
 @register_command
 def SDG60ReadParameters(instr, **kwargs):
     channel = kwargs.get('channel', 1)
-    queries = ["BSWV", "MDWV", "SWWV", "BTWV", "SRATE"]
-    
-    base_cmd = f"C{channel}:"
-    results = {}
-
-    print(f"--- Reading Parameters for Channel {channel} ---")
-
-    for q in queries:
-        # 1. ADD \n HERE 
-        # The instrument needs this to know the command is finished.
-        full_command = f"{base_cmd}{q}?\n"
-        
-        try:
-            # 2. Write (Frame 1)
-            instr.write(full_command)
-            
-            # 3. Wait (Frame 2)
-            time.sleep(0.1) 
-            
-            # 4. Read (Frame 3)
-            raw_response = instr.read()
-            results[q] = raw_response.strip()
-
-        except Exception as e:
-            print(f"[ERROR] Failed to read {q}: {e}")
-            results[q] = "ERROR"
-            
-            # OPTIONAL: Clear the buffer if an error occurs so it doesn't jam the next one
-            try:
-                instr.instr.clear()
-            except:
-                pass
 
-    print(f"[RESPONSE] {results}")
-    return results
+    # Parsed {query: {KEY: value}}, units stripped; max_age=0 always reads the instrument
+    return instr.read_parameters(channel, max_age=kwargs.get('max_age'))
 
 @register_command
 def SDG60ReadArbitraryWFMQ(instr,waveform_name):
@@ -402,7 +422,6 @@ def SDG60ReadArbitraryWFMQ(instr,waveform_name):
     cmd_parts.append(f"{waveform_name}")
     full_command = ",".join(cmd_parts)
     base_cmd = f"{base_cmd}{full_command}"
-    print(f"[SENT] {base_cmd}")
     response = instr.ask(base_cmd)
     print(f"[RESPONSE] {response}")
     return response  
@@ -414,16 +433,15 @@ def SDG60Initialize(instr, **kwargs):
 
     print("--- Initializing Instrument ---")
     time.sleep(1.0)
-    for channel in [1, 2]:
-        if should_be_on:
-            cmd = f"C{channel}:OUTP ON"
-        else:
-            cmd = f"C{channel}:OUTP OFF"
-            
-        print(f"[SENT] {cmd}")
-        instr.write(cmd + "\n")
-        time.sleep(0.2)
-    print(f"[SENT] *RST")
+    with instr.batch():
+        for channel in [1, 2]:
+            if should_be_on:
+                cmd = f"C{channel}:OUTP ON"
+            else:
+                cmd = f"C{channel}:OUTP OFF"
+                
+            instr.write(cmd + "\n")
+    instr.upload_cache.clear()
     instr.write("*RST\n") 
 
 @register_command
@@ -448,7 +466,6 @@ def SDG60ConfNoise(instr, channel, std_dev, voltage_mean, is_bandstate, bandwidt
         cmd_parts.append("BANDSTATE,OFF")
 
     full_command = ",".join(cmd_parts)
-    print(f"[SENT] {full_command}")
     instr.write(full_command)
 
 
@@ -472,7 +489,6 @@ def SDG60ConfArbWaveform3(instr, **kwargs):
         cmd_parts.append(f"PHSE,{kwargs.get('phase', 0.0):#.15g}")
         
         full_cmd = f"C{channel}:BSWV {','.join(cmd_parts)}"
-        print(f"[SENT] {full_cmd}")
         instr.write(full_cmd)
     else:
         interp_idx = kwargs.get('interpolation_index', 1) 
@@ -491,7 +507,6 @@ def SDG60ConfArbWaveform3(instr, **kwargs):
             interp_str = "LINE" if interp_idx == 1 else "HOLD"
             cmd = f"C{channel}:SRATE MODE,TARB,INTER,{interp_str},VALUE,{val_to_send:#.15g}"
 
-        print(f"[SENT] {cmd}")
         instr.write(cmd)
         time.sleep(0.1)
 
@@ -507,7 +522,6 @@ def SDG60ConfArbWaveform3(instr, **kwargs):
         cmd_parts.append(f"PHSE,{kwargs.get('phase', 0.0):#.15g}")
         
         full_cmd = f"C{channel}:BSWV {','.join(cmd_parts)}"
-        print(f"[SENT] {full_cmd}")
         instr.write(full_cmd)
         time.sleep(0.1)
 
@@ -523,7 +537,6 @@ def SDG60ConfArbWaveform3(instr, **kwargs):
             print(f"--- Triggering VKEY Sequence for Interpolation {interp_idx} ---")
             for key in sequence:
                 cmd = f"VKEY VALUE,{key},STATE,1"
-                print(f"[SENT] {cmd}")
                 instr.write(cmd)
                 time.sleep(0.3)
 
@@ -553,7 +566,6 @@ def SDG60ConfBurst2(instr, **kwargs):
 
     if not enable:
         full_command = f"C{channel}:BTWV {','.join(cmd_parts)}"
-        print(f"[SENT] {full_command}")
         instr.write(full_command)
         return
 
@@ -632,7 +644,6 @@ def SDG60ConfBurst2(instr, **kwargs):
 
     # --- Send ---
     full_command = f"C{channel}:BTWV {','.join(cmd_parts)}"
-    print(f"[SENT] {full_command}")
     instr.write(full_command)
 
 @register_command
@@ -643,11 +654,9 @@ def SDG60OutputOnOff(instr, channel, OUTPUT_ENABLED):
     if OUTPUT_ENABLED:
         cmd_parts.append("ON")
         full_command = f"C{channel}:OUTP {'ON'}"
-        print(f"[SENT] {full_command}")
     else:
         cmd_parts.append("OFF")
         full_command = f"C{channel}:OUTP {'OFF'}"
-        print(f"[SENT] {full_command}")
     instr.write(full_command)
 
 
@@ -0,0 +1,253 @@
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class ChannelState:
+    """Last known settings of one channel, None where the driver has not set it since the last reset."""
+    waveform: Optional[str] = None
+    frequency: Optional[str] = None
+    amplitude: Optional[str] = None
+    offset: Optional[str] = None
+    burst: Optional[str] = None
+    modulation: Optional[str] = None
+    output: Optional[str] = None
+    load: Optional[str] = None
+
+
+ALL = "*"       # forget() channel: every channel
+
+
+class Shadow:
+    """
+    Settings sent to an instrument, per channel, as {key: value} strings.
+
+    Keys are driver specific ("BSWV:FRQ" on the SDG6022X, "SOUR:FREQ" on the
+    33600A) and fields maps the ChannelState attributes onto them. Channel None
+    holds the settings that are not per channel.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields        # { "frequency": "BSWV:FRQ", ... }
+        self.channels = {}          # { 1: {"BSWV:FRQ": "1000", ...}, None: {"ROSC": "INT"} }
+        self.sent = 0
+        self.elided = 0
+
+    def get(self, channel, key):
+        return self.channels.get(channel, {}).get(key)
+
+    def set(self, channel, key, value):
+        self.channels.setdefault(channel, {})[key] = value
+
+    def forget(self, channel, prefix=""):
+        """Drop the settings of channel (every channel for ALL) whose key starts with prefix."""
+        for c in (list(self.channels) if channel is ALL else [channel]):
+            settings = self.channels.get(c, {})
+            for key in [key for key in settings if key.startswith(prefix)]:
+                del settings[key]
+
+    def clear(self):
+        self.channels.clear()
+
+    def state(self, channel):
+        return ChannelState(**{field: self.get(channel, key) for field, key in self.fields.items()})
+
+    def stats(self):
+        return {'sent': self.sent, 'elided': self.elided}
+
+
+# ------------------------------------------------------------------
+# Message filters: drop the settings the shadow already holds
+# ------------------------------------------------------------------
+
+def _filter(shadow, pieces, resets, build):
+    """
+    pieces: [(channel, [(key, value), ...] or None, text)], None for pieces that are always sent.
+    An always sent piece may carry a 4th element, the [(channel, prefix)] settings
+    it changes on the instrument: they are sent again after it and forgotten.
+    Returns the pieces to send (rebuilt through build), and the updates and resets
+    to apply once they were sent.
+    """
+    # A changed waveform type or load may change other settings on the instrument, send those as they come
+    reset = {
+        (channel, prefix) for channel, settings, *_ in pieces if settings
+        for key, value in settings for prefix, trigger in resets
+        if key == trigger and shadow.get(channel, key) != value
+    }
+    send, updates = [], []
+    for channel, settings, text, *forgets in pieces:
+        if settings is None:
+            changed = forgets[0] if forgets else ()
+        else:
+            changed = [(channel, prefix) for key, value in settings for prefix, trigger in resets
+                       if key == trigger and shadow.get(channel, key) != value]
+        for c, prefix in changed:
+            # What was set before the change is unknown after it
+            updates = [u for u in updates if not (c in (ALL, u[0]) and u[1].startswith(prefix))]
+            reset.add((c, prefix))
+        if settings is None:
+            send.append(text)
+            continue
+        kept = [
+            (key, value) for key, value in settings
+            if shadow.get(channel, key) != value or any(
+                c in (ALL, channel) and key.startswith(prefix) for c, prefix in reset)
+        ]
+        shadow.elided += len(settings) - len(kept)
+        updates += [(channel, key, value) for key, value in settings]
+        if kept:
+            send.append(build(text, kept))
+    return send, updates, reset
+
+
+def apply_updates(shadow, updates, reset):
+    for channel, prefix in reset:
+        shadow.forget(channel, prefix)
+    for channel, key, value in updates:
+        shadow.set(channel, key, value)
+
+
+# C1:BSWV FRQ,1000,AMP,2 -> (1, "BSWV", "FRQ,1000,AMP,2")
+_SIGLENT = re.compile(r"^(?:C(\d+):)?([A-Z]+)\s+(.+)$", re.IGNORECASE)
+SIGLENT_PAIRS = {'BSWV', 'BTWV', 'OUTP'}        # arguments are KEY,value pairs
+SIGLENT_EVENTS = {      # actions, always sent: { command: prefix of the settings it changes, None for none }
+    'ARWV': 'BSWV:',    # loading an arbitrary waveform changes the basic wave of its channel
+    'VKEY': '',         # front panel keys may change anything
+    'WVDT': None,
+}
+SIGLENT_RESETS = (     # (prefix of the settings, the setting that changes them)
+    ("BSWV:", "BSWV:WVTP"),
+    # Amplitude and offset are rescaled to the new load
+    *((prefix, "OUTP:LOAD") for prefix in ("BSWV:AMP", "BSWV:OFST", "BSWV:HLEV", "BSWV:LLEV")),
+)
+
+
+def siglent_filter(shadow, msg):
+    """Filter a SDG6022X message (commands separated by ';')."""
+    pieces = []
+    for text in filter(None, (piece.strip() for piece in msg.split(";"))):
+        match = _SIGLENT.match(text)
+        if text.startswith("*") or text.endswith("?") or match is None:
+            pieces.append((None, None, text))
+            continue
+        channel, command, args = match.groups()
+        channel = int(channel) if channel else None
+        command = command.upper()
+        fields = [field.strip() for field in args.split(",")]
+        if command in SIGLENT_EVENTS:
+            prefix = SIGLENT_EVENTS[command]
+            forgets = [] if prefix is None else [(ALL if command == 'VKEY' else channel, prefix)]
+            pieces.append((channel, None, text, forgets))
+            continue
+        if args.strip().upper() == 'MTRIG':
+            settings = None
+        elif command == 'OUTP' and fields[0].upper() in ('ON', 'OFF'):
+            fields = ['STATE'] + fields
+            settings = None if len(fields) % 2 else list(zip(fields[::2], fields[1::2]))
+        elif command in SIGLENT_PAIRS and len(fields) % 2 == 0:
+            settings = list(zip(fields[::2], fields[1::2]))
+        else:
+            settings = [("", args.strip())]
+        if settings is not None:
+            settings = [(f"{command}:{key.upper()}" if key else command, value) for key, value in settings]
+        pieces.append((channel, settings, text))
+
+    def build(text, kept):
+        head = text.split(None, 1)[0]
+        command = head.split(":")[-1].upper()
+        if len(kept) == 1 and kept[0][0] == command:
+            return f"{head} {kept[0][1]}"
+        args = [(key.split(":", 1)[1], value) for key, value in kept]
+        return f"{head} " + ",".join(value if key == 'STATE' else f"{key},{value}" for key, value in args)
+
+    return (pieces, SIGLENT_RESETS, build)
+
+
+# :SOUR1:FREQ 1000 -> (1, "SOUR:FREQ", "1000")
+_SCPI = re.compile(r"^:?([A-Z*][A-Z0-9:]*?)\s+(.+)$", re.IGNORECASE)
+SCPI_EVENTS = ('SOUR:FUNC:ARB', 'DATA', 'MMEM', 'DISP')   # loads and memory operations, always sent
+SCPI_RESETS = (("SOUR:", "SOUR:FUNC"), ("SOUR:VOLT", "OUTP:LOAD"))     # SOUR:VOLT* are rescaled to the new load
+
+
+def scpi_filter(shadow, msg):
+    """Filter a 33600A message (full headers separated by ';:'), every piece is sent from the root."""
+    pieces = []
+    for text in filter(None, (piece.strip() for piece in msg.split(";"))):
+        text = re.sub(r":\s+", ":", text.lstrip(":"))
+        match = _SCPI.match(text)
+        if not text.startswith("*"):
+            text = ":" + text
+        if text.startswith("*") or text.endswith("?") or match is None:
+            pieces.append((None, None, text))
+            continue
+        header, value = match.groups()
+        first, sep, rest = value.partition(" ")
+        if sep and ":" in first and not first.startswith('"'):
+            # "SOUR1:FUNC ARB:FILT NORM" sets SOUR1:FUNC:ARB:FILT
+            header, value = f"{header}:{first}", rest
+        nodes = header.upper().split(":")
+        channel = None
+        for i, node in enumerate(nodes):
+            if (digits := re.search(r"\d+$", node)):
+                channel, nodes[i] = int(digits.group()), node[:digits.start()]
+                break
+        key = ":".join(nodes)
+        if key.startswith(SCPI_EVENTS):
+            pieces.append((None, None, text))
+        else:
+            pieces.append((channel, [(key, value.strip())], text))
+
+    def build(text, kept):
+        return text
+
+    return (pieces, SCPI_RESETS, build)
+
+
+class ShadowMixin:
+    """
+    Keeps a Shadow of the settings written to the instrument and leaves out the ones it already has.
+
+    SHADOW_FILTER splits a message into settings (siglent_filter or scpi_filter)
+    and what is left is sent joined with ';'. *RST, a reconnect or a failed write
+    forget everything, events (ARWV, VKEY) the settings they change; call
+    _init_shadow before the base class connects.
+    """
+    SHADOW_FILTER = None
+    SHADOW_FIELDS = {}
+
+    def _init_shadow(self):
+        self.shadow = Shadow(self.SHADOW_FIELDS)
+
+    def write(self, msg, *args, **kwargs):
+        if args or kwargs or not isinstance(msg, str):
+            # Formatted writes are not tracked, their effect is unknown
+            self.shadow.clear()
+            return super().write(msg, *args, **kwargs)
+
+        pieces, resets, build = self.SHADOW_FILTER(self.shadow, msg)
+        send, updates, reset = _filter(self.shadow, pieces, resets, build)
+        if not send:
+            return None
+        try:
+            result = super().write(";".join(send))
+        except Exception:
+            self.shadow.clear()
+            raise
+        self.shadow.sent += 1
+        if any(text.upper().startswith("*RST") for text in send):
+            self.shadow.clear()
+        else:
+            apply_updates(self.shadow, updates, reset)
+        return result
+
+    def invalidate_shadow(self):
+        self.shadow.clear()
+
+    def channel_state(self, channel):
+        """Typed view of the last known settings of channel."""
+        return self.shadow.state(channel)
+
+    def shadow_stats(self):
+        """Number of writes sent and of settings left out because the instrument already had them."""
+        return self.shadow.stats()
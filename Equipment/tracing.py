@@ -0,0 +1,41 @@
+import time
+from functools import partial
+
+from core import Trace
+
+
+class TraceMixin:
+    """
+    Records the messages exchanged with the instrument in core.Trace while tracing is enabled.
+
+    Goes right before the pylablib base class, so it sees what is actually sent
+    (after batching and shadow elision).
+    """
+
+    def write(self, msg, *args, **kwargs):
+        if not Trace.enabled:
+            return super().write(msg, *args, **kwargs)
+        return Trace.timed(self, 'write', partial(super().write, msg, *args, **kwargs), msg)
+
+    def read(self, *args, **kwargs):
+        if not Trace.enabled:
+            return super().read(*args, **kwargs)
+        return self._traced_reply('read', None, partial(super().read, *args, **kwargs))
+
+    def ask(self, msg, *args, **kwargs):
+        if not Trace.enabled:
+            return super().ask(msg, *args, **kwargs)
+        return self._traced_reply('ask', msg, partial(super().ask, msg, *args, **kwargs))
+
+    def _traced_reply(self, kind, msg, func):
+        # The query goes in as a write event, the reply as the event of the read
+        if msg is not None:
+            Trace.record(self, 'write', msg, 0.0)
+        start = time.perf_counter()
+        try:
+            reply = func()
+        except Exception as e:
+            Trace.record(self, 'read', None, time.perf_counter() - start, f"{type(e).__name__}: {e}")
+            raise
+        Trace.record(self, 'read', reply if isinstance(reply, str) else repr(reply), time.perf_counter() - start)
+        return reply
@@ -0,0 +1,46 @@
+import hashlib
+
+
+class UploadCache:
+    """
+    What is currently in the volatile waveform slots of one instrument.
+
+    Every slot is keyed by (channel, slot) and remembers the hash of the bytes
+    that were sent plus the format they were sent in, so an upload of the same
+    content to the same slot can be skipped. Anything that may have changed the
+    instrument memory (clear, *RST, reconnect, a failed upload) has to forget
+    the affected slots.
+    """
+
+    def __init__(self):
+        self.slots = {}     # { (1, 3): (<digest>, ("<i2", 4000000)) }
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(payload):
+        return hashlib.blake2b(payload, digest_size=16).digest()
+
+    def lookup(self, key, digest, fmt):
+        """True (and counted as a hit) if key already holds this content in this format."""
+        if self.slots.get(key) == (digest, fmt):
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def store(self, key, digest, fmt):
+        self.slots[key] = (digest, fmt)
+
+    def forget(self, key):
+        self.slots.pop(key, None)
+
+    def clear(self, channel=None):
+        """Forget every slot, or only the slots of one channel."""
+        if channel is None:
+            self.slots.clear()
+        else:
+            self.slots = {key: value for key, value in self.slots.items() if key[0] != channel}
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'slots': len(self.slots)}
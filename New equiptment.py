@@ -1,31 +1,12 @@
-import pyvisa
-import socket
-
-rm = pyvisa.ResourceManager(visa_library='@py')
-
-
-for r in rm.list_resources():
-    print(f"Original: {r}")
-
-    if not r.startswith("TCPIP"):
-        continue
-
-    parts = r.split("::")
-
-    # parts example:
-    # ['TCPIP0', 'A-33622A-00172.local', 'inst0', 'INSTR']
-
-    host = parts[1]
-
-    try:
-        ip = socket.gethostbyname(host)
-
-        # replace hostname with IP, keep inst0 and INSTR
-        ip_resource = "::".join([parts[0], ip, *parts[2:]])
-
-        print(f"IP VISA:  {ip_resource}")
-
-    except OSError:
-        print("IP VISA:  <hostname unresolved>")
-
-    print()
\ No newline at end of file
+import sys
+
+from core import Discovery
+
+# python "New equiptment.py" [169.254.11.0/24 ...]
+# Lists the VISA TCPIP resources and any hosts/networks given, probes them all at once
+# and updates the instrument cache used by main.py
+for resource, instrument in Discovery.discover(sys.argv[1:]).items():
+    print(f"{instrument.idn}")
+    print(f"IP VISA:  {resource}")
+    print(f"Driver:   {instrument.driver or '<none>'}")
+    print()
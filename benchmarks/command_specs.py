@@ -0,0 +1,85 @@
+"""
+Micro-benchmark of the command paths for a parameter scan, no instrument needed.
+
+    python -m benchmarks.command_specs [calls]
+
+Compares the pydantic validated A33ConfigureWFM call with the compiled spec
+(validated and fast path) and a precomputed ScanPlan, and the same for
+SDG60ConfSTDWFM.
+"""
+import contextlib
+import io
+import sys
+import time
+
+import numpy as np
+
+from Equipment.agilent33600A import Agilent33600A
+from Equipment.command_specs import A33_SPECS, SDG60_SPECS, ScanPlan
+from Equipment.sdg6022x import SDG60ConfSTDWFM
+
+
+class Sink:
+    """Stands in for a driver, keeps the last command written."""
+
+    def write(self, msg):
+        self.last = msg
+
+
+def _time(label, calls, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed / calls * 1e6:8.2f} us/call")
+    return elapsed / calls
+
+
+def run(calls=20_000):
+    sink = Sink()
+    freqs = np.linspace(1e3, 1e6, calls)
+    rows = [dict(channel=1, waveform=0, amplitude=1.0, dc_offset=0.0, frequency_bw_bitrate=float(f), phase=0.0) for f in freqs]
+    spec = A33_SPECS['A33ConfigureWFM']
+
+    def pydantic_path():
+        for row in rows:
+            Agilent33600A.A33ConfigureWFM(sink, **row)
+
+    def spec_validated():
+        for row in rows:
+            sink.write(spec(**row))
+
+    def spec_fast():
+        for row in rows:
+            sink.write(spec.format(**row))
+
+    plan = ScanPlan(spec, rows)
+
+    print(f"A33ConfigureWFM, {calls} calls")
+    results = {
+        'A33 pydantic': _time("  A33ConfigureWFM (pydantic validate_call)", calls, pydantic_path),
+        'A33 spec': _time("  spec, validated", calls, spec_validated),
+        'A33 fast': _time("  spec, fast path (no validation)", calls, spec_fast),
+        'A33 plan': _time("  ScanPlan.run (precomputed)", calls, lambda: plan.run(sink)),
+    }
+
+    std_rows = [dict(channel=1, waveform_type='SINE', freq=float(f), amp=1.0, offset=0.0) for f in freqs]
+    std_spec = SDG60_SPECS['SDG60ConfSTDWFM']
+
+    def sdg_command():
+        # The registered command prints every command it sends
+        with contextlib.redirect_stdout(io.StringIO()):
+            for row in std_rows:
+                SDG60ConfSTDWFM(sink, **row)
+
+    std_plan = ScanPlan(std_spec, std_rows)
+    print(f"SDG60ConfSTDWFM, {calls} calls")
+    results.update({
+        'SDG command': _time("  registered command (incl. print)", calls, sdg_command),
+        'SDG fast': _time("  spec, fast path", calls, lambda: [sink.write(std_spec.format(**row)) for row in std_rows]),
+        'SDG plan': _time("  ScanPlan.run (precomputed)", calls, lambda: std_plan.run(sink)),
+    })
+    return results
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000)
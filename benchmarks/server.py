@@ -0,0 +1,235 @@
+"""
+End to end benchmark of the control server: client -> ZMQ -> main.py ->
+handle_tcp -> driver -> socket -> emulated instrument (core.Emulator).
+
+    python -m benchmarks.server [--scale 1.0] [--output benchmarks/results.jsonl]
+
+Starts an SDG6022X and a 33600A emulator, runs main.py against them and
+drives it with the workloads below, each from its own client threads:
+
+    config_storm        one client, small SDG60ConfSTDWFM commands back to back
+    concurrent_clients  8 clients, configure commands for both instruments
+    mixed_upload        one client uploading waveforms to the SDG6022X while
+                        another configures the 33600A
+    binary_upload       the same, the waveforms sent as core.Wire array frames
+
+For every scenario it reports commands/s, p50/p99 latency per kind of request
+and the bytes that went over ZMQ and to the instruments, and appends the run
+(with the git commit) to the results file as one JSON line, so runs on
+different commits can be compared. The previous run is printed alongside.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import zmq
+
+from benchmarks.startup import RESULTS_PATH, ROOT, SERVER_PORT, _commit, _listening
+from core import Wire
+from core.Emulator import Agilent33600AEmulator, EmulatorServer, SDG6022XEmulator
+
+SDG_PORT = 5225
+A33_PORT = 5226
+
+
+class Client:
+    """One REQ connection to the server, timing every request."""
+
+    def __init__(self, context):
+        self.socket = context.socket(zmq.REQ)
+        self.socket.connect(f"tcp://127.0.0.1:{SERVER_PORT}")
+        self.latencies = {}         # { "config": [seconds, ...] }
+        self.bytes = 0
+        self.failed = 0
+
+    def request(self, kind, message, binary=False):
+        start = time.perf_counter()
+        frames = Wire.encode(message) if binary else [json.dumps(message).encode()]
+        self.socket.send_multipart(frames, copy=False)
+        reply = self.socket.recv_multipart(copy=False)
+        self.latencies.setdefault(kind, []).append(time.perf_counter() - start)
+        self.bytes += sum(memoryview(f).nbytes for f in frames) + sum(len(f) for f in reply)
+        if (Wire.decode(reply)['status'] if binary else reply[0].bytes) in ('Failed', b'Failed'):
+            self.failed += 1
+
+    def close(self):
+        self.socket.close(linger=0)
+
+
+# ------------------------------------------------------------------
+# Workloads: each yields (kind, message) or (kind, message, binary) for one client
+# ------------------------------------------------------------------
+
+def sdg_configs(count, offset=0):
+    for i in range(count):
+        yield "sdg_config", {'cmd': 'SDG60ConfSTDWFM', 'instrument': 'SDG', 'channel': 1 + i % 2,
+                             'waveform_type': 'SINE', 'freq': 1000.0 + offset + i, 'amp': 1.0}
+
+
+def a33_configs(count, offset=0):
+    for i in range(count):
+        yield "a33_config", {'cmd': 'A33ConfigureWFM', 'instrument': 'A33', 'channel': 1 + i % 2, 'waveform': 0,
+                             'amplitude': 1.0, 'dc_offset': 0.0, 'frequency_bw_bitrate': 1000.0 + offset + i, 'phase': 0.0}
+
+
+def mixed_configs(count, offset=0):
+    sdg, a33 = sdg_configs(count, offset), a33_configs(count, offset)
+    for i in range(count):
+        yield next(sdg) if i % 2 else next(a33)
+
+
+def sdg_uploads(count, samples, binary=False, seed=0):
+    rng = np.random.default_rng(seed)
+    for i in range(count):
+        # New data every time, so the upload cache does not skip it
+        waveform = rng.uniform(-1, 1, samples).round(6)
+        yield "sdg_upload", {'cmd': 'upload_custom_waveform', 'instrument': 'SDG', 'name': f'bench{i % 4}',
+                             'waveform': waveform.astype('<f4') if binary else waveform.tolist(), 'channel': 1}, binary
+
+
+def scenarios(scale):
+    n = lambda count: max(1, int(count * scale))
+    return {
+        'config_storm': [sdg_configs(n(2000))],
+        'concurrent_clients': [mixed_configs(n(250), offset=1e5 * c) for c in range(8)],
+        'mixed_upload': [sdg_uploads(n(10), 200_000), a33_configs(n(500))],
+        'binary_upload': [sdg_uploads(n(10), 200_000, binary=True, seed=1), a33_configs(n(500))],
+    }
+
+
+# ------------------------------------------------------------------
+# Running
+# ------------------------------------------------------------------
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) * 1e3 if values else None
+
+
+def run_scenario(context, workloads, emulators):
+    clients = [Client(context) for _ in workloads]
+    wire_before = sum(e.bytes_in + e.bytes_out for e in emulators)
+    threads = [
+        threading.Thread(target=lambda c=c, w=w: [c.request(*request) for request in w])
+        for c, w in zip(clients, workloads)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = {}
+    for client in clients:
+        for kind, values in client.latencies.items():
+            latencies.setdefault(kind, []).extend(values)
+    requests = sum(len(values) for values in latencies.values())
+    result = {
+        'requests': requests,
+        'failed': sum(client.failed for client in clients),
+        'elapsed_s': elapsed,
+        'throughput_per_s': requests / elapsed,
+        'zmq_bytes': sum(client.bytes for client in clients),
+        'instrument_bytes': sum(e.bytes_in + e.bytes_out for e in emulators) - wire_before,
+        'latency_ms': {
+            kind: {'p50': _percentile(values, 50), 'p99': _percentile(values, 99), 'mean': statistics.fmean(values) * 1e3}
+            for kind, values in latencies.items()
+        },
+    }
+    for client in clients:
+        client.close()
+    return result
+
+
+def start_server(timeout=60):
+    if _listening(SERVER_PORT):
+        raise RuntimeError(f"Port {SERVER_PORT} is already in use")
+    env = dict(os.environ, QD_DEVICES=json.dumps({
+        'SDG': ['SDG6022X', f"TCPIP::127.0.0.1::{SDG_PORT}::SOCKET"],
+        'A33': ['Agilent33600A', f"TCPIP::127.0.0.1::{A33_PORT}::SOCKET"],
+    }))
+    server = subprocess.Popen([sys.executable, "main.py"], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    start = time.perf_counter()
+    while not _listening(SERVER_PORT):
+        if server.poll() is not None:
+            raise RuntimeError(f"main.py exited:\n{server.stderr.read().decode(errors='replace')[-2000:]}")
+        if time.perf_counter() - start > timeout:
+            server.kill()
+            raise TimeoutError(f"main.py did not listen within {timeout} s")
+        time.sleep(0.01)
+    return server
+
+
+def _previous(path):
+    try:
+        lines = Path(path).read_text().splitlines()
+    except OSError:
+        return None
+    for line in reversed(lines):
+        entry = json.loads(line)
+        if entry.get('benchmark') == 'server':
+            return entry
+    return None
+
+
+def report(name, result, previous):
+    before = (previous or {}).get('scenarios', {}).get(name)
+    change = ""
+    if before:
+        change = f"  (was {before['throughput_per_s']:.0f}/s on {previous.get('commit')})"
+    print(f"{name:<20} {result['requests']:6d} req  {result['throughput_per_s']:8.0f}/s{change}")
+    print(f"{'':<20} zmq {result['zmq_bytes'] / 1e6:8.2f} MB   instruments {result['instrument_bytes'] / 1e6:8.2f} MB"
+          f"   failed {result['failed']}")
+    for kind, latency in result['latency_ms'].items():
+        print(f"{'':<20} {kind:<12} p50 {latency['p50']:8.3f} ms   p99 {latency['p99']:8.3f} ms")
+
+
+def run(scale=1.0, output=RESULTS_PATH, command_latency=0.0, store_rate=200e6):
+    latency = dict(command_latency=command_latency, store_rate=store_rate)
+    emulators = [
+        EmulatorServer(SDG6022XEmulator(**latency), SDG_PORT, name="SDG6022X").start(),
+        EmulatorServer(Agilent33600AEmulator(**latency), A33_PORT, name="33600A").start(),
+    ]
+    server = None
+    context = zmq.Context.instance()
+    try:
+        server = start_server()
+        previous = _previous(output) if output else None
+        results = {}
+        for name, workloads in scenarios(scale).items():
+            results[name] = run_scenario(context, workloads, emulators)
+            report(name, results[name], previous)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        for emulator in emulators:
+            emulator.stop()
+
+    entry = {
+        'benchmark': 'server', 'commit': _commit(), 'time': time.time(), 'scale': scale,
+        'emulator': latency, 'python': sys.version.split()[0], 'scenarios': results,
+    }
+    if output:
+        with open(output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+        print(f"Results appended to {output}")
+    return entry
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the number of requests")
+    parser.add_argument("--output", default=str(RESULTS_PATH), help="JSONL file the run is appended to ('' for none)")
+    parser.add_argument("--command-latency", type=float, default=0.0, help="emulated seconds per SCPI command")
+    parser.add_argument("--store-rate", type=float, default=200e6, help="emulated bytes/s to store uploads")
+    args = parser.parse_args()
+    run(args.scale, args.output or None, args.command_latency, args.store_rate)
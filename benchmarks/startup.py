@@ -0,0 +1,143 @@
+"""
+Cold start benchmark, based on python -X importtime.
+
+    python -m benchmarks.startup [runs]
+
+Times the import of the server and of each driver in fresh interpreters and
+lists the heaviest packages, then starts main.py against the simulators
+(core/Test_instrument.py, started here if nothing listens on 5025) and times
+it from launch until the ROUTER socket accepts connections. Every run is
+appended (with the git commit) to benchmarks/results.jsonl as one JSON line,
+next to the benchmarks.server runs, so cold starts can be tracked over commits.
+"""
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+SERVER_PORT = 5555
+SIMULATOR_PORT = 5025
+RESULTS_PATH = ROOT / "benchmarks" / "results.jsonl"
+
+IMPORTS = {
+    "server": "import core.Server",
+    "Equipment (lazy)": "import Equipment",
+    "SDG6022X": "from Equipment import SDG6022X",
+    "Agilent33600A": "from Equipment import Agilent33600A",
+}
+
+
+def importtime(statement):
+    """(total seconds, {top level package: cumulative seconds}) of statement in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{statement!r} failed:\n{result.stderr[-2000:]}")
+    packages = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package, nested imports are indented
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if name.startswith("  ") or not cumulative.strip().isdigit():
+            continue
+        packages[name.strip()] = packages.get(name.strip(), 0) + int(cumulative) / 1e6
+    return sum(packages.values()), packages
+
+
+def _listening(port):
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=0.05):
+            return True
+    except OSError:
+        return False
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_simulator(timeout=60):
+    """Start core/Test_instrument.py and wait until it listens on SIMULATOR_PORT."""
+    start = time.perf_counter()
+    simulator = subprocess.Popen([sys.executable, "Test_instrument.py"], cwd=ROOT / "core",
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    while not _listening(SIMULATOR_PORT):
+        if simulator.poll() is not None:
+            raise RuntimeError(f"Test_instrument.py exited:\n{simulator.stderr.read().decode(errors='replace')[-2000:]}")
+        if time.perf_counter() - start > timeout:
+            simulator.kill()
+            simulator.wait()
+            raise TimeoutError(f"Test_instrument.py did not listen within {timeout} s")
+        time.sleep(0.05)
+    return simulator
+
+
+def time_to_listen(timeout=60):
+    """Seconds from launching main.py until its ROUTER socket accepts connections."""
+    if _listening(SERVER_PORT):
+        raise RuntimeError(f"Port {SERVER_PORT} is already in use")
+    env = dict(os.environ, QD_DEVICES=json.dumps({
+        "SDG6022X_Gen1": ["SDG6022X", f"TCPIP::127.0.0.1::{SIMULATOR_PORT}::SOCKET"],
+    }))
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "main.py"], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        while not _listening(SERVER_PORT):
+            if server.poll() is not None:
+                raise RuntimeError(f"main.py exited:\n{server.stderr.read().decode(errors='replace')[-2000:]}")
+            if time.perf_counter() - start > timeout:
+                raise TimeoutError(f"main.py did not listen within {timeout} s")
+            time.sleep(0.005)
+        return time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def run(runs=3, top=8, output=RESULTS_PATH):
+    results = {}
+    for label, statement in IMPORTS.items():
+        totals = []
+        for _ in range(runs):
+            total, packages = importtime(statement)
+            totals.append(total)
+        results[label] = statistics.median(totals)
+        heaviest = sorted(packages.items(), key=lambda item: -item[1])[:top]
+        print(f"{label:<20} {results[label] * 1e3:8.1f} ms   " +
+              ", ".join(f"{name} {seconds * 1e3:.0f}" for name, seconds in heaviest))
+
+    simulator = None if _listening(SIMULATOR_PORT) else start_simulator()
+    try:
+        results['main.py to listening'] = statistics.median(time_to_listen() for _ in range(runs))
+        print(f"{'main.py to listening':<20} {results['main.py to listening'] * 1e3:8.1f} ms")
+    finally:
+        if simulator is not None:
+            simulator.terminate()
+            simulator.wait()
+
+    if output:
+        entry = {
+            'benchmark': 'startup', 'commit': _commit(), 'time': time.time(), 'runs': runs,
+            'python': sys.version.split()[0], 'seconds': results,
+        }
+        with open(output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+        print(f"Results appended to {output}")
+    return results
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 3)
@@ -0,0 +1,200 @@
+"""
+Instrument discovery.
+
+discover() asks every candidate host for *IDN? on its raw SCPI port, all hosts
+at once, and maps the replies to driver classes through DRIVERS. What it
+finds is kept in CACHE_PATH, so the next start connects straight to the
+cached addresses (acquire) and only probes the network again when one of them
+does not answer.
+
+Candidates are the TCPIP resources VISA lists (hostnames resolved in
+parallel) plus any hosts or networks given, e.g. discover(["169.254.11.0/24"]).
+"""
+import importlib
+import ipaddress
+import json
+import re
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+DRIVERS = {     # { <regex on the *IDN? model field>: "module.Class" }, imported only when used
+    r"^SDG60\d\dX": "Equipment.sdg6022x.SDG6022X",
+    r"^336\d\dA$": "Equipment.agilent33600A.Agilent33600A",
+}
+
+CACHE_PATH = Path.home() / ".qd_experiment_control" / "instruments.json"
+SCPI_PORT = 5025
+
+
+class Instrument:
+    def __init__(self, host, idn, resource=None, driver=None, seen=None):
+        self.host = host
+        self.idn = idn
+        self.resource = resource or f"TCPIP::{host}::INSTR"
+        self.driver = driver if driver is not None else driver_for(idn)
+        self.seen = seen if seen is not None else time.time()
+
+    @property
+    def manufacturer(self):
+        return _idn_field(self.idn, 0)
+
+    @property
+    def model(self):
+        return _idn_field(self.idn, 1)
+
+    @property
+    def serial(self):
+        return _idn_field(self.idn, 2)
+
+    def driver_class(self):
+        if self.driver is None:
+            raise LookupError(f"No driver for {self.idn!r}")
+        module, _, name = self.driver.rpartition(".")
+        return getattr(importlib.import_module(module), name)
+
+    def to_dict(self):
+        return {'host': self.host, 'idn': self.idn, 'resource': self.resource, 'driver': self.driver, 'seen': self.seen}
+
+    def __repr__(self):
+        return f"Instrument({self.model} {self.serial} at {self.resource}, driver={self.driver})"
+
+
+def _idn_field(idn, index):
+    fields = [field.strip() for field in idn.split(",")]
+    return fields[index] if index < len(fields) else ""
+
+
+def driver_for(idn):
+    """'Siglent Technologies,SDG6022X,...' -> 'Equipment.sdg6022x.SDG6022X', None if unknown."""
+    model = _idn_field(idn, 1)
+    for pattern, driver in DRIVERS.items():
+        if re.search(pattern, model, re.IGNORECASE):
+            return driver
+    return None
+
+
+# ------------------------------------------------------------------
+# Probing
+# ------------------------------------------------------------------
+
+def probe(host, port=SCPI_PORT, timeout=1.0):
+    """*IDN? reply of the instrument at host, None if nothing answers in time."""
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as conn:
+            conn.settimeout(timeout)
+            conn.sendall(b"*IDN?\n")
+            reply = b""
+            while not reply.endswith(b"\n"):
+                chunk = conn.recv(1024)
+                if not chunk:
+                    break
+                reply += chunk
+    except OSError:
+        return None
+    reply = reply.decode(errors='replace').strip()
+    return reply or None
+
+
+def _resolve(resource):
+    # 'TCPIP0::A-33622A-00172.local::inst0::INSTR' -> ('169.254.11.23', <resource with the IP>)
+    parts = resource.split("::")
+    try:
+        ip = socket.gethostbyname(parts[1])
+    except OSError:
+        return None
+    return ip, "::".join([parts[0], ip, *parts[2:]])
+
+
+def visa_candidates(executor, visa_library="@py"):
+    """{ip: resource} of the TCPIP resources VISA lists, names resolved in parallel."""
+    import pyvisa
+    resources = [r for r in pyvisa.ResourceManager(visa_library).list_resources() if r.upper().startswith("TCPIP")]
+    return dict(filter(None, executor.map(_resolve, resources)))
+
+
+def _hosts(spec):
+    # '169.254.11.23', 'sdg.local' or '169.254.11.0/24'
+    try:
+        network = ipaddress.ip_network(spec, strict=False)
+    except ValueError:
+        return [spec]
+    return [str(ip) for ip in network.hosts()] if network.num_addresses > 1 else [str(network.network_address)]
+
+
+def discover(hosts=(), use_visa=True, timeout=1.0, workers=64, path=CACHE_PATH):
+    """Probe every candidate in parallel, cache and return the instruments that answered as {resource: Instrument}."""
+    cache = load_cache(path) if path is not None else {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="discovery") as executor:
+        candidates = {}     # { host: VISA resource or None }
+        if use_visa:
+            try:
+                candidates.update(visa_candidates(executor))
+            except Exception as e:
+                print(f"VISA resource listing failed: {e}")
+        for spec in hosts:
+            for host in _hosts(spec):
+                candidates.setdefault(host, None)
+        for instrument in cache.values():
+            candidates.setdefault(instrument.host, instrument.resource)
+
+        start = time.perf_counter()
+        replies = executor.map(lambda host: probe(host, timeout=timeout), candidates)
+        found = {}
+        for (host, resource), idn in zip(candidates.items(), replies):
+            if idn is not None:
+                instrument = Instrument(host, idn, resource)
+                found[instrument.resource] = instrument
+        print(f"Probed {len(candidates)} hosts in {time.perf_counter() - start:.2f} s, found {len(found)} instruments")
+
+    if path is not None:
+        # Cached instruments that were probed and did not answer are gone (or moved)
+        cache = {r: i for r, i in cache.items() if i.host not in candidates}
+        cache.update(found)
+        save_cache(cache, path)
+    return found
+
+
+# ------------------------------------------------------------------
+# Cache
+# ------------------------------------------------------------------
+
+def load_cache(path=CACHE_PATH):
+    try:
+        entries = json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return {}
+    return {resource: Instrument(**entry) for resource, entry in entries.items()}
+
+
+def save_cache(instruments, path=CACHE_PATH):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps({resource: i.to_dict() for resource, i in instruments.items()}, indent=2))
+    tmp.replace(path)
+
+
+def _matches(instrument, cls, serial):
+    if serial is not None and instrument.serial != serial:
+        return False
+    return cls is None or instrument.driver == f"{cls.__module__}.{cls.__qualname__}"
+
+
+def acquire(pool, name, cls=None, serial=None, hosts=(), path=CACHE_PATH, **discover_kwargs):
+    """
+    Open the instrument for name through pool: the cached one of class cls (and
+    serial) first, and after probing again if the cache has none or it does not answer.
+    """
+    taken = {entry.addr for entry in pool.entries.values()}
+    for attempt in ("cache", "discovery"):
+        instruments = load_cache(path) if attempt == "cache" else discover(hosts, path=path, **discover_kwargs)
+        for instrument in instruments.values():
+            if instrument.resource in taken or not _matches(instrument, cls, serial):
+                continue
+            try:
+                return pool.acquire(name, cls or instrument.driver_class(), instrument.resource)
+            except Exception as e:
+                print(f"[{name}] {instrument.resource} from the {attempt} did not connect: {e}")
+    raise LookupError(f"No reachable instrument for {name} (class {getattr(cls, '__name__', cls)}, serial {serial})")
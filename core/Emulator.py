@@ -0,0 +1,601 @@
+"""
+Stateful SCPI emulators of the SDG6022X and the 33600A, for working on the
+drivers without hardware.
+
+Unlike Test_instrument.py they parse what the drivers send (';' and ';:'
+chains, Siglent C{n}:BSWV KEY,value lists, IEEE 488.2 #N<len><data> blocks),
+keep per channel settings and answer queries (*IDN?, *OPC?, *ESR?, SYST:ERR?,
+C1:BSWV?, SOUR1:FREQ?, ...). Latency is configurable, so upload and polling
+code can be timed:
+
+    command_latency   seconds added to every command (latencies: per header)
+    transfer_rate     bytes/s the emulated link accepts, None for no limit
+    store_rate        bytes/s at which received blocks are processed; the
+                      instrument is busy (*OPC pending, later commands wait)
+                      until it is done
+
+    python -m core.Emulator        # SDG6022X on 5025, 33600A on 5026
+
+The drivers connect with e.g. SDG6022X("TCPIP::127.0.0.1::5025::SOCKET").
+"""
+import collections
+import re
+import select
+import socket
+import threading
+import time
+
+# ------------------------------------------------------------------
+# Message parsing
+# ------------------------------------------------------------------
+
+class MessageReader:
+    """Splits a byte stream into newline terminated messages, reading binary blocks by their length."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.pos = 0            # scan position in buffer
+        self.quote = None
+
+    def feed(self, data):
+        self.buffer += data
+        messages = []
+        buffer = self.buffer
+        i = self.pos
+        while i < len(buffer):
+            c = buffer[i]
+            if self.quote is not None:
+                if c == self.quote:
+                    self.quote = None
+                i += 1
+            elif c in b"\"'":
+                self.quote = c
+                i += 1
+            elif c == ord("#") and i + 1 < len(buffer) and 0x31 <= buffer[i + 1] <= 0x39:
+                digits = buffer[i + 1] - 0x30
+                if i + 2 + digits > len(buffer):
+                    break       # header not complete yet
+                length = int(buffer[i + 2:i + 2 + digits])
+                end = i + 2 + digits + length
+                if end > len(buffer):
+                    break       # data not complete yet
+                i = end
+                if i == len(buffer):
+                    # Uploads are sent without a terminator (VISA ends them with END), a block
+                    # that ends what was received so far ends the message
+                    messages.append(bytes(buffer))
+                    del buffer[:]
+                    i = 0
+            elif c == ord("\n"):
+                messages.append(bytes(buffer[:i]))
+                del buffer[:i + 1]
+                i = 0
+            else:
+                i += 1
+        self.pos = i
+        return messages
+
+    def end(self):
+        """
+        What is buffered as one message, if it is complete. pylablib sends messages
+        without a terminator and relies on VISA's END, which a raw socket does
+        not carry, so the server calls this once the client stops sending.
+        """
+        if not self.buffer or self.quote is not None or self.pos < len(self.buffer):
+            return []       # nothing buffered, or inside a quote or an incomplete block
+        message = bytes(self.buffer)
+        del self.buffer[:]
+        self.pos = 0
+        return [message]
+
+
+def split_commands(message):
+    """b'A 1;:B #14abcd' -> [('A 1', None), (':B ', b'abcd')], splitting on ';' outside quotes and blocks."""
+    commands = []
+    start = 0
+    quote = None
+    i = 0
+    while i < len(message):
+        c = message[i]
+        if quote is not None:
+            if c == quote:
+                quote = None
+        elif c in b"\"'":
+            quote = c
+        elif c == ord("#") and i + 1 < len(message) and 0x31 <= message[i + 1] <= 0x39:
+            digits = message[i + 1] - 0x30
+            length = int(message[i + 2:i + 2 + digits])
+            data_start = i + 2 + digits
+            commands.append((message[start:i].decode(errors='replace'), message[data_start:data_start + length]))
+            # The block ends the command, continue after the next separator
+            i = data_start + length
+            while i < len(message) and message[i] != ord(";"):
+                i += 1
+            start = i + 1
+        elif c == ord(";"):
+            commands.append((message[start:i].decode(errors='replace'), None))
+            start = i + 1
+        i += 1
+    tail = message[start:].decode(errors='replace') if start < len(message) else ""
+    if tail.strip():
+        commands.append((tail, None))
+    return [(text.strip(), block) for text, block in commands if text.strip() or block is not None]
+
+
+# ------------------------------------------------------------------
+# Common IEEE 488.2 behaviour
+# ------------------------------------------------------------------
+
+OPC = 0x01
+ESB = 0x20
+
+
+class Emulator:
+    IDN = "Emulator,Generic,0,0"
+    NO_ERROR = '+0,"No error"'
+    STATUS = {'*ESR?', '*STB?', '*OPC', '*CLS', '*ESE', '*ESE?', '*SRE', '*SRE?', '*IDN?'}   # answered while busy
+
+    def __init__(self, command_latency=0.0, transfer_rate=None, store_rate=None, latencies=None):
+        self.command_latency = command_latency
+        self.transfer_rate = transfer_rate
+        self.store_rate = store_rate
+        self.latencies = latencies or {}    # { "WVDT": 0.01, "SOUR:FUNC:ARB": 0.2 }
+        self.lock = threading.Lock()
+        self.commands = 0
+        self.block_bytes = 0
+        self.reset()
+
+    def reset(self):
+        self.esr = 0
+        self.ese = 0
+        self.sre = 0
+        self.errors = collections.deque(maxlen=20)
+        self.busy_until = 0.0
+        self.opc_at = None          # *OPC sets the OPC bit once the pending operations are done
+        self.reset_settings()
+
+    # --- status model
+
+    def busy(self, seconds):
+        self.busy_until = max(self.busy_until, time.monotonic()) + seconds
+
+    def wait_idle(self):
+        if (wait := self.busy_until - time.monotonic()) > 0:
+            time.sleep(wait)
+
+    def error(self, code, text):
+        self.errors.append(f'{code:+d},"{text}"')
+
+    def _update_esr(self):
+        if self.opc_at is not None and time.monotonic() >= self.opc_at:
+            self.esr |= OPC
+            self.opc_at = None
+
+    def stb(self):
+        self._update_esr()
+        value = ESB if self.esr & self.ese else 0
+        if self.errors:
+            value |= 0x04
+        if value & self.sre:
+            value |= 0x40
+        return value
+
+    def common(self, header, args):
+        """IEEE 488.2 common commands, None if header is not one."""
+        if header == '*IDN?':
+            return self.IDN
+        if header == '*RST':
+            self.wait_idle()
+            self.reset_settings()
+            return ""
+        if header == '*CLS':
+            self.esr = 0
+            self.errors.clear()
+            return ""
+        if header == '*OPC':
+            self.opc_at = self.busy_until
+            return ""
+        if header == '*OPC?':
+            self.wait_idle()
+            return "1"
+        if header == '*WAI':
+            self.wait_idle()
+            return ""
+        if header == '*ESR?':
+            self._update_esr()
+            value, self.esr = self.esr, 0
+            return str(value)
+        if header == '*STB?':
+            return str(self.stb())
+        if header in ('*ESE', '*SRE'):
+            setattr(self, header[1:].lower(), int(float(args)))
+            return ""
+        if header in ('*ESE?', '*SRE?'):
+            return str(getattr(self, header[1:-1].lower()))
+        if header in ('*TRG', '*SAV', '*RCL'):
+            return ""
+        return None
+
+    # --- dispatch
+
+    def handle(self, message):
+        """Run one message (bytes) and return the reply, or None if it had no queries."""
+        replies = []
+        with self.lock:
+            for text, block in split_commands(message):
+                header, _, args = text.partition(" ")
+                upper = header.upper()
+                if upper not in self.STATUS:
+                    self.wait_idle()
+                delay = self.command_latency + self.latencies.get(self.key(upper), 0.0)
+                if delay > 0:
+                    time.sleep(delay)
+                self.commands += 1
+                if block is not None:
+                    self.block_bytes += len(block)
+                    if self.store_rate:
+                        self.busy(len(block) / self.store_rate)
+                reply = self.common(upper, args.strip())
+                if reply is None:
+                    reply = self.command(text, block)
+                if reply:
+                    replies.append(reply)
+        return ";".join(replies) if replies else None
+
+    def key(self, header):
+        """Name used for the per command latencies."""
+        return header
+
+    def reset_settings(self):
+        raise NotImplementedError
+
+    def command(self, text, block):
+        raise NotImplementedError
+
+
+# ------------------------------------------------------------------
+# Siglent SDG6022X
+# ------------------------------------------------------------------
+
+SIGLENT_SECTIONS = {'AM', 'DSBAM', 'FM', 'PM', 'PWM', 'ASK', 'FSK', 'CARR', 'MOD'}
+SIGLENT_UNITS = {'FRQ': 'HZ', 'PERI': 'S', 'AMP': 'V', 'OFST': 'V', 'HLEV': 'V', 'LLEV': 'V',
+                 'WIDTH': 'S', 'RISE': 'S', 'FALL': 'S', 'DLY': 'S', 'EDGE': 'S', 'TIME': 'S', 'PRD': 'S'}
+_SIGLENT = re.compile(r"^(?:C(\d+):)?([A-Z]+)(\?)?$", re.IGNORECASE)
+
+
+class SDG6022XEmulator(Emulator):
+    IDN = "Siglent Technologies,SDG6022X,SDG6XEMU000001,6.01.01.33"
+    NO_ERROR = '0, No error'
+    CHANNELS = (1, 2)
+
+    def reset_settings(self):
+        self.settings = {ch: {
+            'BSWV': {'WVTP': 'SINE', 'FRQ': '1000', 'PERI': '0.001', 'AMP': '4', 'OFST': '0',
+                     'HLEV': '2', 'LLEV': '-2', 'PHSE': '0'},
+            'OUTP': {'STATE': 'OFF', 'LOAD': 'HZ', 'PLRT': 'NOR'},
+            'MDWV': {'STATE': 'OFF'},
+            'SWWV': {'STATE': 'OFF'},
+            'BTWV': {'STATE': 'OFF'},
+            'SRATE': {'MODE': 'DDS'},
+            'ARWV': {'INDEX': '0', 'NAME': 'SINE'},
+        } for ch in self.CHANNELS}
+        self.other = {}             # settings without a channel, { "ROSC": "INT" }
+        self.waveforms = {}         # { "wave1": <bytes> } uploaded with WVDT
+
+    def key(self, header):
+        return _SIGLENT.sub(r"\2", header.split(" ")[0])
+
+    def command(self, text, block):
+        head, _, args = text.partition(" ")
+        match = _SIGLENT.match(head.strip())
+        if match is None:
+            return self._other(head, args)
+        channel, name, query = match.groups()
+        channel = int(channel) if channel else None
+        name = name.upper()
+        if channel is not None and channel not in self.CHANNELS:
+            self.error(-114, "Header suffix out of range")
+            return ""
+        if channel is None:
+            return self._other(head, args)
+        store = self.settings[channel].setdefault(name, {})
+        if query:
+            return f"C{channel}:{name} {self._format(name, store)}"
+
+        fields = [field.strip() for field in args.split(",")] if args.strip() else []
+        if name == 'WVDT':
+            # C1:WVDT WVNM,name,WAVEDATA,#<block>
+            pairs = dict(zip(fields[::2], fields[1::2]))
+            self.waveforms[pairs.get('WVNM', 'USER')] = bytes(block or b"")
+            return ""
+        if name == 'OUTP' and fields and fields[0].upper() in ('ON', 'OFF'):
+            fields = ['STATE'] + fields
+        if name == 'ARWV' and fields[:1] == ['NAME'] and fields[1] not in self.waveforms:
+            self.error(-224, "Illegal parameter value")
+        self._set_pairs(store, fields)
+        if name == 'BSWV':
+            self._derive(store, fields[::2])
+        return ""
+
+    def _other(self, head, args):
+        name = head.strip().upper()
+        if name.endswith("?"):
+            if name in ('SYST:ERR?', 'SYSTEM:ERROR?'):
+                return self.errors.popleft() if self.errors else self.NO_ERROR
+            if name[:-1] in self.other:
+                return f"{name[:-1]} {self.other[name[:-1]]}"
+            self.error(-113, "Undefined header")
+            return ""
+        self.other[name] = args.strip()
+        return ""
+
+    @staticmethod
+    def _set_pairs(store, fields):
+        section = None
+        i = 0
+        while i < len(fields):
+            key = fields[i].upper()
+            if key in SIGLENT_SECTIONS and i + 1 < len(fields) and fields[i + 1].upper() not in ('ON', 'OFF'):
+                section = key
+                i += 1
+                continue
+            store[f"{section}:{key}" if section else key] = fields[i + 1] if i + 1 < len(fields) else ""
+            i += 2
+
+    @staticmethod
+    def _derive(store, keys):
+        # The instrument keeps the dependent values consistent
+        try:
+            if 'FRQ' in keys:
+                store['PERI'] = f"{1 / float(store['FRQ']):.10g}"
+            elif 'PERI' in keys:
+                store['FRQ'] = f"{1 / float(store['PERI']):.10g}"
+            if 'AMP' in keys or 'OFST' in keys:
+                amp, offset = float(store['AMP']), float(store['OFST'])
+                store['HLEV'], store['LLEV'] = f"{offset + amp / 2:.10g}", f"{offset - amp / 2:.10g}"
+        except (ValueError, ZeroDivisionError, KeyError):
+            pass
+
+    @staticmethod
+    def _format(name, store):
+        parts = []
+        section = None
+        for key, value in store.items():
+            group, _, field = key.rpartition(":")
+            if key == 'STATE' and name == 'OUTP':
+                parts.append(value)
+                continue
+            if group and group != section:
+                parts.append(group)
+                section = group
+            unit = SIGLENT_UNITS.get(field, "") if re.fullmatch(r"[-+]?[\d.]+(?:[eE][-+]?\d+)?", value) else ""
+            parts += [field, f"{value}{unit}"]
+        return ",".join(parts)
+
+
+# ------------------------------------------------------------------
+# Keysight/Agilent 33600A
+# ------------------------------------------------------------------
+
+SCPI_ROOTS = {'SOUR', 'OUTP', 'TRIG', 'SYST', 'MMEM', 'DISP', 'FORM', 'ROSC', 'UNIT', 'MEM', 'INIT',
+              'ABOR', 'STAT', 'CAL', 'LXI', 'HCOP', 'DATA'}
+_VOWELS = set("AEIOU")
+
+
+def short_form(node):
+    """'ROSCillator' / 'ROSCILLATOR' / 'rosc' -> 'ROSC', 'PHASE' -> 'PHAS', 'TRAiling' -> 'TRA'."""
+    if node != node.upper() and node != node.lower():
+        return re.match(r"[A-Z*]*", node).group()
+    node = node.upper()
+    if len(node) <= 4:
+        return node
+    return node[:3] if node[3] in _VOWELS else node[:4]
+
+
+def scpi_key(header):
+    """':SOUR2:FUNC:ARB:FILT' -> (2, 'SOUR:FUNC:ARB:FILT'), 'FREQ' -> (1, 'SOUR:FREQ')."""
+    nodes = []
+    channel = None
+    for node in header.strip().lstrip(":").split(":"):
+        match = re.fullmatch(r"([A-Za-z*]+)(\d*)", node)
+        if match is None:
+            nodes.append(node.upper())
+            continue
+        name, suffix = match.groups()
+        if suffix and channel is None:
+            channel = int(suffix)
+        nodes.append(short_form(name))
+    if nodes and nodes[0] not in SCPI_ROOTS:
+        nodes.insert(0, 'SOUR')        # SOURce is the default root
+    if nodes[:1] == ['DATA']:
+        nodes.insert(0, 'SOUR')
+    return channel or 1, ":".join(nodes)
+
+
+class Agilent33600AEmulator(Emulator):
+    IDN = "Agilent Technologies,33622A,MYEMU00001,A.02.02-3.15-2.00-58-00"
+    CHANNELS = (1, 2)
+    DEFAULTS = {
+        'SOUR:FUNC': 'SIN', 'SOUR:FREQ': '1000', 'SOUR:VOLT': '0.1', 'SOUR:VOLT:OFFS': '0',
+        'SOUR:PHAS': '0', 'SOUR:FUNC:ARB': '"INT:\\BUILTIN\\EXP_RISE.ARB"', 'SOUR:FUNC:ARB:SRAT': '40000',
+        'SOUR:BURS:STAT': 'OFF', 'SOUR:AM:STAT': 'OFF', 'SOUR:FM:STAT': 'OFF', 'SOUR:SWE:STAT': 'OFF',
+        'OUTP': 'OFF', 'OUTP:LOAD': '50', 'OUTP:POL': 'NORM', 'OUTP:MODE': 'NORM',
+        'TRIG:SOUR': 'IMM', 'TRIG:SLOP': 'POS', 'TRIG:DEL': '0', 'TRIG:LEV': '1', 'FORM:BORD': 'NORM',
+        'ROSC:SOUR': 'INT',
+    }
+
+    def reset_settings(self):
+        self.settings = {ch: {} for ch in self.CHANNELS}
+        self.arbs = {ch: {} for ch in self.CHANNELS}    # { 1: {"ARB1": <bytes>} } in volatile memory
+
+    def key(self, header):
+        return scpi_key(header.split(" ")[0].rstrip("?"))[1]
+
+    def command(self, text, block):
+        text = re.sub(r":\s+", ":", text)
+        header, _, args = text.partition(" ")
+        query = header.endswith("?")
+        channel, key = scpi_key(header.rstrip("?"))
+        args = args.strip()
+        if channel not in self.CHANNELS:
+            self.error(-114, "Header suffix out of range")
+            return ""
+        if args and ":" in args.split(" ")[0] and not args.startswith('"'):
+            # 'FUNC ARB:FILT NORM' was sent as ':FUNC: ARB:FILT NORM'
+            sub, _, args = args.partition(" ")
+            key, args = f"{key}:{scpi_key(sub)[1].removeprefix('SOUR:')}", args.strip()
+
+        if key == 'SYST:ERR':
+            return self.errors.popleft() if self.errors else self.NO_ERROR
+        if query:
+            return self._query(channel, key)
+
+        if key in ('SOUR:DATA:ARB:DAC', 'SOUR:DATA:ARB'):
+            name = args.split(",")[0].strip().upper()
+            if block is None:
+                block = args.split(",", 1)[1].encode() if "," in args else b""
+            self.arbs[channel][name] = bytes(block)
+        elif key == 'SOUR:DATA:VOL:CLE':
+            self.arbs[channel].clear()
+        elif key == 'MMEM:LOAD:DATA':
+            name = args.strip('"').replace("\\", "/").rsplit("/", 1)[-1].rsplit(".", 1)[0].upper()
+            self.arbs[channel][name] = b""
+        elif key == 'SOUR:FUNC:ARB' and args.upper() not in self.arbs[channel] and not args.startswith('"'):
+            self.error(-224, "Illegal parameter value")
+        elif key in ('SOUR:FUNC:ARB:SYNC', 'SOUR:PHAS:SYNC', 'DISP:TEXT', 'DISP:TEXT:CLE'):
+            pass
+        else:
+            self.settings[channel][key] = args
+        return ""
+
+    def _query(self, channel, key):
+        if key == 'SOUR:DATA:VOL:CAT':
+            return ",".join(f'"{name}"' for name in self.arbs[channel]) or '""'
+        value = self.settings[channel].get(key, self.DEFAULTS.get(key))
+        if value is None:
+            self.error(-113, "Undefined header")
+            return ""
+        upper = value.upper()
+        if upper in ('ON', 'OFF'):
+            return "1" if upper == 'ON' else "0"
+        try:
+            return f"{float(value):+.14E}"
+        except ValueError:
+            return upper if not value.startswith('"') else value
+
+
+# ------------------------------------------------------------------
+# Socket server
+# ------------------------------------------------------------------
+
+END_GAP = 0.002     # seconds without data that end an unterminated message
+
+
+class EmulatorServer:
+    """Serves one emulator on a TCP port (raw SCPI socket), one thread per connection."""
+
+    def __init__(self, emulator, port, host="127.0.0.1", name=None):
+        self.emulator = emulator
+        self.host = host
+        self.port = port
+        self.name = name or type(emulator).__name__
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._server = None
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((self.host, self.port))
+        self._server.listen()
+        self._server.settimeout(0.2)
+        self._stop.clear()
+        thread = threading.Thread(target=self._accept, name=f"emulator-{self.name}", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        print(f"Emulator {self.name} listening on {self.host}:{self.port}")
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def resource(self):
+        return f"TCPIP::{self.host}::{self.port}::SOCKET"
+
+    def _accept(self):
+        while not self._stop.is_set():
+            try:
+                conn, _ = self._server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            thread = threading.Thread(target=self._serve, args=(conn,), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _serve(self, conn):
+        reader = MessageReader()
+        conn.settimeout(0.2)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with conn:
+            while not self._stop.is_set():
+                try:
+                    data = conn.recv(1 << 20)
+                except socket.timeout:
+                    continue
+                except OSError:
+                    break
+                if not data:
+                    break
+                self.bytes_in += len(data)
+                if self.emulator.transfer_rate:
+                    time.sleep(len(data) / self.emulator.transfer_rate)
+                messages = reader.feed(data)
+                if not select.select([conn], [], [], END_GAP)[0]:
+                    messages += reader.end()
+                for message in messages:
+                    reply = self.emulator.handle(message)
+                    if reply is not None:
+                        out = reply.encode() + b"\n"
+                        self.bytes_out += len(out)
+                        try:
+                            conn.sendall(out)
+                        except OSError:
+                            return
+
+
+def serve(sdg_port=5025, a33_port=5026, host="127.0.0.1", **latency):
+    """Run both emulators until interrupted."""
+    servers = [
+        EmulatorServer(SDG6022XEmulator(**latency), sdg_port, host, "SDG6022X").start(),
+        EmulatorServer(Agilent33600AEmulator(**latency), a33_port, host, "33600A").start(),
+    ]
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\nShutting down...")
+    finally:
+        for server in servers:
+            server.stop()
+
+
+if __name__ == "__main__":
+    # Roughly a LAN instrument: 0.5 ms per command, 10 MB/s link, 20 MB/s to store waveforms
+    serve(command_latency=0.5e-3, transfer_rate=10e6, store_rate=20e6)
@@ -0,0 +1,283 @@
+"""
+Append-only columnar log of command results and logged parameters.
+
+A log is a directory with one file per column, each a plain little-endian
+array of a fixed dtype:
+
+    t.col               float64     Unix time of the row
+    step.col            int64       programme CommandN, -1 for server commands
+    instrument.col      int32       index into strings.txt
+    command.col         int32       index into strings.txt
+    signature.col       int32       names of the params, comma separated, index into strings.txt
+    params.col          float64 x8  numeric parameters, NaN padded
+    value.col           float64     numeric result, NaN if none
+    result_offset.col   int64       non numeric results, as JSON in results.col
+    result_length.col   int32
+    results.col         uint8       the JSON blobs
+    length              int64       rows written, updated with every row
+
+The column files are memory mapped and grown by doubling, so appending a row
+only writes into memory that is already mapped. read() maps the
+columns of a log (also one still being written) read-only for analysis:
+
+    log = ExperimentLog.read("runs/2024-06-01")
+    freqs = log['params'][log.rows_of('A33ConfigureWFM'), 4]
+"""
+import json
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+PARAMS = 8
+COLUMNS = {     # { name: (dtype, width) }
+    't': ('<f8', 1),
+    'step': ('<i8', 1),
+    'instrument': ('<i4', 1),
+    'command': ('<i4', 1),
+    'signature': ('<i4', 1),
+    'params': ('<f8', PARAMS),
+    'value': ('<f8', 1),
+    'result_offset': ('<i8', 1),
+    'result_length': ('<i4', 1),
+}
+_NUMBERS = (bool, int, float, np.number, np.bool_)
+
+active = None       # the ExperimentLog the server and programmes write to, see enable()
+
+
+def _json(value):
+    if hasattr(value, 'tolist'):    # numpy scalars and arrays
+        return value.tolist()
+    return str(value)
+
+
+class _Column:
+    """One memory mapped column file, grown by doubling."""
+
+    def __init__(self, path, dtype, width, rows):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.width = width
+        self.array = None
+        if not path.exists():
+            path.touch()
+        capacity = path.stat().st_size // (self.dtype.itemsize * width)
+        self._map(max(capacity, rows, 1))
+
+    @property
+    def capacity(self):
+        return self.array.shape[0]
+
+    def _map(self, capacity):
+        if self.array is not None:
+            self.array.flush()
+            self.array = None       # the map must be gone before the file is resized (Windows)
+        with open(self.path, 'r+b') as f:
+            f.truncate(capacity * self.dtype.itemsize * self.width)
+        shape = (capacity, self.width) if self.width > 1 else (capacity,)
+        self.array = np.memmap(self.path, dtype=self.dtype, mode='r+', shape=shape)
+
+    def reserve(self, rows):
+        if rows > self.capacity:
+            self._map(max(rows, 2 * self.capacity))
+
+    def close(self, rows):
+        self.array.flush()
+        self.array = None
+        with open(self.path, 'r+b') as f:
+            f.truncate(rows * self.dtype.itemsize * self.width)
+
+
+class ExperimentLog:
+    def __init__(self, path, capacity=65536):
+        """Open the log at directory path, continuing it if it exists."""
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+        meta = self.path / "meta.json"
+        if not meta.exists():
+            meta.write_text(json.dumps({'version': 1, 'columns': COLUMNS}, indent=2))
+        self._length = np.memmap(self._length_file(), dtype='<i8', mode='r+', shape=(1,))
+        self.rows = int(self._length[0])
+
+        self.strings = (self.path / "strings.txt").read_text(encoding="utf-8").splitlines() \
+            if (self.path / "strings.txt").exists() else []
+        self._codes = {s: i for i, s in enumerate(self.strings)}
+        self._strings_file = open(self.path / "strings.txt", "a", encoding="utf-8")
+
+        self.columns = {
+            name: _Column(self.path / f"{name}.col", dtype, width, max(self.rows, capacity))
+            for name, (dtype, width) in COLUMNS.items()
+        }
+        self.results = _Column(self.path / "results.col", '<u1', 1, 1 << 20)
+        self.results_length = 0
+        if self.rows:
+            last = self.rows - 1
+            self.results_length = int(self.columns['result_offset'].array[last] + self.columns['result_length'].array[last])
+        self._nan = np.full(PARAMS, np.nan)
+
+    def _length_file(self):
+        path = self.path / "length"
+        if not path.exists():
+            path.write_bytes(bytes(8))
+        return path
+
+    def code(self, text):
+        """Index of text in the string table, added if new."""
+        code = self._codes.get(text)
+        if code is None:
+            code = self._codes[text] = len(self.strings)
+            self.strings.append(text)
+            self._strings_file.write(text.replace("\n", " ") + "\n")
+            self._strings_file.flush()
+        return code
+
+    # --------------------------------------------------
+    # Writing
+    # --------------------------------------------------
+
+    def append(self, instrument, command, params=None, result=None, step=-1, t=None):
+        """
+        Append one row. params is {name: value}; its numeric values (the first
+        PARAMS) are logged, the rest is left out. A numeric result goes to the
+        value column, anything else is kept as JSON.
+        """
+        names, values = [], []
+        for name, value in (params or {}).items():
+            if isinstance(value, _NUMBERS) and len(values) < PARAMS:
+                names.append(name)
+                values.append(value)
+        blob = None
+        if result is not None and not isinstance(result, _NUMBERS):
+            blob = json.dumps(result, default=_json).encode()
+
+        with self._lock:
+            row = self.rows
+            columns = self.columns
+            if row >= columns['t'].capacity:
+                for column in columns.values():
+                    column.reserve(row + 1)
+            columns['t'].array[row] = time.time() if t is None else t
+            columns['step'].array[row] = step
+            columns['instrument'].array[row] = self.code(instrument or "")
+            columns['command'].array[row] = self.code(command)
+            columns['signature'].array[row] = self.code(",".join(names))
+            params_row = columns['params'].array[row]
+            params_row[:] = self._nan
+            params_row[:len(values)] = values
+            columns['value'].array[row] = result if isinstance(result, _NUMBERS) else np.nan
+            columns['result_offset'].array[row] = self.results_length
+            if blob is not None:
+                self.results.reserve(self.results_length + len(blob))
+                self.results.array[self.results_length:self.results_length + len(blob)] = np.frombuffer(blob, np.uint8)
+                self.results_length += len(blob)
+            columns['result_length'].array[row] = 0 if blob is None else len(blob)
+            self.rows = row + 1
+            self._length[0] = self.rows
+
+    def flush(self):
+        with self._lock:
+            for column in (*self.columns.values(), self.results):
+                column.array.flush()
+            self._length.flush()
+
+    def close(self):
+        """Flush and trim the column files to the rows written."""
+        with self._lock:
+            for column in self.columns.values():
+                column.close(self.rows)
+            self.results.close(self.results_length)
+            self._length.flush()
+            self._length = None
+            self._strings_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ------------------------------------------------------------------
+# Logging from the server and programmes
+# ------------------------------------------------------------------
+
+def enable(path, capacity=65536):
+    """Log every command result and LOGPAR/TSTMP line to the log at path."""
+    global active
+    disable()
+    active = ExperimentLog(path, capacity)
+    return active
+
+
+def disable():
+    global active
+    if active is not None:
+        active.close()
+        active = None
+
+
+# ------------------------------------------------------------------
+# Reading
+# ------------------------------------------------------------------
+
+class LogReader:
+    """Read-only memory maps of a log's columns, trimmed to the rows written when it was opened."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.rows = int(np.fromfile(self.path / "length", dtype='<i8', count=1)[0])
+        meta = json.loads((self.path / "meta.json").read_text())
+        self.strings = (self.path / "strings.txt").read_text(encoding="utf-8").splitlines()
+        self.columns = {}
+        for name, (dtype, width) in meta['columns'].items():
+            shape = (self.rows, width) if width > 1 else (self.rows,)
+            self.columns[name] = self._map(f"{name}.col", dtype, shape)
+        results_size = int(self.columns['result_offset'][-1] + self.columns['result_length'][-1]) if self.rows else 0
+        self._results = self._map("results.col", '<u1', (results_size,))
+
+    def _map(self, name, dtype, shape):
+        if not shape[0]:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(self.path / name, dtype=dtype, mode='r', shape=shape)
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def text(self, name):
+        """A coded column (instrument, command, signature) as strings."""
+        return np.array(self.strings, dtype=object)[self.columns[name]]
+
+    def rows_of(self, command=None, instrument=None):
+        """Row indices of command (on instrument)."""
+        mask = np.ones(self.rows, dtype=bool)
+        for name, text in (('command', command), ('instrument', instrument)):
+            if text is not None:
+                if text not in self.strings:
+                    return np.empty(0, dtype=np.intp)
+                mask &= self.columns[name] == self.strings.index(text)
+        return np.flatnonzero(mask)
+
+    def params(self, row):
+        """{name: value} of the params logged in row."""
+        names = self.strings[self.columns['signature'][row]]
+        return dict(zip(names.split(","), self.columns['params'][row])) if names else {}
+
+    def result(self, row):
+        """The result of row: its number, the decoded JSON, or None."""
+        length = int(self.columns['result_length'][row])
+        if length:
+            offset = int(self.columns['result_offset'][row])
+            return json.loads(self._results[offset:offset + length].tobytes())
+        value = float(self.columns['value'][row])
+        return None if np.isnan(value) else value
+
+
+def read(path):
+    return LogReader(path)
@@ -0,0 +1,213 @@
+"""
+Shared, long lived instrument sessions.
+
+pool.acquire(name, cls, addr) opens a driver once, registers it and hands the
+same instance to every later caller (server, UI, scripts), so nobody pays the
+VISA session setup per action. A background thread checks the pooled
+sessions with a cheap query every check_interval seconds and reconnects the
+ones that stopped answering; pool.call reconnects when the connection
+dropped under a command and reports the command as failed, it is not sent
+again since the instrument may already have run part of it.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from pylablib.core.devio.comm_backend import DeviceBackendError
+
+from core import Trace
+from core.Registry import devices, register_device
+
+
+class PoolEntry:
+    def __init__(self, name, cls, addr, device):
+        self.name = name
+        self.cls = cls
+        self.addr = addr
+        self.device = device
+        self.lock = threading.RLock()   # held by everything using the session outside the server's worker
+        self.checked_at = time.monotonic()
+        self.checks = 0
+        self.reconnects = 0
+        self.last_error = None
+
+
+class DevicePool:
+    def __init__(self, check_interval=30.0, probe="*OPC?"):
+        self.check_interval = check_interval
+        self.probe = probe
+        self.entries = {}       # { "SDG6022X_Gen1": <PoolEntry> }
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ------------------------------------------------------------------
+    # Sessions
+    # ------------------------------------------------------------------
+
+    def acquire(self, name, cls, addr):
+        """The open device called name, opened (and registered) on first use."""
+        with self._lock:
+            entry = self.entries.get(name)
+            if entry is not None:
+                if (entry.cls, entry.addr) != (cls, addr):
+                    raise ValueError(f"{name} is already pooled as {entry.cls.__name__} at {entry.addr}")
+                return entry.device
+            device = cls(addr)
+            self.entries[name] = PoolEntry(name, cls, addr, device)
+        register_device(name, device)
+        return device
+
+    def get(self, name):
+        return self.entries[name].device
+
+    @contextmanager
+    def session(self, name):
+        """Exclusive use of a pooled device, for front-ends that talk to it directly."""
+        entry = self.entries[name]
+        with entry.lock:
+            yield entry.device
+
+    def release(self, name):
+        """Close and forget one session."""
+        with self._lock:
+            entry = self.entries.pop(name)
+        with entry.lock:
+            if devices.get(name) is entry.device:
+                del devices[name]
+            try:
+                entry.device.close()
+            except Exception as e:
+                print(f'[{name}] Error while closing: {e}')
+
+    def close(self):
+        self.stop()
+        for name in list(self.entries):
+            self.release(name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ------------------------------------------------------------------
+    # Health checks and reconnects
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def is_connection_error(device, error):
+        """
+        Errors of the VISA backend or the socket, after which the session is not usable.
+
+        Instrument errors and timeouts waiting for an operation (CompletionTimeout)
+        leave the session usable and are not connection errors.
+        """
+        return isinstance(error, (DeviceBackendError, ConnectionError))
+
+    def reconnect(self, name):
+        entry = self.entries[name]
+        with entry.lock:
+            print(f'[{name}] Reconnecting to {entry.addr}')
+            if Trace.enabled:
+                Trace.timed(name, 'reconnect', entry.device.reconnect, entry.addr)
+            else:
+                entry.device.reconnect()
+            entry.reconnects += 1
+            entry.checked_at = time.monotonic()
+
+    def check(self, name):
+        """Probe one session, reconnecting if it does not answer. Returns True if it was healthy."""
+        entry = self.entries[name]
+        with entry.lock:
+            entry.checks += 1
+            try:
+                entry.device.ask(self.probe)
+                entry.checked_at = time.monotonic()
+                return True
+            except Exception as e:
+                if not self.is_connection_error(entry.device, e):
+                    raise
+                entry.last_error = f'{type(e).__name__}: {e}'
+                print(f'[{name}] Health check failed: {entry.last_error}')
+            try:
+                self.reconnect(name)
+            except Exception as e:
+                entry.last_error = f'{type(e).__name__}: {e}'
+                print(f'[{name}] Reconnect failed: {entry.last_error}')
+            return False
+
+    def call(self, name, func, /, *args, **kwargs):
+        """
+        Run func on a pooled session; if the connection dropped, reconnect and raise.
+
+        func is not run again: it may have been partly sent, and repeating it is up
+        to the caller. Devices that are not pooled are called as they are.
+        """
+        entry = self.entries.get(name)
+        if entry is None:
+            return func(*args, **kwargs)
+        with entry.lock:
+            try:
+                result = func(*args, **kwargs)
+                entry.checked_at = time.monotonic()     # the session just proved itself, no probe needed
+                return result
+            except Exception as e:
+                if not self.is_connection_error(entry.device, e):
+                    raise
+                entry.last_error = f'{type(e).__name__}: {e}'
+                print(f'[{name}] Connection lost: {entry.last_error}')
+                try:
+                    self.reconnect(name)
+                except Exception as reconnect_error:
+                    print(f'[{name}] Reconnect failed: {type(reconnect_error).__name__}: {reconnect_error}')
+                raise
+
+    def _check_due(self, run_on):
+        now = time.monotonic()
+        for name, entry in list(self.entries.items()):
+            if now - entry.checked_at >= self.check_interval:
+                try:
+                    run_on(name, self.check, name)
+                except Exception as e:
+                    print(f'[{name}] Health check error: {e}')
+
+    def start(self, run_on=None):
+        """
+        Start the background health checks.
+
+        run_on(name, func, *args) runs a check where the device's commands run,
+        core.Server.call_on while the server is up; by default checks run in
+        the checking thread under the session lock.
+        """
+        if self._thread is not None:
+            return
+        run_on = run_on or (lambda name, func, *args: func(*args))
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.wait(min(1.0, self.check_interval)):
+                self._check_due(run_on)
+
+        self._thread = threading.Thread(target=loop, name="pool-health", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        return {
+            name: {
+                'addr': entry.addr,
+                'checks': entry.checks,
+                'reconnects': entry.reconnects,
+                'last_error': entry.last_error,
+            }
+            for name, entry in self.entries.items()
+        }
+
+
+pool = DevicePool()     # shared by every front-end in this process
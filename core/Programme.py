@@ -0,0 +1,601 @@
+"""
+Runner for the programme text generated by CommandSetC11v027.wl.
+
+Every line is ``CommandN<TAB>code<TAB>NAME<TAB>params...`` (see PrintLine).
+A programme is parsed once by compile_programme: each line is bound to the
+device method it drives with its arguments already converted, and
+consecutive lines for the same device are grouped into one block. Running
+it then only calls the pre-bound functions, one worker hand-off per block.
+Runs of scalar register arithmetic are fused into one core.Registers.FusedOps.
+While a core.ExperimentLog is enabled, lines returning a result and the
+LOGPAR/TSTMP lines are logged with their CommandN.
+"""
+import inspect
+import threading
+import time
+
+import numpy as np
+
+from core import ExperimentLog, Registers
+from core.Registers import registers
+from core.Registry import commands, devices
+from core.Server import call_on
+from core.Waveforms import ram_waveforms
+
+binders = {}      # { "A33WFM": <function(params) -> (instr, func, kwargs)> }
+device_ids = {}   # { 33600: "AG33600A_Gen1" } programme DeviceID -> registered device name
+
+_compiling = threading.local()   # ids of the programme being compiled on this thread, see compile_programme
+# Programmes share the registers and RAM waveforms, so one runs at a time
+_run_lock = threading.RLock()
+
+# Lines that only annotate the programme
+NO_OPS = {'NULL', 'LABEL'}
+
+# Lines that write a row to the experiment log, their result being the logged params
+LOGGED = {'LOGPAR', 'TSTMP'}
+
+# The command set prints these commands under another command's mnemonic, told apart by their code
+ALIASES = {
+    ('REGINI', '1073'): 'REG1DINI',
+    ('REG1DTOREG1DV', '1090'): 'REG1DTOREG1DR',
+}
+
+
+class ProgrammeError(RuntimeError):
+    def __init__(self, command_n, name, error):
+        super().__init__(f"Line {command_n} ({name}): {type(error).__name__}: {error}")
+        self.command_n = command_n
+        self.name = name
+
+
+def register_binder(name):
+    def decorator(func):
+        binders[name] = func
+        return func
+    return decorator
+
+
+def _device(device_id):
+    """Registered device name for a programme DeviceID."""
+    ids = getattr(_compiling, 'ids', device_ids)
+    try:
+        return ids[int(device_id)]
+    except (KeyError, ValueError, TypeError):
+        raise KeyError(f"No device registered for DeviceID {device_id}") from None
+
+
+def _method(device_id, method):
+    instr = _device(device_id)
+    return instr, getattr(devices[instr], method)
+
+
+def _channel(channel):
+    # The command set numbers channels from 0, the drivers from 1
+    return int(channel) + 1
+
+
+def _returning(func, param):
+    """func returning the value of param it was called with, so the line is logged with it."""
+    def call(**kwargs):
+        func(**kwargs)
+        return kwargs[param]
+    return call
+
+
+def _from_register(func, param, slot):
+    """func with param read from scalar register slot when it runs, not when it is compiled."""
+    def call(**kwargs):
+        return func(**kwargs, **{param: float(registers[slot])})
+    return call
+
+
+# ------------------------------------------------------------------
+# Agilent 33600A
+# ------------------------------------------------------------------
+
+@register_binder('A33INI')
+def _a33_ini(device_id):
+    instr, func = _method(device_id, 'A33Initialize')
+    return instr, func, dict(reset=True)
+
+
+@register_binder('A33WFM')
+def _a33_wfm(device_id, channel, func_index, ampl, offset, freq, phase=0, log_freq=0):
+    instr, func = _method(device_id, 'A33ConfigureWFM')
+    if log_freq >= 1:
+        func = _returning(func, 'frequency_bw_bitrate')
+    kwargs = dict(
+        channel=_channel(channel),
+        waveform=int(func_index),
+        amplitude=ampl,
+        dc_offset=offset,
+        phase=phase,
+    )
+    if freq <= 0:
+        # Freq <= 0 is the number of the register holding the frequency
+        return instr, _from_register(func, 'frequency_bw_bitrate', -freq), kwargs
+    return instr, func, dict(kwargs, frequency_bw_bitrate=freq)
+
+
+@register_binder('A33PUL')
+def _a33_pul(device_id, channel, period, width, lead_edge=4e-9, trail_edge=4e-9):
+    instr, func = _method(device_id, 'A33ConfigurePulse')
+    return instr, func, dict(
+        channel=_channel(channel),
+        pulse_period=period,
+        pulse_width=width,
+        leading_edge=lead_edge,
+        trailing_edge=trail_edge,
+    )
+
+
+@register_binder('A33ERARB')
+def _a33_erarb(device_id, channel):
+    instr, func = _method(device_id, 'A33ClearArbitrary')
+    return instr, func, dict(channel=_channel(channel))
+
+
+def _upload_ram(device, ram_slot, length, arb_index, channel):
+    device.load_split_and_upload_dac(ram_waveforms.dac(ram_slot, length), arb_start_index=arb_index, channel=channel)
+
+
+@register_binder('A33ARBVOL')
+def _a33_arbvol(device_id, channel, wfm_slot, wfm_file, wfm_len, wfm_source):
+    # Only WFMSource 2 (programmatic array) exists here: WFMFile names the RAM waveform slot
+    if wfm_source != 2:
+        raise ValueError("A33ARBVOL only supports WFMSource 2 (RAM waveform)")
+    instr = _device(device_id)
+    return instr, _upload_ram, dict(
+        device=devices[instr],
+        ram_slot=int(wfm_file),
+        length=int(wfm_len),
+        arb_index=int(wfm_slot),
+        channel=_channel(channel),
+    )
+
+
+@register_binder('A33ARB')
+def _a33_arb(device_id, channel, arb_number, ampl, offset, q_freq_sr_per, freq_sr_per, filter_key, phase, adv_mode):
+    instr, func = _method(device_id, 'A33ConfigureARB')
+    return instr, func, dict(
+        channel=_channel(channel),
+        arb_number=int(arb_number),
+        amplitude=ampl,
+        f_sr_p=int(q_freq_sr_per),
+        phase=phase if -360 <= phase <= 360 else None,     # outside the range: no change (burst mode)
+        filter_key=int(filter_key),
+        dc_offset=offset,
+        advance_mode=adv_mode > 0,
+        freq_sample_rate_period=freq_sr_per,
+    )
+
+
+@register_binder('A33TRGCONF')
+def _a33_trgconf(device_id, channel, source, trig_slope, int_period, trg_level, trg_delay):
+    instr, func = _method(device_id, 'A33ConfigureTrigger')
+    return instr, func, dict(
+        channel=_channel(channel),
+        trigger_source=int(source),
+        trigger_slope=int(trig_slope),
+        delay=trg_delay,
+        int_period=int_period,
+        trigger_level=trg_level,
+    )
+
+
+@register_binder('A33BURST')
+def _a33_burst(device_id, channel, state, mode, burst_count, int_period, burst_phase, gate_polarity):
+    instr, func = _method(device_id, 'A33ConfigureBurst')
+    return instr, func, dict(
+        channel=_channel(channel),
+        burst_mode=mode > 0,
+        burst_phase=burst_phase,
+        burst_count=int(burst_count) or 'INF',     # 0 is an infinite burst
+        gate_polarity=gate_polarity > 0,
+        internal_period=int_period,
+        enable_burst=state > 0,
+    )
+
+
+@register_binder('A33OUT')
+def _a33_out(device_id, channel, state, impedance, polarity, mode):
+    instr, func = _method(device_id, 'A33OutputOnOff')
+    return instr, func, dict(
+        channel=_channel(channel),
+        enable_output=state > 0,
+        output_mode=mode > 0,
+        polarity=polarity > 0,
+        impedance=impedance,
+    )
+
+
+@register_binder('A33PSYNC')
+def _a33_psync(device_id, arb_q):
+    instr, func = _method(device_id, 'A33ArbPhaseSync' if arb_q > 0 else 'A33PhaseSync')
+    return instr, func, {}
+
+
+@register_binder('A33TRG')
+def _a33_trg(device_id):
+    instr, func = _method(device_id, 'A33Trg')
+    return instr, func, {}
+
+
+@register_binder('A33AM')
+def _a33_am(device_id, channel, on_off, source, modul_wfm, depth, modul_freq, carrier_supp):
+    instr, func = _method(device_id, 'A33ConfigureAM')
+    return instr, func, dict(
+        channel=_channel(channel),
+        am_source=int(source),
+        modulation_waveform=int(modul_wfm),
+        modulation_frequency=modul_freq,
+        enable_carrier_supression=carrier_supp > 0,
+        enable_amplitude_modulation=on_off > 0,
+        modulation_depth=depth,
+    )
+
+
+@register_binder('A33FM')
+def _a33_fm(device_id, channel, on_off, source, modul_wfm, dev_freq, modul_freq):
+    instr, func = _method(device_id, 'A33ConfigureFM')
+    return instr, func, dict(
+        channel=_channel(channel),
+        enable_frequency_modulation=on_off > 0,
+        fm_source=int(source),
+        modulation_waveform=int(modul_wfm),
+        modulation_deviation=dev_freq,
+        modulation_frequency=modul_freq,
+    )
+
+
+@register_binder('A33SWEEP')
+def _a33_sweep(device_id, channel, state, start_freq, stop_freq, sweep_time, hold_time, ret_time, sweep_spacing):
+    instr, func = _method(device_id, 'A33ConfigureFSweep')
+    return instr, func, dict(
+        channel=_channel(channel),
+        enable_frequency_sweep=state > 0,
+        sweep_spacing=int(sweep_spacing),
+        sweep_time=sweep_time,
+        hold_time=hold_time,
+        return_time=ret_time,
+        start_frequency=start_freq,
+        stop_frequency=stop_freq,
+    )
+
+
+# ------------------------------------------------------------------
+# RAM waveforms (no instrument, run where the programme runs)
+# ------------------------------------------------------------------
+
+@register_binder('RWFMINI')
+def _rwfm_ini(slot, length):
+    return None, ram_waveforms.RWFMINI, dict(slot=slot, length=length)
+
+
+@register_binder('RWFMBLK')
+def _rwfm_blk(slot, x1, x2, y):
+    return None, ram_waveforms.RWFMBLK, dict(slot=slot, x1=x1, x2=x2, y=y)
+
+
+@register_binder('RWFMLINE')
+def _rwfm_line(slot, x1, x2, y1, y2):
+    return None, ram_waveforms.RWFMLINE, dict(slot=slot, x1=x1, x2=x2, y1=y1, y2=y2)
+
+
+@register_binder('RWFMHARMS')
+def _rwfm_harms(slot, length, resc_min, resc_max, mode_cnt, *mode_params):
+    return None, ram_waveforms.RWFMHARMS, dict(
+        slot=slot, length=length, resc_min=resc_min, resc_max=resc_max,
+        mode_cnt=mode_cnt, mode_params=mode_params,
+    )
+
+
+@register_binder('RWFMPUL2')
+def _rwfm_pul2(slot, x_start, x_rise, x_pulse, x_fall, amplitude, freq, phase, phase_corr):
+    return None, ram_waveforms.RWFMPUL2, dict(
+        slot=slot, x_start=x_start, x_rise=x_rise, x_pulse=x_pulse, x_fall=x_fall,
+        amplitude=amplitude, freq=freq, phase=phase, phase_corr=phase_corr,
+    )
+
+
+def _store_phases(phases, acc_phase_out):
+    # AccPhaseOutReg1D: 1D register for the accumulated phases, < 0 to drop them
+    if acc_phase_out >= 0:
+        registers.set_row(acc_phase_out, phases)
+
+
+def _rwfm_pulmf(slot, phase_corr, reg_src, mode_cnt, rationalize_freq, acc_phase_out):
+    modes = registers.rows(reg_src, mode_cnt)[:, :8]
+    _store_phases(ram_waveforms.RWFMPULMF(slot, phase_corr, modes, rationalize_freq), acc_phase_out)
+
+
+def _rwfm_swpmf(slot, phase_corr, reg_src, mode_cnt):
+    ram_waveforms.RWFMSWPMF(slot, phase_corr, registers.rows(reg_src, mode_cnt)[:, :8])
+
+
+def _rwfm_mswpmf_prt(slot, phase_corr, x_gen_start, x_gen_len, reg_src, segm_cnt, acc_phase_out):
+    segments = registers.rows(reg_src, segm_cnt)
+    _store_phases(ram_waveforms.RWFMMSWPMFPRT(slot, phase_corr, x_gen_start, x_gen_len, segments), acc_phase_out)
+
+
+def _rwfm_mswpmf_par(slot, phase_corr, x_chunk_len, reg_src, segm_cnt, acc_phase_out):
+    segments = registers.rows(reg_src, segm_cnt)
+    _store_phases(ram_waveforms.RWFMMSWPMFPAR(slot, phase_corr, x_chunk_len, segments), acc_phase_out)
+
+
+# Mode and segment parameters come from 1D registers, read when the line runs
+@register_binder('RWFMPULMF')
+def _rwfm_pulmf_bind(slot, phase_corr, reg_src, mode_cnt, rationalize_freq, acc_phase_out):
+    return None, _rwfm_pulmf, dict(
+        slot=slot, phase_corr=phase_corr, reg_src=reg_src, mode_cnt=mode_cnt,
+        rationalize_freq=rationalize_freq, acc_phase_out=acc_phase_out,
+    )
+
+
+@register_binder('RWFMSWPMF')
+def _rwfm_swpmf_bind(slot, phase_corr, reg_src, mode_cnt):
+    return None, _rwfm_swpmf, dict(slot=slot, phase_corr=phase_corr, reg_src=reg_src, mode_cnt=mode_cnt)
+
+
+@register_binder('RWFMMSWPMFPRT')
+def _rwfm_mswpmf_prt_bind(slot, phase_corr, x_gen_start, x_gen_len, reg_src, segm_cnt, acc_phase_out):
+    return None, _rwfm_mswpmf_prt, dict(
+        slot=slot, phase_corr=phase_corr, x_gen_start=x_gen_start, x_gen_len=x_gen_len,
+        reg_src=reg_src, segm_cnt=segm_cnt, acc_phase_out=acc_phase_out,
+    )
+
+
+@register_binder('RWFMMSWPMFPAR')
+def _rwfm_mswpmf_par_bind(slot, phase_corr, x_chunk_len, reg_src, segm_cnt, acc_phase_out):
+    return None, _rwfm_mswpmf_par, dict(
+        slot=slot, phase_corr=phase_corr, x_chunk_len=x_chunk_len,
+        reg_src=reg_src, segm_cnt=segm_cnt, acc_phase_out=acc_phase_out,
+    )
+
+
+# ------------------------------------------------------------------
+# Registers (core.Registers)
+# ------------------------------------------------------------------
+
+@register_binder('REGINI')
+def _reg_ini(val, size):
+    return None, registers.REGINI, dict(val=val, size=size)
+
+
+@register_binder('REGSET')
+def _reg_set(dest, val):
+    return None, registers.REGSET, dict(dest=dest, val=val)
+
+
+@register_binder('REGCOPY')
+def _reg_copy(src, dest):
+    return None, registers.REGCOPY, dict(src=src, dest=dest)
+
+
+def _reg_binary(name):
+    def bind(src1, src2, dest):
+        return None, getattr(registers, name), dict(src1=src1, src2=src2, dest=dest)
+    return bind
+
+
+for _name in Registers.BINARY_OPS:
+    register_binder(_name)(_reg_binary(_name))
+
+
+@register_binder('REGTSTMP')
+def _reg_tstmp(dest):
+    return None, registers.REGTSTMP, dict(dest=dest)
+
+
+@register_binder('REGTOLOG')
+def _reg_tolog(src, var_dest):
+    return None, registers.REGTOLOG, dict(src=src, var_dest=var_dest)
+
+
+@register_binder('REG1DINI')
+def _reg1d_ini(val, size1, size2):
+    return None, registers.REG1DINI, dict(val=val, size1=size1, size2=size2)
+
+
+@register_binder('REG1DRESZ')
+def _reg1d_resz(size1, size2):
+    return None, registers.REG1DRESZ, dict(size1=size1, size2=size2)
+
+
+@register_binder('REG1DSET1D')
+def _reg1d_set1d(dest, data_len, *vals):
+    if len(vals) < data_len:
+        raise ValueError(f"DataLen is {data_len:.0f} but only {len(vals)} values follow")
+    return None, registers.REG1DSET1D, dict(dest=dest, data_len=data_len, vals=vals)
+
+
+@register_binder('REGTOREG1D')
+def _reg_to_reg1d(src, dest, col_dest):
+    return None, registers.REGTOREG1D, dict(src=src, dest=dest, col_dest=col_dest)
+
+
+@register_binder('REG1DTOREG1DV')
+def _reg1d_to_reg1d_v(src, col_src, dest, col_dest):
+    return None, registers.REG1DTOREG1DV, dict(src=src, col_src=col_src, dest=dest, col_dest=col_dest)
+
+
+@register_binder('REG1DTOREG1DR')
+def _reg1d_to_reg1d_r(src, dest):
+    return None, registers.REG1DTOREG1DR, dict(src=src, dest=dest)
+
+
+# ------------------------------------------------------------------
+# Experiment log (core.ExperimentLog)
+# ------------------------------------------------------------------
+
+def _logged_variables():
+    # REGTOLOG VarDest 1 and 2
+    return {'Amplitude': registers.log.get(1, np.nan), 'Amplitude2': registers.log.get(2, np.nan)}
+
+
+@register_binder('LOGPAR')
+def _logpar():
+    return None, _logged_variables, {}
+
+
+@register_binder('TSTMP')
+def _tstmp():
+    return None, dict, {}
+
+
+# ------------------------------------------------------------------
+# Registered commands (SDG60* ...)
+# ------------------------------------------------------------------
+
+def _bind_registered(name, params):
+    """
+    Lines naming a registered command take the DeviceID first and then the
+    command's own parameters in signature order.
+    """
+    func = commands[name]
+    instr_param, *rest = [
+        p.name for p in inspect.signature(func).parameters.values()
+        if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)
+    ]
+    if len(params) - 1 > len(rest):
+        raise TypeError(f"{name} takes {len(rest)} parameters after DeviceID, got {len(params) - 1}")
+    instr = _device(params[0])
+    return instr, func, {instr_param: devices[instr], **dict(zip(rest, params[1:]))}
+
+
+# ------------------------------------------------------------------
+# Compile / run
+# ------------------------------------------------------------------
+
+def _param(text):
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def compile_programme(text, ids=None):
+    """
+    Parse programme text into a Programme of pre-bound instructions.
+
+    ids maps DeviceIDs to device names for this programme only, on top of
+    device_ids, e.g. {"33600": "AG33600A_Gen1"}.
+
+    Binding errors (unknown mnemonic, unknown DeviceID, wrong parameter count)
+    are raised here, before anything is sent to an instrument.
+    """
+    outer = getattr(_compiling, 'ids', None)
+    _compiling.ids = {**device_ids, **{int(float(k)): v for k, v in (ids or {}).items()}}
+    try:
+        blocks = _bind_lines(text)
+    finally:
+        _compiling.ids = outer
+        if outer is None:
+            del _compiling.ids
+    return Programme([(instr, _fuse_registers(block) if instr is None else tuple(block)) for instr, block in blocks])
+
+
+def _bind_lines(text):
+    blocks = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        command_n, code, name, *fields = line.rstrip('\r').split('\t')
+        name = name.strip()
+        if name in NO_OPS:
+            continue
+        name = ALIASES.get((name, code.strip()), name)
+
+        params = [_param(f) for f in fields]
+        try:
+            if name in binders:
+                instr, func, kwargs = binders[name](*params)
+            elif name in commands:
+                instr, func, kwargs = _bind_registered(name, params)
+            else:
+                raise KeyError(f"Unknown command '{name}'")
+        except Exception as e:
+            raise ProgrammeError(command_n, name, e) from e
+
+        instruction = (command_n, name, func, kwargs)
+        if blocks and blocks[-1][0] == instr:
+            blocks[-1][1].append(instruction)
+        else:
+            blocks.append((instr, [instruction]))
+    return blocks
+
+
+def _fuse_registers(block):
+    """Replace runs of two or more scalar register lines by one FusedOps instruction."""
+    fused, run = [], []
+
+    def close_run():
+        if len(run) > 1:
+            name = f"{run[0][1]}..{run[-1][1]} ({len(run)} lines)"
+            fused.append((run[0][0], name, registers.fuse([(n, kwargs) for _, n, _, kwargs in run]), {}))
+        else:
+            fused.extend(run)
+        run.clear()
+
+    for instruction in block:
+        if instruction[1] in Registers.FUSIBLE:
+            run.append(instruction)
+        else:
+            close_run()
+            fused.append(instruction)
+    close_run()
+    return tuple(fused)
+
+
+def _lines(block):
+    return sum(len(func) if isinstance(func, Registers.FusedOps) else 1 for _, _, func, _ in block)
+
+
+def _run_block(block, instr=None):
+    log = ExperimentLog.active
+    for command_n, name, func, kwargs in block:
+        try:
+            result = func(**kwargs)
+            if log is not None:
+                if name in LOGGED:
+                    log.append(instr, name, result, step=int(float(command_n)))
+                elif result is not None:
+                    log.append(instr, name, kwargs, result, step=int(float(command_n)))
+        except Exception as e:
+            raise ProgrammeError(command_n, name, e) from e
+
+
+class Programme:
+    def __init__(self, blocks):
+        self.blocks = blocks    # [(instr, ((command_n, name, func, kwargs), ...)), ...]
+
+    def __len__(self):
+        return sum(_lines(block) for _, block in self.blocks)
+
+    def run(self):
+        """Run every instruction in order; blocks for one device run on that device's worker."""
+        with _run_lock:
+            return self._run()
+
+    def _run(self):
+        start = time.perf_counter()
+        executed = 0
+        try:
+            for instr, block in self.blocks:
+                call_on(instr, _run_block, block, instr)
+                executed += _lines(block)
+        except ProgrammeError as e:
+            print(f'Error: {e}')
+            return {
+                'status': 'Failed',
+                'executed': executed,
+                'elapsed': time.perf_counter() - start,
+                'error': {'line': e.command_n, 'cmd': e.name, 'message': str(e)},
+            }
+        return {'status': 'Completed', 'executed': executed, 'elapsed': time.perf_counter() - start}
+
+
+def run_programme(text, ids=None):
+    """Compile and run programme text, ids mapping DeviceIDs for this programme (see compile_programme)."""
+    return compile_programme(text, ids).run()
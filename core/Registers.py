@@ -0,0 +1,274 @@
+"""
+Register machine of the REG* / REG1D* commands of CommandSetC11v027.wl.
+
+Scalar registers (REG*) are one contiguous float64 array, 1D registers
+(REG1D*) the rows of a float64 2-D array. Both keep spare capacity and grow
+geometrically, so REG1DRESZ and writes past the end are amortized and never
+lose data; everything outside the used part is kept at zero.
+
+Runs of scalar arithmetic (FUSIBLE) compile into a FusedOps: the operations
+are put in dependency levels and each level runs as one gather, one NumPy
+ufunc call per operation kind and one scatter, instead of one Python call
+per line.
+"""
+import time
+
+import numpy as np
+
+_MIN_CAPACITY = 16
+
+# REG<op> src1, src2 -> dest
+BINARY_OPS = {
+    'REGADD': np.add,
+    'REGSUB': np.subtract,
+    'REGMUL': np.multiply,
+    'REGDIV': np.divide,
+    'REGMIN': np.minimum,
+    'REGMAX': np.maximum,
+}
+
+# Scalar operations FusedOps can run
+FUSIBLE = {'REGSET', 'REGCOPY', 'REGTSTMP', *BINARY_OPS}
+
+
+def _capacity(needed, current):
+    return max(needed, 2 * current, _MIN_CAPACITY)
+
+
+class RegisterFile:
+    def __init__(self):
+        self._values = np.zeros(_MIN_CAPACITY)
+        self.size = 0                   # scalar registers in use
+        self._bank = np.zeros((0, 0))
+        self.shape = (0, 0)             # (1D registers, length of each) in use
+        self.log = {}                   # { 1: value } REGTOLOG variables, 1 - Amplitude, 2 - Amplitude2
+
+    @property
+    def values(self):
+        return self._values[:self.size]
+
+    def __getitem__(self, slot):
+        slot = int(slot)
+        if not 0 <= slot < self.size:
+            raise IndexError(f"Register {slot} is not initialized ({self.size} registers)")
+        return self._values[slot]
+
+    def __setitem__(self, slot, value):
+        slot = int(slot)
+        self._grow(slot + 1)
+        self._values[slot] = value
+
+    def row(self, slot):
+        """1D register slot, a view of its used length."""
+        slot = int(slot)
+        if not 0 <= slot < self.shape[0]:
+            raise IndexError(f"1D register {slot} is not initialized ({self.shape[0]} registers)")
+        return self._bank[slot, :self.shape[1]]
+
+    def rows(self, first, count):
+        """1D registers first .. first + count - 1 as a (count, length) view, e.g. RWFMPULMF modes."""
+        first, count = int(first), int(count)
+        if first < 0 or first + count > self.shape[0]:
+            raise IndexError(f"1D registers {first}..{first + count - 1} are not initialized ({self.shape[0]} registers)")
+        return self._bank[first:first + count, :self.shape[1]]
+
+    def set_row(self, slot, values):
+        """Assign values to the start of 1D register slot, growing the bank as needed."""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        slot = int(slot)
+        self.resize(slot + 1, len(values))
+        self._bank[slot, :len(values)] = values
+
+    # --------------------------------------------------
+    # Storage
+    # --------------------------------------------------
+
+    def _grow(self, size):
+        """Make scalar registers 0 .. size - 1 exist; new ones are 0."""
+        if size > len(self._values):
+            values = np.zeros(_capacity(size, len(self._values)))
+            values[:self.size] = self.values
+            self._values = values
+        self.size = max(self.size, size)
+
+    def resize(self, rows, length):
+        """Grow the 1D registers to at least rows x length, keeping their data; new elements are 0."""
+        rows, length = max(int(rows), self.shape[0]), max(int(length), self.shape[1])
+        capacity = self._bank.shape
+        if rows > capacity[0] or length > capacity[1]:
+            bank = np.zeros((
+                _capacity(rows, capacity[0]) if rows > capacity[0] else capacity[0],
+                _capacity(length, capacity[1]) if length > capacity[1] else capacity[1],
+            ))
+            bank[:self.shape[0], :self.shape[1]] = self._bank[:self.shape[0], :self.shape[1]]
+            self._bank = bank
+        self.shape = (rows, length)
+
+    # --------------------------------------------------
+    # REG* commands
+    # --------------------------------------------------
+
+    def REGINI(self, val, size):
+        """Initialize size scalar registers to val."""
+        self.values[:] = 0
+        self.size = 0
+        self._grow(int(size))
+        self.values[:] = val
+
+    def REGSET(self, dest, val):
+        self[dest] = val
+
+    def REGCOPY(self, src, dest):
+        self[dest] = self[src]
+
+    def REGTSTMP(self, dest):
+        """Current time (Unix seconds) to register dest."""
+        self[dest] = time.time()
+
+    def REGTOLOG(self, src, var_dest):
+        """Register src to the logged variable var_dest (1 - Amplitude, 2 - Amplitude2)."""
+        self.log[int(var_dest)] = float(self[src])
+
+    def _binary(self, op, src1, src2, dest):
+        with np.errstate(all='ignore'):
+            self[dest] = BINARY_OPS[op](self[src1], self[src2])
+
+    def REGADD(self, src1, src2, dest):
+        self._binary('REGADD', src1, src2, dest)
+
+    def REGSUB(self, src1, src2, dest):
+        self._binary('REGSUB', src1, src2, dest)
+
+    def REGMUL(self, src1, src2, dest):
+        self._binary('REGMUL', src1, src2, dest)
+
+    def REGDIV(self, src1, src2, dest):
+        self._binary('REGDIV', src1, src2, dest)
+
+    def REGMIN(self, src1, src2, dest):
+        self._binary('REGMIN', src1, src2, dest)
+
+    def REGMAX(self, src1, src2, dest):
+        self._binary('REGMAX', src1, src2, dest)
+
+    # --------------------------------------------------
+    # REG1D* commands
+    # --------------------------------------------------
+
+    def REG1DINI(self, val, size1, size2):
+        """size1 1D registers of size2 elements, all val. Previous data is erased."""
+        self._bank[:self.shape[0], :self.shape[1]] = 0
+        self.shape = (0, 0)
+        self.resize(size1, size2)
+        self._bank[:self.shape[0], :self.shape[1]] = val
+
+    def REG1DRESZ(self, size1, size2):
+        """Sizes become the max of the requested and the current ones, data is kept."""
+        self.resize(size1, size2)
+
+    def REG1DSET1D(self, dest, data_len, vals):
+        self.set_row(dest, np.asarray(vals, dtype=np.float64)[:int(data_len)])
+
+    def REGTOREG1D(self, src, dest, col_dest):
+        value = self[src]
+        self.resize(int(dest) + 1, int(col_dest) + 1)
+        self._bank[int(dest), int(col_dest)] = value
+
+    def REG1DTOREG1DV(self, src, col_src, dest, col_dest):
+        value = self.row(src)[int(col_src)]
+        self.resize(int(dest) + 1, int(col_dest) + 1)
+        self._bank[int(dest), int(col_dest)] = value
+
+    def REG1DTOREG1DR(self, src, dest):
+        values = self.row(src).copy()
+        self.resize(int(dest) + 1, 0)
+        self._bank[int(dest), :len(values)] = values
+
+    def fuse(self, ops):
+        """FusedOps running [(name, kwargs), ...] of FUSIBLE operations on this register file."""
+        return FusedOps(self, ops)
+
+
+class FusedOps:
+    """
+    A run of scalar register operations as dependency levels.
+
+    An operation goes one level after the last write to any register it reads,
+    after the last write to its destination, and not before the last read of
+    its destination. A level reads all its inputs before writing any result,
+    so the effect is the same as running the lines in order.
+    """
+
+    def __init__(self, registers, ops):
+        self.registers = registers
+        self.count = len(ops)
+        last_write, last_read = {}, {}
+        written = set()
+        grown = 0           # size the run has grown the registers to so far
+        needed = 0
+        groups = {}     # { (level, kind): [(dest, srcs, val), ...] }
+
+        for name, kwargs in ops:
+            dest = int(kwargs['dest'])
+            if name == 'REGSET':
+                srcs, val = (), float(kwargs['val'])
+            elif name == 'REGCOPY':
+                srcs, val = (int(kwargs['src']),), None
+            elif name == 'REGTSTMP':
+                srcs, val = (), None
+            else:
+                srcs, val = (int(kwargs['src1']), int(kwargs['src2'])), None
+
+            # Reads past what the run has grown the registers to need registers from before it
+            needed = max([needed] + [s + 1 for s in srcs if s >= grown])
+            level = max([last_write.get(s, -1) + 1 for s in srcs]
+                        + [last_write.get(dest, -1) + 1, last_read.get(dest, 0)])
+            for s in srcs:
+                last_read[s] = max(last_read.get(s, 0), level)
+            last_write[dest] = level
+            written.add(dest)
+            grown = max(grown, dest + 1)
+            groups.setdefault((level, name), []).append((dest, srcs, val))
+
+        # Registers that must exist before the run, and the size it leaves
+        self.needed = needed
+        self.size = max(written, default=-1) + 1
+
+        self.levels = []    # [[(kind, dest, srcs, vals), ...], ...] with index arrays
+        for level in range(max((lv for lv, _ in groups), default=-1) + 1):
+            steps = []
+            for (lv, kind), items in groups.items():
+                if lv != level:
+                    continue
+                dest = np.array([d for d, _, _ in items], dtype=np.intp)
+                srcs = [np.array(s, dtype=np.intp) for s in zip(*(s for _, s, _ in items))]
+                vals = np.array([v for _, _, v in items]) if kind == 'REGSET' else None
+                steps.append((kind, dest, srcs, vals))
+            self.levels.append(steps)
+
+    def __len__(self):
+        return self.count
+
+    def __call__(self):
+        registers = self.registers
+        if self.needed > registers.size:
+            raise IndexError(f"Register {self.needed - 1} is not initialized ({registers.size} registers)")
+        registers._grow(self.size)
+        values = registers._values
+        with np.errstate(all='ignore'):
+            for steps in self.levels:
+                results = []
+                for kind, dest, srcs, vals in steps:
+                    if kind == 'REGSET':
+                        results.append((dest, vals))
+                    elif kind == 'REGCOPY':
+                        results.append((dest, values[srcs[0]]))
+                    elif kind == 'REGTSTMP':
+                        results.append((dest, time.time()))
+                    else:
+                        results.append((dest, BINARY_OPS[kind](values[srcs[0]], values[srcs[1]])))
+                for dest, result in results:
+                    values[dest] = result
+
+
+registers = RegisterFile()
@@ -1,11 +1,423 @@
 import zmq
 import json
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+
+from core import ExperimentLog, Trace, Wire
+from core.Pool import pool
 from core.Registry import commands, devices
 
-def handle_tcp(message):
+workers = {}        # { "SDG1": <DeviceWorker> } while serve() is running
+connections = {}    # { "SDG1": <AsyncSCPI> } raw socket transports used by serve_async()
+
+
+class DeviceWorker(threading.Thread):
+    """
+    Owns one registered device and runs every job submitted for it
+    strictly in arrival order, so different devices can work in parallel.
+    """
+
+    def __init__(self, name):
+        super().__init__(name=f"worker-{name}", daemon=True)
+        self.jobs = queue.Queue()
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        self.jobs.put((future, func, args, kwargs))
+        return future
+
+    def stop(self):
+        self.jobs.put(None)
+
+    def is_current(self):
+        return threading.current_thread() is self
+
+    def run(self):
+        while (job := self.jobs.get()) is not None:
+            future, func, args, kwargs = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+
+def resolve_command(instr, cmd):
+    """Registered command functions take the device first, anything else is a public driver method."""
+    device = devices[instr]
+    if cmd in commands:
+        return partial(commands[cmd], device)
+    if cmd.startswith('_'):
+        raise KeyError(f"'{cmd}' is not a public command")
+    return getattr(device, cmd)
+
+
+def call_on(instr, func, *args, **kwargs):
+    """Run func on the worker owning instr, or inline if there is none or we already are it."""
+    worker = workers.get(instr)
+    if worker is None or worker.is_current():
+        return func(*args, **kwargs)
+    return worker.submit(func, *args, **kwargs).result()
+
+
+def execute(instr, cmd, func, kwargs, params=None):
+    """
+    Run func(**kwargs) as the command cmd on instr the way every command runs:
+    on the pooled session, traced, and logged with params (kwargs if None).
+    """
+    # Pooled sessions are reconnected if the connection dropped and the error is raised, the command is not repeated
+    if Trace.enabled:
+        result = call_on(instr, Trace.command, instr, cmd, partial(pool.call, instr, func, **kwargs))
+    else:
+        result = call_on(instr, pool.call, instr, func, **kwargs)
+    if ExperimentLog.active is not None:
+        ExperimentLog.active.append(instr, cmd, kwargs if params is None else params, result)
+    return result
+
+
+def run_command(message):
     cmd = message.pop('cmd')
     instr = message.pop('instrument')
-    devices[instr].commands[cmd](**message)
+    return execute(instr, cmd, resolve_command(instr, cmd), message)
+
+
+def is_batch(message):
+    return isinstance(message, list) or (isinstance(message, dict) and 'batch' in message)
+
+
+def batch_steps(message):
+    """Steps of a batch message; ValueError unless they are a list of command objects."""
+    steps = message if isinstance(message, list) else message.get('batch')
+    if not isinstance(steps, list) or not all(isinstance(step, dict) for step in steps):
+        raise ValueError("A batch must be a list of command objects")
+    return steps
+
+
+def is_programme(message):
+    return isinstance(message, dict) and message.get('cmd') == 'programme'
+
+
+def is_sweep(message):
+    return isinstance(message, dict) and message.get('cmd') == 'sweep'
+
+
+def is_scpi(message):
+    return isinstance(message, dict) and message.get('cmd') == 'scpi'
+
+
+def _jsonable(value):
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if hasattr(value, 'tolist'):    # numpy scalars and arrays
+        return value.tolist()
+    return str(value)
+
+
+def run_batch(steps, stop_on_error=True):
+    """
+    Run a list of {cmd, instrument, **kwargs} steps in order and aggregate the outcome.
+
+    With stop_on_error the steps after the first failure are reported as 'Skipped',
+    otherwise every step is attempted.
+    """
+    results = []
+    failed = False
+    for index, step in enumerate(steps):
+        entry = {'index': index, 'cmd': step.get('cmd'), 'instrument': step.get('instrument')}
+        if failed and stop_on_error:
+            entry['status'] = 'Skipped'
+            results.append(entry)
+            continue
+
+        start = time.perf_counter()
+        try:
+            result = run_command(dict(step))
+            entry['status'] = 'Completed'
+            entry['result'] = _jsonable(result)
+        except Exception as e:
+            failed = True
+            entry['status'] = 'Failed'
+            entry['error'] = f'{type(e).__name__}: {e}'
+        entry['elapsed'] = time.perf_counter() - start
+        results.append(entry)
+
+    return {'status': 'Failed' if failed else 'Completed', 'steps': results}
+
+
+def handle_tcp(message):
+    """
+    Run one command message, or a batch of them.
+
+    A batch is either a bare list of command messages or
+    {"batch": [...], "stop_on_error": true}, and returns the run_batch summary.
+    {"cmd": "programme", "text": ..., "device_ids": {...}} runs CommandSetC11 programme text.
+    {"cmd": "sweep", "instrument": ..., "target": ..., "axes": {...}} runs a parameter sweep (core.Sweep).
+    """
+    if is_batch(message):
+        stop_on_error = isinstance(message, list) or message.get('stop_on_error', True)
+        return run_batch(batch_steps(message), stop_on_error)
+    if is_programme(message):
+        from core.Programme import run_programme
+        return run_programme(message['text'], message.get('device_ids'))
+    if is_sweep(message):
+        from core.Sweep import run_sweep
+        return call_on(message['instrument'], run_sweep, message)
+    return run_command(message)
+
+
+# ------------------------------------------------------------------
+# ROUTER server
+# ------------------------------------------------------------------
+
+_COMPLETED_ADDR = "inproc://completed"
+_local = threading.local()
+
+
+def _push_reply(frames):
+    # zmq sockets are not thread safe, so every thread finishing a job gets its own PUSH
+    push = getattr(_local, 'push', None)
+    if push is None:
+        push = _local.push = zmq.Context.instance().socket(zmq.PUSH)
+        push.connect(_COMPLETED_ADDR)
+    push.send_multipart(frames, copy=False)
+
+
+def _decode(parts):
+    """(message, binary) of the frames after the route: core.Wire multipart messages, or one frame of JSON."""
+    if Wire.is_binary(parts):
+        message, binary = Wire.decode(parts), True
+    elif len(parts) != 1:
+        raise ValueError(f"Expected one JSON frame, got {len(parts)} frames")
+    else:
+        message, binary = json.loads(parts[0].bytes), False
+    if is_batch(message):
+        batch_steps(message)    # rejected here, before dispatch looks at the steps
+    return message, binary
+
+
+def _reply(result, error, summary, binary):
+    """Reply frames: 'Completed', 'Failed' or the JSON summary, or a core.Wire message to binary clients."""
+    if binary:
+        if error is not None:
+            return Wire.encode({'status': 'Failed', 'error': f"{type(error).__name__}: {error}"})
+        return Wire.encode({'status': 'Completed', 'result': result})
+    if error is not None:
+        return [b'Failed']
+    # Batches, programmes and sweeps get their summary back, single commands keep the plain string reply
+    return [(json.dumps(result) if summary else 'Completed').encode()]
+
+
+def _print_error(e, parts):
+    print(f'Error: {e}')
+    print('Json message leading to eror')
+    print(parts[0].bytes.decode(errors='replace'))     # the header only for binary messages
+    traceback.print_exception(e)
+
+
+def _is_summary(message):
+    return is_batch(message) or is_programme(message) or is_sweep(message)
+
+
+def _complete(route, parts, summary, binary, future):
+    e = future.exception()
+    if e is not None:
+        _print_error(e, parts)
+    _push_reply(route + _reply(future.result() if e is None else None, e, summary, binary))
+
+
+def _owner(message):
+    """Name of the one device a message is bound to, None if it is not bound to a single device."""
+    if is_batch(message):
+        names = {step.get('instrument') for step in batch_steps(message)}
+        return names.pop() if len(names) == 1 else None
+    if isinstance(message, dict):
+        return message.get('instrument')
+    return None
+
+
+def dispatch(message, coordinator):
+    """Queue message on its device worker; anything not bound to a single device goes to the coordinator."""
+    worker = workers.get(_owner(message))
+    if worker is not None:
+        return worker.submit(handle_tcp, message)
+    return coordinator.submit(handle_tcp, message)
+
+
+def serve(address="tcp://*:5555", poll_ms=1000):
+    """
+    Serve the registered devices on a ROUTER socket.
+
+    Every device gets a DeviceWorker, so a long upload on one instrument does not
+    hold up the others. Each reply is routed back to its client as soon as the
+    command finishes, independently of the order the requests came in.
+    Messages are JSON, or core.Wire multipart messages carrying arrays as raw
+    frames; each client gets its reply in the format it sent.
+    """
+    context = zmq.Context.instance()
+    socket = context.socket(zmq.ROUTER)
+    socket.bind(address)
+    completed = context.socket(zmq.PULL)
+    completed.bind(_COMPLETED_ADDR)
+
+    for name in devices:
+        workers[name] = DeviceWorker(name)
+        workers[name].start()
+    coordinator = ThreadPoolExecutor(thread_name_prefix="coordinator")
+    pool.stop()
+    pool.start(run_on=call_on)      # health checks queue behind the device's commands
+
+    poller = zmq.Poller()
+    poller.register(socket, zmq.POLLIN)
+    poller.register(completed, zmq.POLLIN)
+
+    try:
+        while True:
+            events = dict(poller.poll(poll_ms))
+
+            if socket in events:
+                # Array frames are kept as received and reach the driver as np.frombuffer views
+                route, parts = Wire.split_route(socket.recv_multipart(copy=False))
+                try:
+                    message, binary = _decode(parts)
+                except Exception as e:
+                    print(f'Error: could not decode message: {e}')
+                    socket.send_multipart(route + _reply(None, e, False, Wire.is_binary(parts)))
+                    continue
+                try:
+                    summary = _is_summary(message)
+                    future = dispatch(message, coordinator)
+                except Exception as e:
+                    # A message of the wrong shape must not take the server down
+                    _print_error(e, parts)
+                    socket.send_multipart(route + _reply(None, e, False, binary))
+                    continue
+                future.add_done_callback(partial(_complete, route, parts, summary, binary))
+
+            if completed in events:
+                socket.send_multipart(completed.recv_multipart(copy=False), copy=False)
+
+    except KeyboardInterrupt:
+        print('Closing connections')
+
+    finally:
+        pool.stop()
+        for worker in workers.values():
+            worker.stop()
+        for worker in workers.values():
+            worker.join()
+        workers.clear()
+        coordinator.shutdown(wait=True)
+        socket.close(linger=0)
+        completed.close(linger=0)
+
+
+# ------------------------------------------------------------------
+# asyncio ROUTER server
+# ------------------------------------------------------------------
+
+def _as_list(value):
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+
+async def run_scpi(message):
+    """
+    {"cmd": "scpi", "instrument": ..., "write": [...], "query": [...]} on the device's AsyncSCPI.
+
+    The writes go out first, then all queries are sent back to back and their
+    replies are collected in order.
+    """
+    connection = connections[message['instrument']]
+    for msg in _as_list(message.get('write')):
+        await connection.write(msg)
+    queries = _as_list(message.get('query'))
+    replies = await connection.query_many(queries) if queries else []
+    return {'status': 'Completed', 'replies': replies}
+
+
+async def _serve_one(socket, route, parts, coordinator):
+    import asyncio
+
+    try:
+        message, binary = _decode(parts)
+    except Exception as e:
+        print(f'Error: could not decode message: {e}')
+        await socket.send_multipart(route + _reply(None, e, False, Wire.is_binary(parts)))
+        return
+
+    try:
+        if is_scpi(message):
+            result, summary = await run_scpi(message), True
+        else:
+            # Driver commands still run on their device worker, awaited without blocking the loop
+            result, summary = await asyncio.wrap_future(dispatch(message, coordinator)), _is_summary(message)
+        reply = _reply(result, None, summary, binary)
+    except Exception as e:
+        _print_error(e, parts)
+        reply = _reply(None, e, False, binary)
+    await socket.send_multipart(route + reply, copy=False)
+
+
+async def serve_async(address="tcp://*:5555", resources=None):
+    """
+    Serve the registered devices on an asyncio ROUTER socket.
+
+    resources maps device names to raw socket addresses
+    ({"SDG1": "TCPIP::169.254.11.24::5025::SOCKET"}); those devices also take
+    {"cmd": "scpi", ...} messages, which are awaited on an AsyncSCPI connection so
+    writes and pipelined queries to different instruments overlap. Every other
+    message runs on the device workers exactly as with serve().
+    """
+    # Only the asyncio server needs these, serve() starts without them
+    import asyncio
+    import zmq.asyncio
+    from Equipment.async_scpi import AsyncSCPI
+
+    context = zmq.asyncio.Context.instance()
+    socket = context.socket(zmq.ROUTER)
+    socket.bind(address)
+
+    for name, addr in (resources or {}).items():
+        connections[name] = await AsyncSCPI(addr).open()
+    for name in devices:
+        workers[name] = DeviceWorker(name)
+        workers[name].start()
+    coordinator = ThreadPoolExecutor(thread_name_prefix="coordinator")
+    pool.stop()
+    pool.start(run_on=call_on)
+    tasks = set()
 
+    try:
+        while True:
+            route, parts = Wire.split_route(await socket.recv_multipart(copy=False))
+            task = asyncio.create_task(_serve_one(socket, route, parts, coordinator))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
 
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print('Closing connections')
 
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.gather(*(connection.close() for connection in connections.values()))
+        connections.clear()
+        pool.stop()
+        for worker in workers.values():
+            worker.stop()
+        for worker in workers.values():
+            worker.join()
+        workers.clear()
+        coordinator.shutdown(wait=True)
+        socket.close(linger=0)
@@ -0,0 +1,252 @@
+"""
+Server side parameter sweeps.
+
+{"cmd": "sweep", "instrument": "AG33600A_Gen1", "target": "A33ConfigureWFM",
+ "axes": {"frequency_bw_bitrate": {"start": 1e3, "stop": 1e6, "num": 100}},
+ "fixed": {"channel": 1, "waveform": 0, "amplitude": 1, "dc_offset": 0, "phase": 0},
+ "mode": "product", "dwell": 0.01}
+
+The scan is expanded with NumPy (Cartesian product of the axes, or "zip" to
+step them together), every point is checked at once against the bounds
+declared on the target's signature, and the SCPI strings are formatted before
+the first one is sent. Running then only writes, waits for the dwell time and
+records when each point went out. The target is any command the server takes
+(a driver method or a registered command), and every point is run like one:
+on the pooled session, traced and logged (core.Server.execute).
+"""
+import inspect
+import time
+import typing
+from functools import partial
+
+import numpy as np
+
+from core.Registry import commands, devices
+from core.Server import execute, resolve_command
+
+
+class SweepError(ValueError):
+    pass
+
+
+# ------------------------------------------------------------------
+# Expansion
+# ------------------------------------------------------------------
+
+def axis_values(axis):
+    """
+    Values of one axis: a list, {"start", "stop", "num"} (linear, or geometric
+    with "log": true) or {"start", "stop", "step"}.
+    """
+    if isinstance(axis, dict):
+        if 'num' in axis:
+            space = np.geomspace if axis.get('log') else np.linspace
+            return space(axis['start'], axis['stop'], int(axis['num']))
+        if 'step' in axis:
+            return np.arange(axis['start'], axis['stop'], axis['step'])
+        raise SweepError(f"Axis needs 'num' or 'step', got {sorted(axis)}")
+    return np.asarray(axis)
+
+
+def expand(axes, mode='product'):
+    """{name: values} -> {name: 1D array}, one entry per sweep point, first axis slowest."""
+    names = list(axes)
+    values = [np.atleast_1d(axis_values(axes[name])) for name in names]
+    if mode == 'zip':
+        lengths = {len(v) for v in values}
+        if len(lengths) > 1:
+            raise SweepError(f"Zipped axes need equal lengths, got {dict(zip(names, map(len, values)))}")
+        return dict(zip(names, values))
+    if mode != 'product':
+        raise SweepError(f"Unknown sweep mode '{mode}', use 'product' or 'zip'")
+    grids = np.meshgrid(*values, indexing='ij')
+    return {name: grid.ravel() for name, grid in zip(names, grids)}
+
+
+# ------------------------------------------------------------------
+# Vectorized validation against the target signature
+# ------------------------------------------------------------------
+
+def signature_bounds(func):
+    """
+    {parameter: (type, allowed values or None, [(op, bound), ...], required)} from
+    the annotations (Literal[...] and Annotated[..., Field(ge=..., gt=...)]) of func.
+    """
+    bounds = {}
+    for name, param in inspect.signature(func).parameters.items():
+        if param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
+            continue
+        annotation = param.annotation
+        kind, allowed, limits = float, None, []
+        if typing.get_origin(annotation) is typing.Literal:
+            allowed = typing.get_args(annotation)
+            kind = type(allowed[0])
+        elif typing.get_origin(annotation) is typing.Annotated:
+            kind, *extras = typing.get_args(annotation)
+            for extra in extras:
+                for constraint in getattr(extra, 'metadata', ()):
+                    for op in ('ge', 'gt', 'le', 'lt'):
+                        if getattr(constraint, op, None) is not None:
+                            limits.append((op, getattr(constraint, op)))
+        elif annotation in (bool, int, float):
+            kind = annotation
+        bounds[name] = (kind, allowed, limits, param.default is param.empty)
+    return bounds
+
+
+def takes_kwargs(func):
+    return any(param.kind is param.VAR_KEYWORD for param in inspect.signature(func).parameters.values())
+
+
+_FAILS = {
+    'ge': np.less,
+    'gt': np.less_equal,
+    'le': np.greater,
+    'lt': np.greater_equal,
+}
+
+
+def check_points(target, bounds, points, count, takes_any=False):
+    """
+    Raise SweepError naming the first bad point of every parameter that has one.
+    Targets taking **kwargs (takes_any) get the parameters outside bounds unchecked.
+    """
+    missing = sorted(name for name, (*_, required) in bounds.items() if required and name not in points)
+    unknown = [] if takes_any else sorted(set(points) - set(bounds))
+    if missing or unknown:
+        raise SweepError(f"{target}: missing parameters {missing}, unknown parameters {unknown}")
+
+    errors = []
+    for name, (kind, allowed, limits, _) in bounds.items():
+        if name not in points:
+            continue
+        values = np.broadcast_to(points[name], (count,))
+        if not np.issubdtype(values.dtype, np.number) and values.dtype != bool:
+            errors.append(f"{name}: not numeric ({values.dtype})")
+            continue
+        bad = np.zeros(count, dtype=bool)
+        if kind is bool:
+            bad |= (values != 0) & (values != 1)
+        else:
+            bad |= ~np.isfinite(values.astype(float))
+            if kind is int:
+                bad |= values != np.round(values)
+        if allowed is not None:
+            bad |= ~np.isin(values, allowed)
+        for op, bound in limits:
+            bad |= _FAILS[op](values, bound)
+        if bad.any():
+            first = int(np.argmax(bad))
+            errors.append(f"{name}: {int(bad.sum())} point(s) out of bounds, first #{first} = {values[first].item()!r}")
+    if errors:
+        raise SweepError(f"{target}: " + "; ".join(errors))
+
+
+def _python(value, kind):
+    if kind is bool:
+        return bool(value)
+    if kind is int:
+        return int(value)
+    return float(value)
+
+
+# ------------------------------------------------------------------
+# Sweep
+# ------------------------------------------------------------------
+
+class Sweep:
+    """
+    An expanded, validated sweep of one command, ready to run.
+
+    Points of driver methods in the driver's COMMAND_SPECS are formatted up
+    front and only written; other commands are called with each point's
+    arguments, registered ones checked against their spec first.
+    """
+
+    def __init__(self, instr, target, axes, fixed=None, mode='product', dwell=0.0):
+        device = devices[instr]
+        try:
+            self.func = resolve_command(instr, target)
+        except (KeyError, AttributeError):
+            raise SweepError(f"{instr} has no command '{target}'") from None
+        self.instr = instr
+        self.target = target
+        self.axes = expand(axes, mode)
+        self.count = len(next(iter(self.axes.values()))) if self.axes else 1
+
+        bounds = signature_bounds(self.func)
+        takes_any = takes_kwargs(self.func)
+        points = {**{k: np.asarray(v) for k, v in (fixed or {}).items()}, **self.axes}
+        check_points(target, bounds, points, self.count, takes_any)
+
+        dwell = np.broadcast_to(np.asarray(dwell, dtype=float), (self.count,))
+        if (dwell < 0).any():
+            raise SweepError("dwell must not be negative")
+        self.dwell = dwell
+
+        # One kwargs dict per point, with plain Python values
+        columns = {name: np.broadcast_to(points[name], (self.count,)).tolist()
+                   for name in points if name in bounds or takes_any}
+        self.rows = [
+            {name: _python(columns[name][i], bounds[name][0]) if name in bounds else columns[name][i] for name in columns}
+            for i in range(self.count)
+        ]
+
+        # Precomputed SCPI strings where the driver has a compiled spec for the target. Registered
+        # commands may do more than format their spec, they are only checked against it.
+        spec = getattr(device, 'COMMAND_SPECS', {}).get(target)
+        self.commands = None
+        if spec is not None and target in commands:
+            try:
+                for row in self.rows:
+                    spec.validate(row)
+            except ValueError as e:
+                raise SweepError(str(e)) from None
+        elif spec is not None:
+            self.commands = [spec.format(**row) for row in self.rows]
+
+    def __len__(self):
+        return self.count
+
+    def run(self):
+        """Send every point, keeping at least its dwell time between points. Returns the timing summary."""
+        device = devices[self.instr]
+        sent_at = np.empty(self.count)
+        write_time = np.empty(self.count)
+
+        start = time.perf_counter()
+        next_at = start
+        for i in range(self.count):
+            if (wait := next_at - time.perf_counter()) > 0:
+                time.sleep(wait)
+            t0 = time.perf_counter()
+            if self.commands is not None:
+                execute(self.instr, self.target, partial(device.write, self.commands[i]), {}, self.rows[i])
+            else:
+                execute(self.instr, self.target, self.func, self.rows[i])
+            t1 = time.perf_counter()
+            sent_at[i], write_time[i] = t0 - start, t1 - t0
+            next_at = t0 + self.dwell[i]
+
+        return {
+            'status': 'Completed',
+            'points': self.count,
+            'precomputed': self.commands is not None,
+            'elapsed': time.perf_counter() - start,
+            'axes': {name: values.tolist() for name, values in self.axes.items()},
+            'sent_at': sent_at.tolist(),
+            'write_time': write_time.tolist(),
+        }
+
+
+def run_sweep(message):
+    """Build and run the sweep described by a {"cmd": "sweep", ...} message."""
+    sweep = Sweep(
+        message['instrument'],
+        message['target'],
+        message['axes'],
+        fixed=message.get('fixed'),
+        mode=message.get('mode', 'product'),
+        dwell=message.get('dwell', 0.0),
+    )
+    return sweep.run()
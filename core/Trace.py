@@ -0,0 +1,220 @@
+"""
+Structured command tracing.
+
+While enabled, every command the server runs and every message a driver puts
+on the wire is recorded as one event in a ring buffer:
+
+    {"seq": 12, "t": 1718000000.123, "instrument": "SDG6022X_Gen1", "kind": "write",
+     "command": "SDG60ConfSTDWFM", "scpi": "C1:BSWV WVTP,SINE,FRQ,1000", "duration": 0.0004, "outcome": "ok"}
+
+Recording is one tuple appended to a deque; a background thread turns the
+events into JSON lines and writes them to the log. Disabled (the default),
+call sites only test Trace.enabled. load/replay/diff work on such logs, e.g.
+diff(load("python.jsonl"), load("labview.jsonl")) lists the SCPI each
+session sent differently, per instrument.
+"""
+import collections
+import difflib
+import itertools
+import json
+import threading
+import time
+
+from core.Registry import devices
+
+enabled = False
+echo = False
+dropped = 0
+
+_pending = collections.deque()      # events not flushed yet
+_recent = collections.deque()       # last flushed events, for events()
+_seq = itertools.count()
+_names = {}                         # { id(device): "SDG1" }, rebuilt when flushing
+_file = None
+_flusher = None
+_stop = threading.Event()
+_flush_lock = threading.Lock()
+_capacity = 65536
+_context = threading.local()         # command being run on this thread, see command()
+
+FIELDS = ('seq', 't', 'instrument', 'kind', 'command', 'scpi', 'duration', 'outcome')
+
+
+# ------------------------------------------------------------------
+# Recording
+# ------------------------------------------------------------------
+
+def record(device, kind, scpi=None, duration=None, outcome="ok", command=None):
+    """Append one event. device is a driver instance or an instrument name."""
+    global dropped
+    if command is None:
+        command = getattr(_context, 'command', None)
+    if len(_pending) >= _capacity:
+        dropped += 1        # the flusher fell behind, keep the newest events
+        _pending.popleft()
+    _pending.append((next(_seq), time.time(), device, kind, command, scpi, duration, outcome))
+
+
+def timed(device, kind, func, scpi=None, command=None):
+    """func() recorded with its duration and outcome."""
+    start = time.perf_counter()
+    try:
+        result = func()
+    except Exception as e:
+        record(device, kind, scpi, time.perf_counter() - start, f"{type(e).__name__}: {e}", command)
+        raise
+    record(device, kind, scpi, time.perf_counter() - start, "ok", command)
+    return result
+
+
+def command(instrument, name, func):
+    """Run func as the command name on instrument; the driver events it causes are tagged with name."""
+    outer = getattr(_context, 'command', None)
+    _context.command = name
+    try:
+        return timed(instrument, 'command', func, command=name)
+    finally:
+        _context.command = outer
+
+
+def _name(device):
+    if device is None or isinstance(device, str):
+        return device
+    name = _names.get(id(device))
+    if name is None:
+        _names.update({id(d): n for n, d in devices.items()})
+        name = _names.get(id(device), type(device).__name__)
+    return name
+
+
+def _scpi(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    return value
+
+
+def _as_dict(event):
+    seq, t, device, kind, command, scpi, duration, outcome = event
+    return dict(zip(FIELDS, (seq, t, _name(device), kind, command, _scpi(scpi), duration, outcome)))
+
+
+# ------------------------------------------------------------------
+# Flushing
+# ------------------------------------------------------------------
+
+def flush():
+    """Move the pending events to the log (and to the console with echo)."""
+    with _flush_lock:
+        lines = []
+        while _pending:
+            event = _as_dict(_pending.popleft())
+            _recent.append(event)
+            lines.append(json.dumps(event))
+            if echo:
+                print(f"[{event['instrument']}] {event['kind']} {event['command'] or ''} {event['scpi'] or ''} "
+                      f"-> {event['outcome']}")
+        if _file is not None and lines:
+            _file.write("\n".join(lines) + "\n")
+            _file.flush()
+
+
+def enable(path=None, capacity=65536, interval=0.2, console=False):
+    """
+    Start tracing. Events are appended to the JSONL file path (if given) every
+    interval seconds; the last capacity events stay available to events().
+    """
+    global enabled, echo, _file, _flusher, _capacity, _recent
+    disable()
+    _capacity = capacity
+    _recent = collections.deque(maxlen=capacity)
+    _names.clear()
+    echo = console
+    _file = open(path, "a", encoding="utf-8") if path is not None else None
+    _stop.clear()
+
+    def loop():
+        while not _stop.wait(interval):
+            flush()
+
+    _flusher = threading.Thread(target=loop, name="trace-flush", daemon=True)
+    _flusher.start()
+    enabled = True
+
+
+def disable():
+    """Stop tracing, writing out what is still pending."""
+    global enabled, _file, _flusher
+    enabled = False
+    if _flusher is not None:
+        _stop.set()
+        _flusher.join()
+        _flusher = None
+    flush()
+    if _file is not None:
+        _file.close()
+        _file = None
+
+
+def events():
+    """Recorded events of the current session, oldest first."""
+    flush()
+    return list(_recent)
+
+
+# ------------------------------------------------------------------
+# Analysis
+# ------------------------------------------------------------------
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def scpi_sent(events, instrument=None):
+    """{instrument: [scpi, ...]} of the messages put on the wire, in order."""
+    sent = collections.defaultdict(list)
+    for event in events:
+        if event['kind'] == 'write' and event['outcome'] == 'ok' and event['scpi'] is not None:
+            if instrument is None or event['instrument'] == instrument:
+                sent[event['instrument']].append(event['scpi'])
+    return dict(sent)
+
+
+def diff(a, b, instrument=None):
+    """
+    {instrument: [(tag, [scpi in a], [scpi in b]), ...]} of where two sessions
+    sent different SCPI, tag being 'replace', 'delete' or 'insert' as in difflib.
+    """
+    sent_a, sent_b = scpi_sent(a, instrument), scpi_sent(b, instrument)
+    result = {}
+    for name in sorted(sent_a.keys() | sent_b.keys()):
+        seq_a, seq_b = sent_a.get(name, []), sent_b.get(name, [])
+        changes = [
+            (tag, seq_a[i1:i2], seq_b[j1:j2])
+            for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, seq_a, seq_b, autojunk=False).get_opcodes()
+            if tag != 'equal'
+        ]
+        if changes:
+            result[name] = changes
+    return result
+
+
+def replay(events, targets, timing=False):
+    """
+    Send the recorded SCPI again: targets maps instrument names to anything
+    with write() (a driver, or a socket wrapper to core/Test_instrument.py).
+    With timing the original gaps between messages are kept.
+    """
+    previous = None
+    count = 0
+    for event in events:
+        if event['kind'] != 'write' or event['outcome'] != 'ok' or event['instrument'] not in targets:
+            continue
+        if event['scpi'] is None or event['scpi'].startswith("<"):
+            continue        # binary blocks are not kept in the log
+        if timing and previous is not None:
+            time.sleep(max(0.0, event['t'] - previous))
+        previous = event['t']
+        targets[event['instrument']].write(event['scpi'])
+        count += 1
+    return count
@@ -0,0 +1,413 @@
+"""
+RAM waveform slots mirroring the RWFM* commands of CommandSetC11v027.wl.
+
+Slots are float32 buffers in DAC units (-32767..+32767 for the 33600A).
+Every primitive writes in place into its slot, block by block, using
+preallocated float64 scratch buffers, so building a multi-million sample
+waveform does not allocate per sample or loop over samples in Python.
+dac() converts a slot into a reusable int16 buffer that can go straight
+to Agilent33600A.load_split_and_upload_dac.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+DAC_MAX = 32767
+_BLOCK = 1 << 20    # samples processed per vectorized step
+_PARALLEL_MIN = 1 << 22     # shorter sweeps are generated in process
+
+
+def schroeder_phases(amplitudes):
+    """Minimum crest factor phases for a sum of harmonics with the given amplitudes (Schroeder, 1970)."""
+    power = np.asarray(amplitudes, dtype=np.float64) ** 2
+    power /= power.sum()
+    k = np.arange(len(power))
+    # phi_k = -2 pi sum_{l<k} (k - l) p_l
+    return np.array([-2 * np.pi * np.dot(k[i] - k[:i], power[:i]) for i in k])
+
+
+def rationalize(freq, length, denominator):
+    """
+    Frequency rounding used by RWFMPULMF: >0 rounds to a multiple of 1/denominator,
+    <0 to a whole number of cycles over length, 0 leaves it exact.
+    """
+    if denominator > 0:
+        return np.round(freq * denominator) / denominator
+    if denominator < 0 and length > 0:
+        return np.round(freq * length) / length
+    return freq
+
+
+def parse_segments(segments):
+    """
+    Split multi-segment sweep rows {XSegmLen, CarrierCnt, (Ampl, Freq, Phase) * CarrierCnt}
+    into (lengths, amplitudes, frequencies, phases) arrays of shape (S,) and (S, CarrierCnt).
+    """
+    rows = [np.asarray(row, dtype=np.float64) for row in segments]
+    carriers = int(rows[0][1])
+    if any(int(row[1]) != carriers for row in rows):
+        raise ValueError("All sweep segments must have the same CarrierCnt")
+    triplets = np.array([row[2:2 + 3 * carriers] for row in rows]).reshape(len(rows), carriers, 3)
+    lengths = np.array([int(row[0]) for row in rows], dtype=np.int64)
+    return lengths, triplets[:, :, 0], triplets[:, :, 1], triplets[:, :, 2]
+
+
+def sweep_start_phases(lengths, freqs, phases):
+    """
+    Carrier phase at the start of every generated segment (all but the last one),
+    plus the accumulated phase at the end of the sweep.
+    """
+    start = np.empty((len(lengths) - 1, freqs.shape[1]))
+    phase = phases[0].copy()
+    for s in range(len(lengths) - 1):
+        if s:
+            phase += phases[s]    # phase jump at the segment boundary
+        start[s] = phase
+        phase = phase + np.pi * (freqs[s] + freqs[s + 1]) * lengths[s]
+    return start, phase
+
+
+_engine = None   # per worker process, keeps its scratch buffers between chunks
+
+
+def _sweep_chunk(shm_name, total, x0, x1, lengths, amps, freqs, start_phase):
+    """Pool worker: generate sweep samples x0..x1-1 straight into the shared slot buffer."""
+    global _engine
+    if _engine is None:
+        _engine = RamWaveforms()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        out = np.ndarray((total,), dtype=np.float32, buffer=shm.buf)
+        _engine._sweep_range(out, x0, x1, lengths, amps, freqs, start_phase)
+        del out
+    finally:
+        shm.close()
+
+
+class RamWaveforms:
+    def __init__(self):
+        self.slots = {}     # { slot: float32 samples }
+        self._dac = {}      # { slot: int16 buffer reused by dac() }
+        self._shm = {}      # { slot: SharedMemory backing slots[slot] }
+        self._pool = None
+        self._ramp = np.arange(_BLOCK, dtype=np.float64)
+        self._x = np.empty(_BLOCK)
+        self._y = np.empty(_BLOCK)
+        self._e = np.empty(_BLOCK)
+        self._acc = np.empty(_BLOCK)
+
+    def __getitem__(self, slot):
+        return self.slots[int(slot)]
+
+    # --------------------------------------------------
+    # Block helpers
+    # --------------------------------------------------
+
+    @staticmethod
+    def _blocks(start, stop):
+        for a in range(start, stop, _BLOCK):
+            yield a, min(a + _BLOCK, stop)
+
+    def _add_pulse(self, acc, a, b, start, rise, flat, fall, amplitude, freq, phase, freq_end=None):
+        """
+        Add one cos-enveloped carrier to acc, which holds samples a..b-1.
+        phase is the carrier phase at sample start; with freq_end the
+        frequency sweeps linearly from freq to freq_end over the pulse.
+        """
+        length = rise + flat + fall
+        lo, hi = max(a, start), min(b, start + length)
+        if lo >= hi:
+            return
+        n = hi - lo
+        i, y, env = self._x[:n], self._y[:n], self._e[:n]
+        np.add(self._ramp[:n], lo - start, out=i)    # index inside the pulse
+
+        # carrier: phase(i) = phase + 2 pi (f i + (f_end - f) i^2 / 2L)
+        np.multiply(i, 2 * np.pi * freq, out=y)
+        if freq_end is not None and freq_end != freq:
+            np.multiply(i, i, out=env)
+            env *= np.pi * (freq_end - freq) / length
+            y += env
+        y += phase
+        np.sin(y, out=y)
+
+        # envelope: cos rise, flat top, cos fall
+        env.fill(1.0)
+        rise_end = min(max(rise - (lo - start), 0), n)
+        if rise_end:
+            seg = env[:rise_end]
+            np.multiply(i[:rise_end], np.pi / rise, out=seg)
+            np.cos(seg, out=seg)
+            np.subtract(1.0, seg, out=seg)
+            seg *= 0.5
+        fall_start = min(max(rise + flat - (lo - start), 0), n)
+        if fall_start < n:
+            seg = env[fall_start:]
+            np.subtract(i[fall_start:], rise + flat, out=seg)
+            seg *= np.pi / fall
+            np.cos(seg, out=seg)
+            seg += 1.0
+            seg *= 0.5
+
+        y *= env
+        y *= amplitude
+        acc[lo - a:hi - a] += y
+
+    # --------------------------------------------------
+    # RWFM* commands
+    # --------------------------------------------------
+
+    def RWFMINI(self, slot, length):
+        """Initialize RAM waveform slot with length zeros, reusing its buffer when the length is unchanged."""
+        slot, length = int(slot), int(length)
+        buf = self.slots.get(slot)
+        if buf is None or len(buf) != length:
+            self._release(slot)
+            self.slots[slot] = np.zeros(length, dtype=np.float32)
+        else:
+            buf.fill(0)
+
+    def RWFMBLK(self, slot, x1, x2, y):
+        """Set samples x1..x2 (inclusive) to y."""
+        self[slot][int(x1):int(x2) + 1] = y
+
+    def RWFMLINE(self, slot, x1, x2, y1, y2):
+        """Set samples x1..x2 (inclusive) to the straight line from (x1, y1) to (x2, y2)."""
+        buf, x1, x2 = self[slot], int(x1), int(x2)
+        slope = (y2 - y1) / (x2 - x1) if x2 > x1 else 0.0
+        for a, b in self._blocks(x1, x2 + 1):
+            x = self._x[:b - a]
+            np.add(self._ramp[:b - a], a - x1, out=x)
+            x *= slope
+            x += y1
+            buf[a:b] = x
+
+    def RWFMHARMS(self, slot, length, resc_min, resc_max, mode_cnt, mode_params):
+        """
+        Sum of harmonics {ModeN, ModeAmpl} over one period of length samples with
+        Schroeder (minimum crest factor) phases, rescaled to resc_min..resc_max.
+        """
+        modes = np.asarray(mode_params, dtype=np.float64).reshape(int(mode_cnt), 2)
+        numbers, amplitudes = modes[:, 0], modes[:, 1]
+        phases = schroeder_phases(amplitudes)
+        length = int(length)
+        self.RWFMINI(slot, length)
+        buf = self[slot]
+
+        for a, b in self._blocks(0, length):
+            n = b - a
+            x, y, acc = self._x[:n], self._y[:n], self._acc[:n]
+            np.add(self._ramp[:n], a, out=x)
+            acc.fill(0)
+            for number, amplitude, phase in zip(numbers, amplitudes, phases):
+                np.multiply(x, 2 * np.pi * number / length, out=y)
+                y += phase
+                np.cos(y, out=y)
+                y *= amplitude
+                acc += y
+            buf[a:b] = acc
+
+        lo, hi = float(buf.min()), float(buf.max())
+        if hi > lo:
+            buf -= lo
+            buf *= (resc_max - resc_min) / (hi - lo)
+            buf += resc_min
+
+    def RWFMPUL2(self, slot, x_start, x_rise, x_pulse, x_fall, amplitude, freq, phase, phase_corr):
+        """
+        Set the pulse samples to a carrier with cos rise, flat top and cos fall.
+        freq is in units of the sample rate, phase is referenced to the start of
+        the waveform, shifted by 2 pi freq phase_corr.
+        """
+        buf = self[slot]
+        start, rise, flat, fall = int(x_start), int(x_rise), int(x_pulse), int(x_fall)
+        stop = start + rise + flat + fall
+        carrier_phase = phase + 2 * np.pi * freq * (start + phase_corr)
+        for a, b in self._blocks(start, stop):
+            acc = self._acc[:b - a]
+            acc.fill(0)
+            self._add_pulse(acc, a, b, start, rise, flat, fall, amplitude, freq, carrier_phase)
+            buf[a:b] = acc
+
+    def RWFMPULMF(self, slot, phase_corr, modes, rationalize_freq=0):
+        """
+        Multifrequency pulse: one RWFMPUL2 style carrier per row of modes
+        {XStart, XRise, XPulse, XFall, Amplitude, Freq, Phase, TrackedModeIndex}, summed.
+
+        A mode whose TrackedModeIndex names an earlier mode continues that mode's
+        accumulated phase (plus its own Phase) instead of starting from the
+        waveform reference. Returns the accumulated phase of every mode at its end.
+        """
+        modes = np.atleast_2d(np.asarray(modes, dtype=np.float64))
+        geometry = modes[:, :4].astype(np.int64)
+        lengths = geometry[:, 1:].sum(axis=1)
+        freqs = np.array([rationalize(f, d, rationalize_freq) for f, d in zip(modes[:, 5], lengths)])
+
+        start_phase = np.empty(len(modes))
+        end_phase = np.empty(len(modes))
+        for k, (start, length) in enumerate(zip(geometry[:, 0], lengths)):
+            tracked = int(modes[k, 7])
+            if 0 <= tracked < k:
+                start_phase[k] = end_phase[tracked] + modes[k, 6]
+            else:
+                start_phase[k] = modes[k, 6] + 2 * np.pi * freqs[k] * (start + phase_corr)
+            end_phase[k] = start_phase[k] + 2 * np.pi * freqs[k] * length
+
+        self._sum_pulses(slot, geometry, lengths, modes[:, 4], freqs, start_phase)
+        return np.mod(end_phase, 2 * np.pi)
+
+    def RWFMSWPMF(self, slot, phase_corr, modes):
+        """
+        Multifrequency sweep: rows {XStart, XRise, XPulse, XFall, Amplitude, Freq init, Freq fin, Phase},
+        each a cos-enveloped linear chirp from Freq init to Freq fin, summed.
+        """
+        modes = np.atleast_2d(np.asarray(modes, dtype=np.float64))
+        geometry = modes[:, :4].astype(np.int64)
+        lengths = geometry[:, 1:].sum(axis=1)
+        start_phase = modes[:, 7] + 2 * np.pi * modes[:, 5] * (geometry[:, 0] + phase_corr)
+        self._sum_pulses(slot, geometry, lengths, modes[:, 4], modes[:, 5], start_phase, modes[:, 6])
+
+    def _sum_pulses(self, slot, geometry, lengths, amplitudes, freqs, phases, freqs_end=None):
+        buf = self[slot]
+        stop = int((geometry[:, 0] + lengths).max())
+        for a, b in self._blocks(int(geometry[:, 0].min()), stop):
+            acc = self._acc[:b - a]
+            acc.fill(0)
+            for k, (start, rise, flat, fall) in enumerate(geometry):
+                self._add_pulse(
+                    acc, a, b, start, rise, flat, fall, amplitudes[k], freqs[k], phases[k],
+                    None if freqs_end is None else freqs_end[k],
+                )
+            buf[a:b] = acc
+
+    def RWFMMSWPMFPRT(self, slot, phase_corr, x_gen_start, x_gen_len, segments):
+        """
+        Generate samples x_gen_start .. x_gen_start + x_gen_len - 1 of a multi-segment
+        multifrequency sweep (RWFMSWPMFMSPRT in the command set).
+
+        segments are rows {XSegmLen, CarrierCnt, (Ampl init, Freq init, Phase) * CarrierCnt}.
+        Within a segment every carrier's amplitude and frequency move linearly to the
+        next segment's initial values; the phase of segments after the first is a phase
+        jump, and the last segment only supplies the final values. The sweep starts at
+        sample 0 of the slot; phase_corr is accepted but not applied, as in LabVIEW.
+        Returns the accumulated carrier phases at the end of the sweep.
+        """
+        lengths, amps, freqs, phases = parse_segments(segments)
+        start_phase, end_phase = sweep_start_phases(lengths, freqs, phases)
+        x0 = int(x_gen_start)
+        self._sweep_range(self[slot], x0, x0 + int(x_gen_len), lengths, amps, freqs, start_phase)
+        return np.mod(end_phase, 2 * np.pi)
+
+    def RWFMMSWPMFPAR(self, slot, phase_corr, x_chunk_len, segments, workers=None):
+        """
+        Whole multi-segment multifrequency sweep (RWFMSWPMFMSPAR in the command set),
+        split into chunks of at most x_chunk_len samples. Returns the accumulated phases.
+
+        Long sweeps are generated in parallel by a process pool writing into the
+        slot through shared memory. Every sample's phase follows from the segment
+        start phases, so chunk boundaries are phase continuous by construction.
+        workers defaults to the CPU count, workers=1 generates in process.
+        """
+        lengths, amps, freqs, phases = parse_segments(segments)
+        start_phase, end_phase = sweep_start_phases(lengths, freqs, phases)
+        total = int(lengths[:-1].sum())
+        workers = workers or os.cpu_count() or 1
+        chunk = int(x_chunk_len) if x_chunk_len > 0 else total
+        chunk = max(1, min(chunk, -(-total // workers)))
+        ranges = [(x0, min(x0 + chunk, total)) for x0 in range(0, total, chunk)]
+
+        if workers == 1 or total < _PARALLEL_MIN:
+            buf = self[slot]
+            for x0, x1 in ranges:
+                self._sweep_range(buf, x0, x1, lengths, amps, freqs, start_phase)
+        else:
+            shm = self._shared(slot)
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=workers)
+            jobs = [
+                self._pool.submit(_sweep_chunk, shm.name, len(self[slot]), x0, x1, lengths, amps, freqs, start_phase)
+                for x0, x1 in ranges
+            ]
+            for job in jobs:
+                job.result()
+        return np.mod(end_phase, 2 * np.pi)
+
+    def _shared(self, slot):
+        """Move a slot into shared memory (once) so pool workers can write into it."""
+        slot = int(slot)
+        if slot not in self._shm:
+            buf = self.slots[slot]
+            shm = shared_memory.SharedMemory(create=True, size=max(buf.nbytes, 1))
+            shared = np.ndarray(buf.shape, dtype=np.float32, buffer=shm.buf)
+            shared[:] = buf
+            self.slots[slot] = shared
+            self._shm[slot] = shm
+        return self._shm[slot]
+
+    def _release(self, slot):
+        self._dac.pop(slot, None)
+        shm = self._shm.pop(slot, None)
+        if shm is not None:
+            self.slots.pop(slot, None)
+            shm.close()
+            shm.unlink()
+
+    def close(self):
+        """Free shared slot memory and stop the generator pool."""
+        for slot in list(self._shm):
+            self._release(slot)
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _sweep_range(self, buf, x0, x1, lengths, amps, freqs, start_phase):
+        edges = np.concatenate(([0], np.cumsum(lengths[:-1])))
+        for a, b in self._blocks(x0, x1):
+            acc = self._acc[:b - a]
+            acc.fill(0)
+            for s in range(len(lengths) - 1):
+                lo, hi = max(a, edges[s]), min(b, edges[s + 1])
+                if lo >= hi:
+                    continue
+                n, length = hi - lo, lengths[s]
+                i, y, env = self._x[:n], self._y[:n], self._e[:n]
+                for c in range(freqs.shape[1]):
+                    f0, df = freqs[s, c], freqs[s + 1, c] - freqs[s, c]
+                    a0, da = amps[s, c], amps[s + 1, c] - amps[s, c]
+                    np.add(self._ramp[:n], lo - edges[s], out=i)
+                    # phase(i) = phase0 + 2 pi (f0 i + df i^2 / 2L)
+                    np.multiply(i, np.pi * df / length, out=y)
+                    y += 2 * np.pi * f0
+                    y *= i
+                    y += start_phase[s, c]
+                    np.sin(y, out=y)
+                    # amplitude(i) = a0 + da i / L
+                    np.multiply(i, da / length, out=env)
+                    env += a0
+                    y *= env
+                    acc[lo - a:hi - a] += y
+            buf[a:b] = acc
+
+    # --------------------------------------------------
+    # Upload
+    # --------------------------------------------------
+
+    def dac(self, slot, length=None):
+        """Slot rounded and clipped to int16 DAC codes, in a buffer reused between calls."""
+        slot = int(slot)
+        buf = self.slots[slot]
+        length = len(buf) if length is None else int(length)
+        out = self._dac.get(slot)
+        if out is None:
+            out = self._dac[slot] = np.empty(len(buf), dtype=np.int16)
+        for a, b in self._blocks(0, length):
+            y = self._y[:b - a]
+            np.rint(buf[a:b], out=y)
+            np.clip(y, -DAC_MAX, DAC_MAX, out=y)
+            out[a:b] = y
+        return out[:length]
+
+
+ram_waveforms = RamWaveforms()
@@ -0,0 +1,129 @@
+"""
+Binary multipart messages for the ZMQ server.
+
+A JSON client sends one frame, the message itself, and gets 'Completed',
+'Failed' or a JSON summary back, as before. A binary client sends
+
+    [MAGIC + header, frame 0, frame 1, ...]
+
+where the header is the message with every NumPy array replaced by None,
+plus where each array goes and its dtype and shape:
+
+    {"message": {"cmd": "upload_custom_waveform", "instrument": "SDG1", "name": "w1", "waveform": null},
+     "frames": [[["waveform"], "<f4", [200000]]]}
+
+The array data travels as raw frames and is received as read-only
+np.frombuffer views of the ZMQ messages, so it is never copied or parsed on
+the way to the driver. Binary clients get a reply in the same format,
+{"status": "Completed", "result": ...} or {"status": "Failed", "error": ...},
+arrays in the result coming back as frames.
+
+    socket = zmq.Context.instance().socket(zmq.REQ)
+    socket.connect("tcp://localhost:5555")
+    Wire.send(socket, {'cmd': 'upload_custom_waveform', 'instrument': 'SDG1', 'name': 'w1', 'waveform': wfm})
+    print(Wire.recv(socket))
+"""
+import json
+
+import numpy as np
+
+MAGIC = b"QDB1"
+
+
+def _buffer(part):
+    # zmq.Frame when received with copy=False, bytes otherwise
+    return part.buffer if hasattr(part, 'buffer') else memoryview(part)
+
+
+def split_route(frames):
+    """([identity] or [identity, b''] for REQ clients, message frames) of what a ROUTER received."""
+    split = 2 if len(frames) > 2 and len(_buffer(frames[1])) == 0 else 1
+    return [bytes(_buffer(f)) for f in frames[:split]], frames[split:]
+
+
+def is_binary(parts):
+    return len(parts) > 0 and bytes(_buffer(parts[0])[:len(MAGIC)]) == MAGIC
+
+
+# ------------------------------------------------------------------
+# Encoding
+# ------------------------------------------------------------------
+
+def _pack(value, path, frames, buffers):
+    # Replaces the arrays in value by None, noting their path, dtype and shape
+    if isinstance(value, np.ndarray) and value.dtype.kind in "biufc":
+        value = np.ascontiguousarray(value)
+        frames.append([path, value.dtype.str, list(value.shape)])
+        buffers.append(value)
+        return None
+    if isinstance(value, dict):
+        return {k: _pack(v, path + [k], frames, buffers) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_pack(v, path + [i], frames, buffers) for i, v in enumerate(value)]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def encode(message):
+    """Frames of message, its arrays as raw frames (to send with copy=False)."""
+    frames, buffers = [], []
+    header = {'message': _pack(message, [], frames, buffers), 'frames': frames}
+    return [MAGIC + json.dumps(header, default=str).encode(), *buffers]
+
+
+def _frame_spec(spec):
+    """(path, dtype, shape) of one header frames entry; ValueError if it is not one."""
+    if not isinstance(spec, list) or len(spec) != 3:
+        raise ValueError(f"Frame entry {spec!r} is not [path, dtype, shape]")
+    path, dtype, shape = spec
+    if not isinstance(path, list) or not all(isinstance(key, (str, int)) and not isinstance(key, bool) for key in path):
+        raise ValueError(f"Frame path {path!r} is not a list of keys and indices")
+    if not isinstance(shape, list) or not all(isinstance(n, int) and not isinstance(n, bool) and n >= 0 for n in shape):
+        raise ValueError(f"Frame shape {shape!r} is not a list of sizes")
+    try:
+        dtype = np.dtype(dtype)
+    except TypeError:
+        raise ValueError(f"Frame dtype {dtype!r} is not a dtype") from None
+    if dtype.kind not in "biufc":
+        raise ValueError(f"Arrays of dtype {dtype} are not accepted")
+    return path, dtype, shape
+
+
+def decode(parts):
+    """
+    The message of the frames from encode(), its arrays as views of the frames.
+
+    Raises ValueError for frames that are not a valid encoding.
+    """
+    header = json.loads(bytes(_buffer(parts[0])[len(MAGIC):]))
+    if not isinstance(header, dict) or 'message' not in header or not isinstance(header.get('frames'), list):
+        raise ValueError("Header must be an object with a message and a list of frames")
+    message = header['message']
+    if len(header['frames']) != len(parts) - 1:
+        raise ValueError(f"Header describes {len(header['frames'])} arrays, got {len(parts) - 1} frames")
+    for spec, part in zip(header['frames'], parts[1:]):
+        path, dtype, shape = _frame_spec(spec)
+        data = _buffer(part)
+        if len(data) != dtype.itemsize * int(np.prod(shape)):
+            raise ValueError(f"Frame for {path} has {len(data)} bytes, expected {dtype} of shape {shape}")
+        array = np.frombuffer(data, dtype=dtype).reshape(shape)
+        if not path:
+            message = array
+            continue
+        try:
+            target = message
+            for key in path[:-1]:
+                target = target[key]
+            target[path[-1]] = array
+        except (KeyError, IndexError, TypeError):
+            raise ValueError(f"Frame path {path} is not in the message") from None
+    return message
+
+
+def send(socket, message):
+    socket.send_multipart(encode(message), copy=False)
+
+
+def recv(socket):
+    return decode(socket.recv_multipart(copy=False))
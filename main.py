@@ -1,54 +1,51 @@
-import zmq
-from contextlib import ExitStack
-import traceback
+import json
+import os
 
-from core.Server import handle_tcp
-from core.Registry import register_device, commands, devices
+from core import Discovery, ExperimentLog, Trace
+from core.Pool import pool
+from core.Server import serve
+from core.Registry import commands, devices
 
-from Equipment import SDG6022X, Agilent33600A
+from Equipment import load_driver
 
 
+# Drivers are named, so only the ones configured are imported.
+# An address of None finds the instrument through core.Discovery (cached, probed again only if it moved)
 device_configs = {
-    # 'AG33600A_Gen1' : (Agilent33600A, 'TCPIP::169.254.11.23::INSTR'),
-    'SDG6022X_Gen1' : SDG6022X('TCPIP::169.254.11.24::INSTR'),
+    # 'AG33600A_Gen1' : ('Agilent33600A', None),
+    'SDG6022X_Gen1' : ('SDG6022X', 'TCPIP::169.254.11.24::INSTR'),
 }
 
+# QD_DEVICES='{"SDG6022X_Gen1": ["SDG6022X", "TCPIP::127.0.0.1::5025::SOCKET"]}' to run against another rack or the simulators
+if 'QD_DEVICES' in os.environ:
+    device_configs = {name: tuple(config) for name, config in json.loads(os.environ['QD_DEVICES']).items()}
 
-with ExitStack() as stack:
-    for instrument_name, (instrument_class, addr) in device_configs.items():
-        dev = stack.enter_context(instrument_class(addr))
-        register_device(instrument_name, dev)
+# QD_TRACE=session.jsonl records every command and SCPI message (core.Trace)
+if 'QD_TRACE' in os.environ:
+    Trace.enable(os.environ['QD_TRACE'])
 
-    context = zmq.Context()
-    socket = context.socket(zmq.REP)
-    socket.bind("tcp://*:5555")
-    socket.RCVTIMEO = 1000
+# QD_LOG=runs/today appends command results and LOGPAR rows to a columnar log (core.ExperimentLog)
+if 'QD_LOG' in os.environ:
+    ExperimentLog.enable(os.environ['QD_LOG'])
+
+
+# The pool keeps the sessions open, health checks them while serving and reconnects dropped ones
+with pool:
+    for instrument_name, (driver, addr) in device_configs.items():
+        instrument_class = load_driver(driver)
+        if addr is None:
+            Discovery.acquire(pool, instrument_name, instrument_class)
+        else:
+            pool.acquire(instrument_name, instrument_class, addr)
 
     print(commands)
     print(devices)
 
+    # One worker per device: commands for different instruments run in parallel,
+    # commands for the same instrument keep their order.
+    serve("tcp://*:5555")
+
+Trace.disable()
+ExperimentLog.disable()
 
-    run = True
-    while run:
-        try:
-            message = socket.recv_json()
-            handle_tcp(message)
-            socket.send_string('Completed')
-            
-        except zmq.Again:
-            # print('Waiting for command')
-            continue
-        
-        except KeyboardInterrupt:
-            print('Closing connections')
-            run = False
-            
-        except Exception as e:
-            print(f'Error: {e}')
-            print('Json message leading to eror')
-            print(message)
-            traceback.print_exc()
-            socket.send_string('Failed')
-            run=False
-
-print('Connections closed.')
\ No newline at end of file
+print('Connections closed.')
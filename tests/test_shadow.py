@@ -0,0 +1,89 @@
+import unittest
+
+from Equipment.shadow import ShadowMixin, scpi_filter, siglent_filter
+
+
+class _Instrument:
+    def __init__(self):
+        self.sent = []
+
+    def write(self, msg):
+        self.sent.append(msg)
+
+
+class _A33(ShadowMixin, _Instrument):
+    SHADOW_FILTER = staticmethod(scpi_filter)
+
+    def __init__(self):
+        self._init_shadow()
+        super().__init__()
+
+
+class _SDG(ShadowMixin, _Instrument):
+    SHADOW_FILTER = staticmethod(siglent_filter)
+
+    def __init__(self):
+        self._init_shadow()
+        super().__init__()
+
+
+class ScpiShadowTest(unittest.TestCase):
+    def test_repeated_setting_is_elided(self):
+        a33 = _A33()
+        a33.write(":SOUR1:FREQ 1000")
+        a33.write(":SOUR1:FREQ 1000")
+        self.assertEqual(a33.sent, [":SOUR1:FREQ 1000"])
+
+    def test_load_change_forgets_amplitude_and_offset(self):
+        a33 = _A33()
+        a33.write(":OUTP1:LOAD 50;:SOUR1:VOLT 1;:SOUR1:VOLT:OFFS 0.1;:SOUR1:FREQ 1000")
+        a33.write(":OUTP1:LOAD 1e+06")
+        a33.write(":SOUR1:VOLT 1;:SOUR1:VOLT:OFFS 0.1;:SOUR1:FREQ 1000")
+        self.assertEqual(a33.sent[-1], ":SOUR1:VOLT 1;:SOUR1:VOLT:OFFS 0.1")
+
+    def test_load_change_after_amplitude_in_one_message(self):
+        a33 = _A33()
+        a33.write(":OUTP1:LOAD 50")
+        a33.write(":SOUR1:VOLT 1;:OUTP1:LOAD 1e+06")
+        a33.write(":SOUR1:VOLT 1")
+        self.assertEqual(a33.sent[-1], ":SOUR1:VOLT 1")
+
+    def test_load_change_keeps_other_channel(self):
+        a33 = _A33()
+        a33.write(":OUTP1:LOAD 50;:SOUR1:VOLT 1;:SOUR2:VOLT 1")
+        a33.write(":OUTP1:LOAD 1e+06")
+        a33.write(":SOUR2:VOLT 1")
+        self.assertEqual(len(a33.sent), 2)
+
+
+class SiglentShadowTest(unittest.TestCase):
+    def test_load_change_forgets_amplitude_and_offset(self):
+        sdg = _SDG()
+        sdg.write("C1:OUTP LOAD,50;C1:BSWV WVTP,SINE,FRQ,1000,AMP,1,OFST,0.1")
+        sdg.write("C1:OUTP LOAD,HZ")
+        sdg.write("C1:BSWV WVTP,SINE,FRQ,1000,AMP,1,OFST,0.1")
+        self.assertEqual(sdg.sent[-1], "C1:BSWV AMP,1,OFST,0.1")
+
+    def test_unchanged_load_keeps_amplitude(self):
+        sdg = _SDG()
+        sdg.write("C1:OUTP LOAD,50;C1:BSWV AMP,1")
+        sdg.write("C1:OUTP LOAD,50;C1:BSWV AMP,1")
+        self.assertEqual(len(sdg.sent), 1)
+
+    def test_arbitrary_waveform_forgets_basic_wave(self):
+        sdg = _SDG()
+        sdg.write("C1:BSWV WVTP,SINE,FRQ,1000")
+        sdg.write("C1:ARWV INDEX,2")
+        sdg.write("C1:BSWV WVTP,SINE,FRQ,1000")
+        self.assertEqual(sdg.sent[-1], "C1:BSWV WVTP,SINE,FRQ,1000")
+
+    def test_front_panel_keys_forget_everything(self):
+        sdg = _SDG()
+        sdg.write("C1:BSWV FRQ,1000;C2:OUTP ON")
+        sdg.write("VKEY VALUE,18,STATE,1")
+        sdg.write("C1:BSWV FRQ,1000;C2:OUTP ON")
+        self.assertEqual(sdg.sent[-1], "C1:BSWV FRQ,1000;C2:OUTP ON")
+
+
+if __name__ == "__main__":
+    unittest.main()